@@ -0,0 +1,130 @@
+"""
+This module persists the daily case duration aggregates used by count_anomaly_by_case_duration_mad.py
+so that fresh 311 data can be added incrementally instead of re-reading the full history.
+
+The state holds:
+    - the DailyMatrix of daily total case durations and request counts for every type,
+    - the Case ID watermark: the highest Case ID already ingested,
+    - the Case IDs of service requests that were still open (no Closed Date) when last ingested.
+
+New data is ingested by keeping only the rows above the watermark and the rows of previously open
+cases; rows without a Case ID cannot be placed relative to the watermark and are only counted when
+the state is built from the full history. Cases that have closed since the last run are added to
+the day they were opened on, and cases that are still open are remembered for the next run.
+
+The state is saved as a compressed NPZ file ('./output/anomaly_state.npz' by default).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from daily_matrix import DailyMatrix
+
+STATE_FILE = "./output/anomaly_state.npz"
+STATE_COLUMNS = ["Case ID", "Subject", "Type", "Open Date", "Closed Date"]
+
+
+def case_durations(df):
+    """
+    Select the service requests of df with both dates and a positive case duration, sorted by open
+    date, with their duration in a "Case Duration (hours)" column.
+    """
+    # Drop any rows that don't have either an Open or Closed date
+    df = df.dropna(subset=["Open Date", "Closed Date"])
+    df = df[df["Subject"] == "Service Request"]
+    df = df.sort_values(by="Open Date", ascending=True)
+
+    df = df.assign(
+        **{
+            "Case Duration (hours)": (
+                df["Closed Date"] - df["Open Date"]
+            ).dt.total_seconds() / 3600
+        }
+    )
+    return df[df["Case Duration (hours)"] > 0]
+
+
+def _open_case_ids(df):
+    """Return the Case IDs of the service requests in df that have been opened but not closed."""
+    open_cases = (
+        (df["Subject"] == "Service Request")
+        & df["Open Date"].notna()
+        & df["Closed Date"].isna()
+    )
+    return np.unique(df.loc[open_cases, "Case ID"].dropna().to_numpy(dtype=np.int64))
+
+
+def _max_case_id(df):
+    """Return the highest Case ID in df, or -1 if it has no Case IDs (none are below -1)."""
+    case_id = df["Case ID"].max()
+    return -1 if pd.isna(case_id) else int(case_id)
+
+
+class AnomalyState:
+    """Daily aggregates and ingestion watermarks persisted between runs of the anomaly counter."""
+
+    def __init__(self, daily, watermark, open_case_ids):
+        self.daily = daily
+        self.watermark = watermark
+        self.open_case_ids = open_case_ids
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build the state from the full history, given as a DataFrame with STATE_COLUMNS."""
+        durations = case_durations(df)
+        daily = DailyMatrix.from_frame(durations, value_column="Case Duration (hours)")
+        watermark = _max_case_id(df)
+        return cls(daily, watermark, _open_case_ids(df))
+
+    def update(self, df):
+        """
+        Ingest new data from df (a full export or only the latest rows), given as a DataFrame with
+        STATE_COLUMNS. Returns the earliest day whose totals changed, or None if nothing changed.
+        """
+        # Case IDs are nullable; missing ones are never above the watermark nor open
+        case_ids = df["Case ID"].to_numpy(dtype=np.int64, na_value=-1)
+        is_new = case_ids > self.watermark
+        was_open = np.isin(case_ids, self.open_case_ids)
+        df = df[is_new | was_open]
+        if df.empty:
+            return None
+
+        # Previously open cases that are no longer open are either closed now or no longer valid
+        updated_ids = df.loc[was_open[is_new | was_open], "Case ID"].to_numpy(dtype=np.int64)
+        still_open = np.setdiff1d(self.open_case_ids, updated_ids)
+        self.open_case_ids = np.union1d(still_open, _open_case_ids(df))
+        self.watermark = max(self.watermark, _max_case_id(df))
+
+        durations = case_durations(df)
+        if durations.empty:
+            return None
+        self.daily = self.daily.merge(
+            DailyMatrix.from_frame(durations, value_column="Case Duration (hours)")
+        )
+        return durations["Open Date"].min().floor("D")
+
+    def save(self, path=STATE_FILE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # np.savez appends .npz to names without it, so write through a file handle instead
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                first_day=np.datetime64(self.daily.days[0], "D"),
+                types=np.array(self.daily.types, dtype=str),
+                counts=self.daily.counts,
+                sums=self.daily.sums,
+                watermark=self.watermark,
+                open_case_ids=self.open_case_ids,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=STATE_FILE):
+        with np.load(path) as data:
+            counts = data["counts"]
+            days = pd.date_range(
+                start=pd.Timestamp(data["first_day"].item()), periods=len(counts), freq="D"
+            )
+            daily = DailyMatrix(days, pd.Index(data["types"]), counts, data["sums"])
+            return cls(daily, int(data["watermark"]), data["open_case_ids"])
@@ -0,0 +1,245 @@
+"""
+This script derives association rules, such as "Hood_N -> Type_T", from the frequent itemsets
+found by FP-Growth (SPMF or fpgrowth.py), with their confidence and lift.
+
+The supports of all itemsets are loaded into a dictionary keyed by itemset, so the support of any
+antecedent or consequent is a single lookup. For every itemset of two or more items, each split
+into an antecedent and a consequent is considered:
+    confidence = support(itemset) / support(antecedent)
+    lift = confidence / (support(consequent) / number of transactions)
+and rules below the minimum confidence or lift are discarded. Rules are kept in compact arrays
+(the itemset of each rule and a bitmask of its antecedent items) until they are sorted and written,
+so millions of rules fit in memory.
+
+Rules can be restricted to antecedents and consequents made of items of given categories, using
+the suffix of each item: R (Reason), T (Type), N (Neighbourhood) and W (Ward). An itemset with an
+item allowed on neither side is skipped before any split is considered.
+
+The number of transactions is counted from the formatted dataset written by format.py.
+
+Usage:
+    python association_rules.py <keys.txt> <results.txt> [--transactions FORMATTED_DATA]
+        [--min-confidence C] [--min-lift L]
+        [--antecedent RTNW] [--consequent RTNW]
+
+    e.g. rules from a neighbourhood to a request type:
+        python association_rules.py output/keys.txt output/results.txt --antecedent N --consequent T
+
+Output:
+    './output/association_rules.csv', sorted by decreasing lift
+"""
+
+import argparse
+import csv
+import os
+from array import array
+from itertools import combinations
+import numpy as np
+from format_results import item_sort_order, parse_keys
+from fpgrowth import read_patterns
+from instrument import add_arguments, configure, run, stage
+from pattern_store import CATEGORY_BITS, category_mask, item_category
+
+TRANSACTIONS_FILE = "./output/formatted_data.txt"
+OUTPUT_FILE = "./output/association_rules.csv"
+WRITE_BLOCK_SIZE = 100_000
+
+
+def count_transactions(formatted_txt):
+    """Count the transactions (lines) of a formatted dataset."""
+    n_transactions = 0
+    with open(formatted_txt, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            n_transactions += block.count(b"\n")
+    return n_transactions
+
+
+def generate_rules(
+    supports,
+    item_categories,
+    n_transactions,
+    min_confidence=0.0,
+    min_lift=0.0,
+    antecedent_categories=None,
+    consequent_categories=None,
+):
+    """
+    Derive association rules from a dictionary mapping itemsets (frozensets of item numbers) to
+    their support. item_categories maps item numbers to category bits, and antecedent_categories
+    and consequent_categories are the bitmasks of the categories allowed on each side of a rule
+    (any category if None).
+
+    Rules are returned in compact arrays rather than as sets, as there can be many more rules than
+    itemsets. Returns (itemsets, rules): itemsets is a list of the item tuples of the itemsets with
+    rules, and rules a dictionary of arrays with, for every rule:
+        - "itemset": the index of its itemset in itemsets,
+        - "antecedent": a bitmask of the positions of the antecedent items within the itemset (the
+          other items are the consequent),
+        - "support", "confidence" and "lift".
+    """
+    all_categories = category_mask("".join(CATEGORY_BITS))
+    if antecedent_categories is None:
+        antecedent_categories = all_categories
+    if consequent_categories is None:
+        consequent_categories = all_categories
+
+    itemsets = []
+    rule_itemsets, rule_antecedents = array("q"), array("q")
+    rule_supports, confidences, lifts = array("q"), array("d"), array("d")
+
+    for itemset, support in supports.items():
+        if len(itemset) < 2:
+            continue
+
+        # Items that can only go on one side of a rule are placed there up front, as bitmasks of
+        # their positions in the itemset
+        items = tuple(itemset)
+        fixed_antecedent, either = 0, []
+        for position, item in enumerate(items):
+            category = item_categories.get(item, 0)
+            in_antecedent = bool(category & antecedent_categories)
+            in_consequent = bool(category & consequent_categories)
+            if in_antecedent and in_consequent:
+                either.append(1 << position)
+            elif in_antecedent:
+                fixed_antecedent |= 1 << position
+            elif not in_consequent:
+                break
+        else:
+            # The antecedent must be frequent enough for the rule to reach min_confidence
+            max_antecedent_support = (
+                support / min_confidence if min_confidence > 0 else float("inf")
+            )
+            full = (1 << len(items)) - 1
+            index = len(itemsets)
+            for size in range(len(either) + 1):
+                for chosen in combinations(either, size):
+                    antecedent = fixed_antecedent | sum(chosen)
+                    if antecedent == 0 or antecedent == full:
+                        continue
+                    antecedent_support = supports.get(
+                        frozenset(item for i, item in enumerate(items) if antecedent >> i & 1)
+                    )
+                    if antecedent_support is None or antecedent_support > max_antecedent_support:
+                        continue
+                    consequent_support = supports.get(
+                        frozenset(item for i, item in enumerate(items) if not antecedent >> i & 1)
+                    )
+                    if consequent_support is None:
+                        continue
+                    confidence = support / antecedent_support
+                    lift = confidence * n_transactions / consequent_support
+                    if lift < min_lift:
+                        continue
+                    rule_itemsets.append(index)
+                    rule_antecedents.append(antecedent)
+                    rule_supports.append(support)
+                    confidences.append(confidence)
+                    lifts.append(lift)
+            if len(rule_itemsets) and rule_itemsets[-1] == index:
+                itemsets.append(items)
+
+    rules = {
+        "itemset": np.frombuffer(rule_itemsets, dtype=np.int64),
+        "antecedent": np.frombuffer(rule_antecedents, dtype=np.int64),
+        "support": np.frombuffer(rule_supports, dtype=np.int64),
+        "confidence": np.frombuffer(confidences, dtype=np.float64),
+        "lift": np.frombuffer(lifts, dtype=np.float64),
+    }
+    return itemsets, rules
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Derive association rules with confidence and lift from frequent itemsets."
+    )
+    parser.add_argument("keys_txt", help="Keys file mapping item numbers to names")
+    parser.add_argument("results_txt", help="Frequent itemsets found by SPMF or fpgrowth.py")
+    parser.add_argument(
+        "--transactions",
+        default=TRANSACTIONS_FILE,
+        help="Formatted dataset the itemsets were mined from, to count the transactions",
+    )
+    parser.add_argument(
+        "--min-confidence", type=float, default=0.5, help="Minimum confidence of a rule"
+    )
+    parser.add_argument("--min-lift", type=float, default=0.0, help="Minimum lift of a rule")
+    parser.add_argument(
+        "--antecedent", default="RTNW", help="Categories allowed in the antecedent, e.g. N"
+    )
+    parser.add_argument(
+        "--consequent", default="RTNW", help="Categories allowed in the consequent, e.g. T"
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+
+    print("Reading frequent itemsets...")
+    with stage("read"):
+        keys = parse_keys(args.keys_txt)
+        supports = read_patterns(args.results_txt)
+        n_transactions = count_transactions(args.transactions)
+    item_categories = {item: item_category(name) for item, name in keys.items()}
+    print(f"Read {len(supports)} itemsets over {n_transactions} transactions.")
+
+    print("Generating rules...")
+    with stage("generate"):
+        itemsets, rules = generate_rules(
+            supports,
+            item_categories,
+            n_transactions,
+            min_confidence=args.min_confidence,
+            min_lift=args.min_lift,
+            antecedent_categories=category_mask(args.antecedent),
+            consequent_categories=category_mask(args.consequent),
+        )
+    del supports
+    with stage("sort"):
+        # Sort by decreasing lift, then confidence, then support
+        order = np.lexsort((-rules["support"], -rules["confidence"], -rules["lift"]))
+
+    # Antecedents and consequents recur across many rules, so each is named once
+    names_cache = {}
+
+    def item_names(items):
+        items = tuple(items)
+        names = names_cache.get(items)
+        if names is None:
+            sorted_names = sorted(
+                (keys[item] for item in items),
+                key=lambda name: (item_sort_order.get(name[-2:], len(item_sort_order)), name),
+            )
+            names = names_cache[items] = ", ".join(sorted_names)
+        return names
+
+    def rows():
+        # Rules are converted to Python values a block at a time to bound memory
+        for block_start in range(0, len(order), WRITE_BLOCK_SIZE):
+            block = order[block_start : block_start + WRITE_BLOCK_SIZE]
+            for index, antecedent, support, confidence, lift in zip(
+                rules["itemset"][block].tolist(),
+                rules["antecedent"][block].tolist(),
+                rules["support"][block].tolist(),
+                rules["confidence"][block].round(4).tolist(),
+                rules["lift"][block].round(4).tolist(),
+            ):
+                items = itemsets[index]
+                yield [
+                    item_names(item for i, item in enumerate(items) if antecedent >> i & 1),
+                    item_names(item for i, item in enumerate(items) if not antecedent >> i & 1),
+                    support,
+                    confidence,
+                    lift,
+                ]
+
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    with stage("write"), open(OUTPUT_FILE, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Antecedent", "Consequent", "Support", "Confidence", "Lift"])
+        writer.writerows(rows())
+    print(f"Saved {len(order)} rules to {OUTPUT_FILE}")
+
+
+if __name__ == "__main__":
+    with run():
+        main()
@@ -0,0 +1,288 @@
+"""
+This script benchmarks the main steps of the pipeline on synthetic 311 datasets of increasing size
+(100k, 1M and 10M rows by default), generated by synthetic_311.py.
+
+For every dataset size, the steps below are run in order as separate processes, in a fresh working
+directory, exactly as they are run from the command line:
+    - clean: clean_for_fp.py
+    - format: format.py, mining the frequent patterns at --minsup
+    - cache: ingest.py, building the columnar cache read by the next steps
+    - anomaly_mad: count_anomaly_by_case_duration_mad.py
+    - anomaly_isolation_forest: count_anomaly_by_case_duration_isolation_forest.py
+    - heatmap: create_request_heat_map.py
+
+The wall time, throughput (dataset rows per second), CPU time and peak memory of every step are
+read from the timing report it saves (see instrument.py; reports are enabled for every step through
+the INSTRUMENT_REPORT environment variable), along with the times of its stages. Results are
+saved to './output/benchmark_results.json', keyed by the git commit of the scripts (with a "-dirty"
+suffix when they have uncommitted changes), so runs of different commits can be compared. The
+generated datasets are kept in './output/benchmark_data' and reused by later runs.
+
+Usage:
+    python benchmark.py [--sizes 100k 1M 10M] [--steps STEP ...] [--minsup M] [--seed S]
+        [--compare COMMIT]
+
+    --compare prints the wall time and peak memory of every step relative to the saved results
+    of another commit (or a prefix of it).
+"""
+
+import argparse
+import copy
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from instrument import REPORT_ENV, git_commit
+from synthetic_311 import generate_dataset, row_count
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = "./output/benchmark_data"
+RESULTS_FILE = "./output/benchmark_results.json"
+DEFAULT_SIZES = ["100k", "1M", "10M"]
+DEFAULT_MINSUP = 0.005
+
+# (step, script, arguments); {csv} is replaced with the dataset and {minsup} with --minsup
+STEPS = [
+    ("clean", "clean_for_fp.py", ["{csv}"]),
+    ("format", "format.py", ["./output/cleaned_311_dataset.csv", "--minsup", "{minsup}"]),
+    ("cache", "ingest.py", ["{csv}"]),
+    ("anomaly_mad", "count_anomaly_by_case_duration_mad.py", ["{csv}"]),
+    ("anomaly_isolation_forest", "count_anomaly_by_case_duration_isolation_forest.py", ["{csv}"]),
+    ("heatmap", "create_request_heat_map.py", ["{csv}"]),
+]
+
+
+def is_dirty():
+    """Return whether the scripts have uncommitted changes."""
+    try:
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=SCRIPTS_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return bool(status.strip())
+
+
+def dataset_path(n_rows, seed, data_dir=DATA_DIR):
+    """Return the path of the synthetic dataset of n_rows rows, generating it if needed."""
+    path = os.path.join(data_dir, f"synthetic_311_{n_rows}_seed{seed}.csv")
+    if not os.path.exists(path):
+        print(f"Generating {n_rows:,} rows to {path}...")
+        generate_dataset(path, n_rows, seed=seed)
+    return path
+
+
+def latest_report(workdir, script):
+    """Return the latest timing report saved by script in workdir, or None."""
+    name = os.path.splitext(script)[0]
+    reports = glob.glob(os.path.join(workdir, "output", "reports", f"{name}-*.json"))
+    if not reports:
+        return None
+    with open(max(reports, key=os.path.getmtime), "r") as f:
+        return json.load(f)
+
+
+def round_mb(value):
+    """Round a memory size in MB, keeping None for peaks that could not be measured."""
+    return None if value is None else round(value, 1)
+
+
+def format_mb(value):
+    return "n/a" if value is None else f"{value:,.0f} MB"
+
+
+def run_step(workdir, script, args, n_rows, log_file):
+    """Run a step's script in workdir and return its measurements."""
+    command = [sys.executable, os.path.join(SCRIPTS_DIR, script)] + args
+    start = time.perf_counter()
+    with open(log_file, "w") as log:
+        process = subprocess.Popen(
+            command,
+            cwd=workdir,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, REPORT_ENV: "1"},
+        )
+        if hasattr(os, "wait4"):
+            # Waited for with wait4 to get the resource usage of this process alone
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        else:
+            # wait4 is POSIX-only; elsewhere the peak memory comes from the report alone
+            process.wait()
+            usage = None
+    wall = time.perf_counter() - start
+
+    result = {"wall_s": round(wall, 3), "rows_per_s": round(n_rows / wall)}
+    if process.returncode != 0:
+        with open(log_file, "r") as log:
+            result["error"] = log.read()[-2000:]
+        return result
+
+    report = latest_report(workdir, script)
+    if report is None:
+        # ru_maxrss is in kilobytes on Linux
+        result["peak_rss_mb"] = None if usage is None else round(usage.ru_maxrss / 1024, 1)
+        return result
+    # The report's peak is used rather than the process's ru_maxrss, which the report's per-stage
+    # peak measurements reset
+    total = report["total"]
+    result["cpu_s"] = round(total["cpu_s"] + total["child_cpu_s"], 3)
+    # Peaks are None where the report could not measure them
+    result["peak_rss_mb"] = round_mb(total["peak_rss_mb"])
+    result["stages"] = {
+        path: {"wall_s": stage["wall_s"], "peak_rss_mb": round_mb(stage["peak_rss_mb"])}
+        for path, stage in report["stages"].items()
+    }
+    return result
+
+
+def run_benchmark(dataset_csv, n_rows, steps, minsup):
+    """Run the given steps on a dataset in a fresh working directory. Returns their results."""
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as workdir:
+        os.makedirs(os.path.join(workdir, "output"))
+        values = {"csv": os.path.abspath(dataset_csv), "minsup": str(minsup)}
+        for step, script, args in STEPS:
+            if step not in steps:
+                continue
+            print(f"  {step}...", end="", flush=True)
+            result = run_step(
+                workdir,
+                script,
+                [arg.format(**values) for arg in args],
+                n_rows,
+                os.path.join(workdir, f"{step}.log"),
+            )
+            results[step] = result
+            if "error" in result:
+                print(f" failed:\n{result['error']}")
+                # Later steps may depend on this step's output
+                break
+            print(
+                f" {result['wall_s']:.1f}s, {result['rows_per_s']:,} rows/s, "
+                f"{format_mb(result['peak_rss_mb'])}"
+            )
+    return results
+
+
+def load_results(path=RESULTS_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_results(results, path=RESULTS_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def find_results(results, commit):
+    """Return the saved results of the commit starting with commit, or None."""
+    matches = [key for key in results if key.startswith(commit)]
+    if len(matches) > 1:
+        sys.exit(f"Commit {commit} matches several saved results: {', '.join(matches)}")
+    return results[matches[0]] if matches else None
+
+
+def print_comparison(current, baseline, sizes):
+    """
+    Print the wall time and peak memory of every step run on the given dataset sizes, relative to
+    the baseline results.
+    """
+    print(f"\nCompared with {baseline['commit']} (ratios below 1 are improvements):")
+    print(f"{'Rows':>12}  {'Step':<26}{'Wall time':>12}{'Peak memory':>14}")
+    for size in map(str, sizes):
+        baseline_steps = baseline["sizes"].get(size, {}).get("steps", {})
+        for step, result in current["sizes"][size]["steps"].items():
+            reference = baseline_steps.get(step)
+            if reference is None or "error" in reference or "error" in result:
+                continue
+            wall = result["wall_s"] / reference["wall_s"]
+            if result["peak_rss_mb"] is None or reference["peak_rss_mb"] is None:
+                memory = f"{'n/a':>14}"
+            else:
+                memory = f"{result['peak_rss_mb'] / reference['peak_rss_mb']:>13.2f}x"
+            print(f"{int(size):>12,}  {step:<26}{wall:>11.2f}x{memory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline's scripts on synthetic 311 datasets."
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=row_count,
+        default=[row_count(size) for size in DEFAULT_SIZES],
+        help="Dataset sizes in rows, e.g. 100k 1M 10M",
+    )
+    parser.add_argument(
+        "--steps",
+        nargs="+",
+        choices=[step for step, _, _ in STEPS],
+        default=[step for step, _, _ in STEPS],
+        help="Steps to run (later steps may need the output of earlier ones)",
+    )
+    parser.add_argument(
+        "--minsup", type=float, default=DEFAULT_MINSUP, help="Minsup of the format step"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic datasets")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory of the datasets")
+    parser.add_argument("--results", default=RESULTS_FILE, help="File the results are saved to")
+    parser.add_argument(
+        "--compare", metavar="COMMIT", help="Compare with the saved results of a commit"
+    )
+    args = parser.parse_args()
+
+    commit = git_commit() or "unknown"
+    key = commit + ("-dirty" if is_dirty() else "")
+    results = load_results(args.results)
+    baseline = None
+    if args.compare:
+        baseline = find_results(results, args.compare)
+        if baseline is None:
+            sys.exit(f"No saved results for commit {args.compare} in {args.results}")
+        # The results of the current commit are updated in place by this run
+        baseline = copy.deepcopy(baseline)
+
+    current = results.get(key) or {"commit": key, "sizes": {}}
+    current.update(
+        {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        }
+    )
+    for n_rows in args.sizes:
+        dataset_csv = dataset_path(n_rows, args.seed, args.data_dir)
+        print(f"Benchmarking {n_rows:,} rows...")
+        steps = run_benchmark(dataset_csv, n_rows, args.steps, args.minsup)
+        size = current["sizes"].setdefault(str(n_rows), {"seed": args.seed, "steps": {}})
+        size["seed"] = args.seed
+        size["minsup"] = args.minsup
+        size["steps"].update(steps)
+        results[key] = current
+        # Saved after every size, so the results of a long run are kept if it is interrupted
+        save_results(results, args.results)
+    print(f"Results of {key} saved to {args.results}")
+
+    if baseline is not None:
+        print_comparison(current, baseline, args.sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,27 @@
+"""
+This script cleans a 311 dataset for anomaly detection, keeping only the Open Date of every
+service request that has one.
+
+The file is processed in a single streaming pass by the engine in cleaning.py. To produce this
+output together with the frequent pattern output in the same pass, run `python cleaning.py`.
+
+Usage:
+    python clean_for_anomaly.py <input_csv_file>
+
+Output:
+    A cleaned CSV file is saved to './output/311_cleaned_for_anomaly.csv'.
+"""
+
 import sys
-import csv
+from cleaning import ANOMALY_OUTPUT, clean_dataset
+from instrument import run
 
 def main():
     args = sys.argv[1:]
     csv_file = args[0]
-    output_file = "./output/311_cleaned_for_anomaly.csv"
-
-    with open(csv_file, mode="r", newline="") as infile, open(
-        output_file, mode="w", newline=""
-    ) as outfile:
-        reader = csv.DictReader(infile)
-        fieldnames = ["Open Date"]
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        writer.writeheader()
-
-        row_count = sum(1 for row in reader)
-        infile.seek(0)
-        next(reader)
 
-        for i, row in enumerate(reader, start=1):
-            if row["Subject"] == "Service Request" and row["Open Date"]:
-                writer.writerow({
-                    "Open Date": row["Open Date"],
-                })
-            print(f"Processing row {i}/{row_count}")
+    clean_dataset(csv_file, anomaly_output=ANOMALY_OUTPUT)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with run():
+        main()
@@ -14,39 +14,23 @@ and Ward "_W"
 Usage:
     python clean_for_fp.py <input_csv_file>
 
+The file is processed in a single streaming pass by the engine in cleaning.py. To produce this
+output together with the anomaly detection output in the same pass, run `python cleaning.py`.
+
 Output:
     A cleaned CSV file is saved to './output/cleaned_311_dataset.csv'.
 """
 
 import sys
-import csv
+from cleaning import FP_OUTPUT, clean_dataset
+from instrument import run
 
 def main():
     args = sys.argv[1:]
     csv_file = args[0]
-    output_file = "./output/cleaned_311_dataset.csv"
-
-    with open(csv_file, mode="r", newline="") as infile, open(
-        output_file, mode="w", newline=""
-    ) as outfile:
-        reader = csv.DictReader(infile)
-        fieldnames = ["Reason", "Type", "Neighbourhood", "Ward"]
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        writer.writeheader()
-
-        row_count = sum(1 for row in reader)
-        infile.seek(0)
-        next(reader)
-
-        for i, row in enumerate(reader, start=1):
-            if row["Subject"] == "Service Request" and row["Neighbourhood"]:
-                writer.writerow({
-                    "Reason": row["Reason"] + "_R",
-                    "Type": row["Type"] + "_T",
-                    "Neighbourhood": row["Neighbourhood"] + "_N",
-                    "Ward": row["Ward"] + "_W"
-                })
-            print(f"Processing row {i}/{row_count}")
+
+    clean_dataset(csv_file, fp_output=FP_OUTPUT)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with run():
+        main()
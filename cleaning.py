@@ -0,0 +1,185 @@
+"""
+This module implements the streaming cleaning pipeline used to prepare the 311 dataset for the
+frequent pattern mining and anomaly detection steps.
+
+The input CSV file is read once, in large chunks. Each chunk is filtered and transformed with
+vectorised operations and appended to the requested outputs in a single write per chunk, so both
+the FP output and the anomaly output can be produced in the same pass over the file. Progress is
+reported by the number of bytes processed, at most a few times per second.
+
+FP output ('./output/cleaned_311_dataset.csv'):
+    Service requests with a neighbourhood value, keeping only the Reason, Type, Neighbourhood and
+    Ward columns, suffixed with "_R", "_T", "_N" and "_W" respectively.
+
+Anomaly output ('./output/311_cleaned_for_anomaly.csv'):
+    The Open Date of every service request that has one.
+
+Usage:
+    python cleaning.py <input_csv_file> [--fp] [--anomaly]
+
+    Produces the FP output and/or the anomaly output; both are produced when neither flag is given.
+"""
+
+import argparse
+import os
+import time
+import pandas as pd
+from instrument import add_arguments, configure, run, stage
+
+FP_OUTPUT = "./output/cleaned_311_dataset.csv"
+ANOMALY_OUTPUT = "./output/311_cleaned_for_anomaly.csv"
+
+FP_COLUMNS = ["Reason", "Type", "Neighbourhood", "Ward"]
+FP_SUFFIXES = {"Reason": "_R", "Type": "_T", "Neighbourhood": "_N", "Ward": "_W"}
+ANOMALY_COLUMNS = ["Open Date"]
+
+CHUNK_SIZE = 500_000
+PROGRESS_INTERVAL = 0.5  # seconds between progress updates
+WRITE_BUFFER_SIZE = 1 << 20
+LINE_TERMINATOR = "\r\n"  # matches the csv module's default dialect
+
+
+class ProgressReporter:
+    """Reports progress through a file by bytes processed, throttled to one update per interval."""
+
+    def __init__(self, total_bytes, interval=PROGRESS_INTERVAL):
+        self.total_bytes = max(total_bytes, 1)
+        self.interval = interval
+        self.last_report = 0.0
+
+    def update(self, bytes_processed, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        percent = min(100.0, 100.0 * bytes_processed / self.total_bytes)
+        print(
+            f"\rProcessed {bytes_processed / 1e6:,.1f} / {self.total_bytes / 1e6:,.1f} MB "
+            f"({percent:.1f}%)",
+            end="",
+            flush=True,
+        )
+
+    def finish(self):
+        self.update(self.total_bytes, force=True)
+        print()
+
+
+def clean_fp_chunk(chunk):
+    """Select service requests with a neighbourhood and suffix each field with its column type."""
+    mask = (chunk["Subject"] == "Service Request") & (chunk["Neighbourhood"] != "")
+    selected = chunk.loc[mask, FP_COLUMNS]
+    return pd.DataFrame(
+        {column: selected[column] + FP_SUFFIXES[column] for column in FP_COLUMNS}
+    )
+
+
+def clean_anomaly_chunk(chunk):
+    """Select the open date of every service request that has one."""
+    mask = (chunk["Subject"] == "Service Request") & (chunk["Open Date"] != "")
+    return chunk.loc[mask, ANOMALY_COLUMNS]
+
+
+def _write_chunk(df, outfile):
+    df.to_csv(outfile, header=False, index=False, lineterminator=LINE_TERMINATOR)
+
+
+def clean_dataset(csv_file, fp_output=None, anomaly_output=None, chunksize=CHUNK_SIZE):
+    """
+    Clean csv_file in a single streaming pass, writing the FP output to fp_output and the anomaly
+    output to anomaly_output. Either output may be None to skip it. Returns the number of rows
+    written to each output as a (fp_rows, anomaly_rows) tuple.
+    """
+    if fp_output is None and anomaly_output is None:
+        raise ValueError("At least one of fp_output and anomaly_output must be given.")
+
+    usecols = {"Subject"}
+    if fp_output is not None:
+        usecols.update(FP_COLUMNS)
+    if anomaly_output is not None:
+        usecols.update(ANOMALY_COLUMNS)
+
+    outputs = []
+    for path, columns in ((fp_output, FP_COLUMNS), (anomaly_output, ANOMALY_COLUMNS)):
+        if path is None:
+            outputs.append(None)
+            continue
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        outfile = open(path, mode="w", newline="", buffering=WRITE_BUFFER_SIZE)
+        outfile.write(",".join(columns) + LINE_TERMINATOR)
+        outputs.append(outfile)
+    fp_file, anomaly_file = outputs
+
+    fp_rows = 0
+    anomaly_rows = 0
+    progress = ProgressReporter(os.path.getsize(csv_file))
+    try:
+        with open(csv_file, mode="rb") as infile:
+            # Read every field as a plain string, so empty values stay empty instead of NaN
+            reader = pd.read_csv(
+                infile,
+                usecols=sorted(usecols),
+                dtype=str,
+                keep_default_na=False,
+                chunksize=chunksize,
+            )
+            chunks = iter(reader)
+            while True:
+                with stage("read"):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                chunk = chunk.fillna("")
+                if fp_file is not None:
+                    with stage("filter"):
+                        cleaned = clean_fp_chunk(chunk)
+                    with stage("write"):
+                        _write_chunk(cleaned, fp_file)
+                    fp_rows += len(cleaned)
+                if anomaly_file is not None:
+                    with stage("filter"):
+                        cleaned = clean_anomaly_chunk(chunk)
+                    with stage("write"):
+                        _write_chunk(cleaned, anomaly_file)
+                    anomaly_rows += len(cleaned)
+                progress.update(infile.tell())
+        progress.finish()
+    finally:
+        for outfile in outputs:
+            if outfile is not None:
+                outfile.close()
+
+    return fp_rows, anomaly_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Clean the 311 dataset for frequent pattern mining and anomaly detection."
+    )
+    parser.add_argument("csv_file", help="Path to the 311 dataset CSV file")
+    parser.add_argument("--fp", action="store_true", help=f"Write the FP output to {FP_OUTPUT}")
+    parser.add_argument(
+        "--anomaly", action="store_true", help=f"Write the anomaly output to {ANOMALY_OUTPUT}"
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+
+    # Produce both outputs by default
+    write_fp = args.fp or not args.anomaly
+    write_anomaly = args.anomaly or not args.fp
+
+    fp_rows, anomaly_rows = clean_dataset(
+        args.csv_file,
+        fp_output=FP_OUTPUT if write_fp else None,
+        anomaly_output=ANOMALY_OUTPUT if write_anomaly else None,
+    )
+    if write_fp:
+        print(f"Saved {fp_rows} rows to {FP_OUTPUT}")
+    if write_anomaly:
+        print(f"Saved {anomaly_rows} rows to {ANOMALY_OUTPUT}")
+
+
+if __name__ == "__main__":
+    with run():
+        main()
@@ -1,21 +1,201 @@
+"""
+This script counts, for every service request type, the number of days with an abnormally high
+daily total case duration. Each type's daily total case durations are decomposed into trend,
+seasonal and residual components, and an Isolation Forest is applied to the positive residuals
+(abnormally long durations).
+
+The forests of all types are fitted in parallel with joblib (--n-jobs), and the number of days
+each tree is fitted on can be bounded with --max-samples ("auto" by default: at most 256).
+
+Fitted forests are saved in './output/isolation_forest_models', one compressed file per request
+type, with an index of the data version each was fitted on (a hash of the type's daily totals) and
+its fitting parameters. On later runs, a type's saved forest is used to score its days without
+refitting when its daily totals are unchanged, or when new days have only been appended to them
+(e.g. after a fresh data pull). Only the forests of types that were fitted again are rewritten,
+and the forests of types that no longer appear are removed.
+
+A reused forest scores the residuals of the new decomposition of the longer series, which is not
+exactly what it was fitted on: the new days change the seasonal component of every earlier day,
+and the trend of the last half period before them, so the forest's learned threshold drifts from
+those residuals and the anomaly counts can differ from a fresh fit. On a synthetic dataset of 3
+years, reusing forests fitted without the last 1%, 2% and 5% of the days counted 3%, 7% and 19%
+more anomalous days in total than refitting them. To bound the drift, forests are only reused while
+the days they were fitted on make up at least MIN_FITTED_SHARE (98%) of the series; use --refit
+for counts that match a fresh fit exactly. Forests are also refitted when a type's earlier daily
+totals have changed or when the fitting parameters differ. The timings file lists, for every
+type, the data version scored and the data version its forest was fitted on.
+
+Usage:
+    python count_anomaly_by_case_duration_isolation_forest.py <311_request_dataset.csv>
+        [--n-jobs N] [--max-samples auto|N|F] [--refit] [--no-cache]
+
+Output:
+    './output/anomaly_count.csv' - The anomaly counts for each request type
+    './output/isolation_forest_timings.csv' - The fit and score time of each request type, with
+        the data version scored and the data version its forest was fitted on
+    './output/isolation_forest_models/' - The fitted forests, for later runs
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import joblib
+import numpy as np
 import pandas as pd
-from statsmodels.tsa.seasonal import seasonal_decompose
-import sys
+from joblib import Parallel, delayed
 from sklearn.ensemble import IsolationForest
+from daily_matrix import DailyMatrix
+from decompose import seasonal_decompose_batch
+from ingest import add_cache_argument, load_dataset
+from instrument import add_arguments, run, stage
+
+MODELS_DIR = "./output/isolation_forest_models"
+TIMINGS_FILE = "./output/isolation_forest_timings.csv"
+CONTAMINATION = 0.02
+RANDOM_STATE = 42
+# Saved forests are only reused while their days make up at least this share of the series
+MIN_FITTED_SHARE = 0.98
+
+
+def max_samples_arg(value):
+    """Parse --max-samples as "auto", a number of days (int) or a fraction of the days (float)."""
+    if value == "auto":
+        return value
+    return float(value) if "." in value else int(value)
+
+
+def series_version(values):
+    """Return a short hash identifying a type's daily totals."""
+    return hashlib.sha256(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest()[:16]
+
+
+class ModelStore:
+    """
+    The saved forests: one compressed joblib file per request type, and a JSON index with the data
+    version, number of days and fitting parameters of each type's forest. Forests are only loaded
+    when they are reused, and only written when they are fitted again.
+    """
+
+    INDEX_NAME = "index.json"
+
+    def __init__(self, directory=MODELS_DIR):
+        self.directory = directory
+        self.index_path = os.path.join(directory, self.INDEX_NAME)
+        try:
+            with open(self.index_path, "r") as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+        self.changed = False
+
+    def entry(self, request_type):
+        return self.entries.get(request_type)
+
+    def model_path(self, request_type):
+        return os.path.join(self.directory, self.entries[request_type]["file"])
+
+    def put(self, request_type, model, version, n_days, params):
+        """Save a type's newly fitted forest."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Request types can contain any character, so files are named by a hash of the type
+        name = hashlib.sha256(request_type.encode("utf-8")).hexdigest()[:16] + ".joblib"
+        tmp_path = os.path.join(self.directory, name + ".tmp")
+        joblib.dump(model, tmp_path, compress=3)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        self.entries[request_type] = {
+            "file": name,
+            "version": version,
+            "n_days": n_days,
+            "params": params,
+        }
+        self.changed = True
+
+    def prune(self, request_types):
+        """Remove the forests of the types that are not in request_types."""
+        for request_type in set(self.entries) - set(request_types):
+            entry = self.entries.pop(request_type)
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except FileNotFoundError:
+                pass
+            self.changed = True
+
+    def save(self):
+        """Write the index, if any forest was added or removed."""
+        if not self.changed:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+        self.changed = False
+
+
+def is_reusable(entry, daily_totals, params):
+    """
+    Return whether the forest of a saved entry can score daily_totals without refitting: it was
+    fitted with the same parameters on the same daily totals, or on a prefix of them covering at
+    least MIN_FITTED_SHARE of the days.
+    """
+    if entry is None or entry["params"] != params:
+        return False
+    n_days = entry["n_days"]
+    if n_days > len(daily_totals) or n_days < MIN_FITTED_SHARE * len(daily_totals):
+        return False
+    return series_version(daily_totals[:n_days]) == entry["version"]
 
-def main(dataset_csv):
+
+def fit_and_score(positive_residuals, model_path, params):
+    """
+    Count the anomalies among a type's positive residuals, fitting a new forest unless the path of
+    a saved one is given. Saved forests are loaded here, in the worker. Returns (the newly fitted
+    forest or None, anomaly count, fit seconds, score seconds).
+    """
+    if len(positive_residuals) == 0:
+        return None, 0, 0.0, 0.0
+
+    fit_seconds = 0.0
+    if model_path is not None:
+        model = joblib.load(model_path)
+    else:
+        # A number of samples above the number of days is the same as all the days
+        if isinstance(params["max_samples"], int):
+            params = {**params, "max_samples": min(params["max_samples"], len(positive_residuals))}
+        start = time.perf_counter()
+        model = IsolationForest(**params).fit(positive_residuals)
+        fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    anomalies = model.predict(positive_residuals)
+    score_seconds = time.perf_counter() - start
+    # Saved forests are not sent back to the main process
+    fitted = model if model_path is None else None
+    return fitted, int((anomalies == -1).sum()), fit_seconds, score_seconds
+
+
+def main(
+    dataset_csv,
+    n_jobs=1,
+    max_samples="auto",
+    refit=False,
+    models_dir=MODELS_DIR,
+    use_cache=True,
+):
     print("Loading data...")
-    df = pd.read_csv(dataset_csv)
+    # Only service requests are read from the dataset
+    df = load_dataset(
+        dataset_csv,
+        columns=["Type", "Open Date", "Closed Date"],
+        filters={"Subject": "Service Request"},
+        use_cache=use_cache,
+    )
 
     # Drop any rows that don't have either an Open or Closed date
     df = df.dropna(subset=["Open Date", "Closed Date"])
 
-    print("Filtering by service requests...")
-    df = df[df["Subject"] == "Service Request"]
-
-    df["Open Date"] = pd.to_datetime(df["Open Date"], format="%m/%d/%Y %I:%M:%S %p")
-    df["Closed Date"] = pd.to_datetime(df["Closed Date"], format="%m/%d/%Y %I:%M:%S %p")
-
     print("Sorting by open date...")
     df = df.sort_values(by="Open Date", ascending=True)
 
@@ -24,76 +204,148 @@ def main(dataset_csv):
         df["Closed Date"] - df["Open Date"]
     ).dt.total_seconds() / 3600
     df = df[df["Case Duration (hours)"] > 0]
-    df = df.set_index("Case ID")
 
-    print("Grouping by request type...")
-    grouped = df.groupby("Type")
-    anomaly_data_list = []
+    print("Aggregating daily case durations by request type...")
+    with stage("group"):
+        daily = DailyMatrix.from_frame(df, value_column="Case Duration (hours)")
+    n_days = daily.last_day - daily.first_day + 1
 
-    total_groups = len(grouped)
-    current_group = 0
-
-    for request_type, group in grouped:
-        current_group += 1
-        print(f"Processing group {current_group} of {total_groups}...")
-
-        # Set 'Open Date' as index for grouping by day
-        group = group.set_index("Open Date")
-        daily_total_case_durations = group.resample("D")["Case Duration (hours)"].sum()
-
-        # Fill missing days with 0 case durations
-        daily_total_case_durations = daily_total_case_durations.reindex(
-            pd.date_range(
-                start=daily_total_case_durations.index.min(),
-                end=daily_total_case_durations.index.max(),
-                freq="D",
-            ),
-            fill_value=0,
-        )
+    # Skip groups with less than 730 observations (need at least 730 to determine seasonal trends)
+    for request_type in daily.types[n_days < 730]:
+        print(f"Skipping group: {request_type}")
+    columns = np.flatnonzero(n_days >= 730)
 
-        # Skip groups with less than 730 observations (need at least 730 to determine seasonal trends)
-        if len(daily_total_case_durations) < 730:
-            print(f"Skipping group: {request_type}")
-            continue
-
-        decomposition = seasonal_decompose(
-            daily_total_case_durations, model="additive", period=365
+    print("Decomposing daily case durations...")
+    with stage("decompose"):
+        decomposition = seasonal_decompose_batch(
+            daily.sums[:, columns],
+            period=365,
+            starts=daily.first_day[columns],
+            stops=daily.last_day[columns] + 1,
         )
-        residuals_df = pd.DataFrame(decomposition.resid.dropna())
 
+    params = {
+        "contamination": CONTAMINATION,
+        "max_samples": max_samples,
+        "random_state": RANDOM_STATE,
+    }
+    store = ModelStore(models_dir)
 
-        # Rename the column to make it easier to reference
-        residuals_df.columns = ["Residuals"]
+    request_types = list(daily.types[columns])
+    tasks = []
+    for j, request_type in enumerate(request_types):
+        observed, _, _, residuals = decomposition.column(j)
+        residuals = residuals[~np.isnan(residuals)]
 
-        # Keep only positive residuals (abnormally long durations)
-        positive_residuals = residuals_df[residuals_df["Residuals"] > 0]
+        # Keep only positive residuals (abnormally long durations), as a single feature column
+        positive_residuals = residuals[residuals > 0].reshape(-1, 1)
+        model_path = None
+        if not refit and is_reusable(store.entry(request_type), observed, params):
+            model_path = store.model_path(request_type)
+        tasks.append((positive_residuals, model_path))
 
-        # Apply Isolation Forest only to positive residuals to look for anomalies with long case durations
-        if not positive_residuals.empty:
-            iso_forest_residuals = IsolationForest(contamination=0.02, random_state=42)
-            anomalies = iso_forest_residuals.fit_predict(positive_residuals)
+    n_reused = sum(model_path is not None for _, model_path in tasks)
+    print(
+        f"Fitting {len(tasks) - n_reused} and reusing {n_reused} Isolation Forests "
+        f"with {n_jobs} job(s)..."
+    )
+    # Apply Isolation Forest only to positive residuals to look for anomalies with long durations
+    with stage("fit"):
+        outcomes = Parallel(n_jobs=n_jobs)(
+            delayed(fit_and_score)(positive_residuals, model_path, params)
+            for positive_residuals, model_path in tasks
+        )
 
-            # Count anomalies (only abnormally long durations)
-            anomaly_count = (anomalies == -1).sum()
-        else:
-            anomaly_count = 0
+    anomaly_data_list = []
+    timings = []
+    fitted = []
+    for j, request_type in enumerate(request_types):
+        observed = decomposition.column(j)[0]
+        version = series_version(observed)
+        positive_residuals, reused = tasks[j]
+        model, anomaly_count, fit_seconds, score_seconds = outcomes[j]
+        if model is not None:
+            fitted.append((request_type, model, version, len(observed)))
 
         # Append the results to the list
         anomaly_data_list.append(
             {
                 "Request Type": request_type,
                 "Number of days with abnormally high total daily case duration": anomaly_count,
-                "Total number of days in period": len(daily_total_case_durations),
-                "Anomaly Rate": anomaly_count / len(daily_total_case_durations),
+                "Total number of days in period": len(observed),
+                "Anomaly Rate": anomaly_count / len(observed),
+            }
+        )
+        if reused is not None:
+            model_version = store.entry(request_type)["version"]
+        else:
+            # Types without positive residuals have no forest
+            model_version = version if model is not None else None
+        timings.append(
+            {
+                "Request Type": request_type,
+                "Model": "reused" if reused is not None else "fitted",
+                # The version of the daily totals scored, and of those the forest was fitted on
+                "Data version": version,
+                "Model data version": model_version,
+                "Days scored": len(positive_residuals),
+                "Fit time (s)": round(fit_seconds, 4),
+                "Score time (s)": round(score_seconds, 4),
             }
         )
 
-    print("Saving anomaly counts to CSV file..")
-    # Save the anomaly counts for all types to a CSV file
-    anomaly_data = pd.DataFrame(anomaly_data_list)
-    anomaly_data.to_csv("./output/anomaly_count.csv", index=False)
+    with stage("write models"):
+        for request_type, model, version, n_days in fitted:
+            store.put(request_type, model, version, n_days, params)
+    with stage("write"):
+        # The forests of types without enough days, or no longer in the dataset, are removed
+        store.prune(request_types)
+        store.save()
+
+        print("Saving anomaly counts to CSV file..")
+        # Save the anomaly counts for all types to a CSV file
+        anomaly_data = pd.DataFrame(anomaly_data_list)
+        anomaly_data.to_csv("./output/anomaly_count.csv", index=False)
+
+        timings = pd.DataFrame(timings)
+        timings.to_csv(TIMINGS_FILE, index=False)
+    print(
+        f"Fit time {timings['Fit time (s)'].sum():.2f}s, "
+        f"score time {timings['Score time (s)'].sum():.2f}s; "
+        f"per-type timings saved to {TIMINGS_FILE}"
+    )
 
 
 if __name__ == "__main__":
-    dataset_csv = sys.argv[1]
-    main(dataset_csv)
+    parser = argparse.ArgumentParser(
+        description="Count days with anomalous total case durations using Isolation Forests."
+    )
+    parser.add_argument("dataset_csv", help="Path to the 311 dataset CSV file")
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=1,
+        help="Number of parallel jobs fitting the forests (-1 for all CPUs)",
+    )
+    parser.add_argument(
+        "--max-samples",
+        type=max_samples_arg,
+        default="auto",
+        help='Days each tree is fitted on: "auto" (at most 256), a number, or a fraction',
+    )
+    parser.add_argument(
+        "--refit",
+        action="store_true",
+        help=f"Fit every forest again, ignoring the forests saved in {MODELS_DIR}",
+    )
+    add_cache_argument(parser)
+    add_arguments(parser)
+    args = parser.parse_args()
+    with run(args):
+        main(
+            args.dataset_csv,
+            n_jobs=args.n_jobs,
+            max_samples=args.max_samples,
+            refit=args.refit,
+            use_cache=not args.no_cache,
+        )
@@ -1,93 +1,273 @@
+"""
+This script counts, for every service request type, the number of days with an anomalous daily
+total case duration. Each type's daily total case durations are decomposed into trend, seasonal
+and residual components, and a day is anomalous when its residual is more than 3 MADs away from
+the median residual.
+
+The daily totals of all types are built as one DailyMatrix and decomposed together with
+seasonal_decompose_batch. With more than one worker, the types are split into one batch per worker
+process, each sent only the rows its types span, and results are collected in request type order,
+so the output is the same regardless of the number of workers.
+
+Every run saves the daily aggregates to './output/anomaly_state.npz' (see anomaly_state.py). With
+--incremental, the dataset only needs to contain the latest data (e.g. a fresh daily pull): only
+cases above the previous run's Case ID watermark and cases that were still open are ingested, and
+the anomalies are recomputed from the saved aggregates without re-reading the full history. The
+anomalous days in the trailing window affected by the new data are also listed.
+
+The decomposition of every analysed type, with the median and MAD of its residuals, is saved to
+'./output/anomaly_decompositions.npz' (see decomposition_store.py), for plotting.
+
+Usage:
+    python count_anomaly_by_case_duration_mad.py <311_request_dataset.csv> [--workers N]
+        [--incremental] [--no-cache]
+
+Where:
+    --workers is the number of worker processes (defaults to 1, which processes every type in the
+    main process).
+    --incremental adds the dataset to the saved aggregates instead of replacing them.
+
+Output:
+    './output/anomaly_count.csv' - The anomaly counts for each request type
+    './output/anomaly_state.npz' - The daily aggregates, for later incremental runs
+    './output/anomaly_decompositions.npz' - The decomposition of every analysed type, for
+        visualize_anomaly_detection.py
+    './output/recent_anomalies.csv' - With --incremental, the anomalous days affected by new data
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from statsmodels.tsa.seasonal import seasonal_decompose
-import sys
+from anomaly_state import STATE_COLUMNS, STATE_FILE, AnomalyState
+from decompose import seasonal_decompose_batch
+from decomposition_store import DECOMPOSITION_FILE, DecompositionStore, data_version
+from ingest import add_cache_argument, load_dataset
+from instrument import add_arguments, run, stage
 
+PERIOD = 365
+# Types need at least 730 observations (two full periods) to determine seasonal trends
+MIN_DAYS = 2 * PERIOD
 
-def main(dataset_csv):
-    print("Loading data...")
-    df = pd.read_csv(dataset_csv)
-
-    # Drop any rows that don't have either an Open or Closed date
-    df = df.dropna(subset=["Open Date", "Closed Date"])
-
-    print("Filtering by service requests...")
-    df = df[df["Subject"] == "Service Request"]
-
-    print("Calculating case durations...")
-    df["Open Date"] = pd.to_datetime(df["Open Date"], format="%m/%d/%Y %I:%M:%S %p")
-    df["Closed Date"] = pd.to_datetime(df["Closed Date"], format="%m/%d/%Y %I:%M:%S %p")
-    
-    print("Sorting by open date...")
-    df = df.sort_values(by="Open Date", ascending=True)
-
-    print("Calculating case durations...")
-    df["Case Duration (hours)"] = (
-        df["Closed Date"] - df["Open Date"]
-    ).dt.total_seconds() / 3600
-    df = df[df["Case Duration (hours)"] > 0]
-    df = df.set_index("Case ID")
-
-    print("Grouping by request type...")
-    # Group by 'Type'
-    grouped = df.groupby("Type")
-    anomaly_data_list = []
-    
-    total_groups = len(grouped)
-    current_group = 0 
-
-    for request_type, group in grouped:
-        current_group += 1
-        print(f"Processing group {current_group} of {total_groups}...") 
-        
-        group = group.set_index("Open Date")
-        daily_total_case_durations = group.groupby(group.index.date)["Case Duration (hours)"].sum()
-
-        # Fill missing days with 0 case durations
-        daily_total_case_durations = daily_total_case_durations.reindex(
-            pd.date_range(
-                start=daily_total_case_durations.index.min(),
-                end=daily_total_case_durations.index.max(),
-                freq="D",
-            ),
-            fill_value=0,
-        )
 
-        # Skip groups with less than 730 observations (need at least 730 to determine seasonal trends)
-        if len(daily_total_case_durations) < 730:
-            print(f"Skipping group: {request_type}")
-            continue
+def mad_anomalies(decomposition):
+    """
+    Apply the MAD rule to every column of a BatchDecomposition. Returns the median and MAD of each
+    column's residuals, and a boolean array marking the anomalous days.
+    """
+    residuals = decomposition.resid
 
-        decomposition = seasonal_decompose(
-            daily_total_case_durations, model="additive", period=365
-        )
-        residuals = decomposition.resid.dropna()
+    # Calculate the median and MAD of each type's residuals (NaN outside the residuals)
+    median = np.nanmedian(residuals, axis=0)
+    deviation = np.abs(residuals - median)
+    mad = np.nanmedian(deviation, axis=0)
+
+    # Anomalies are points where |residual - median| > 3 * MAD
+    return median, mad, deviation > 3 * mad
 
-        # Calculate the median and MAD of the residuals
-        median = residuals.median()
-        mad = (residuals - median).abs().median()
 
-        # Anomalies are points where |residual - median| > 3 * MAD
-        anomaly_count = residuals[
-            (residuals - median).abs() > 3 * mad
-        ].count()
+def analyze_types(request_types, sums, starts, stops, total_requests):
+    """
+    Count the anomalous days of a batch of request types. Column j of sums holds the daily total
+    case durations of request_types[j], from row starts[j] up to (excluding) row stops[j], with
+    missing days filled with 0. Returns one result row per type, in the same order, and the
+    decomposition of each type's series with the median and MAD of its residuals.
+    """
+    decomposition = seasonal_decompose_batch(sums, PERIOD, starts, stops)
+    median, mad, anomalies = mad_anomalies(decomposition)
+    anomaly_counts = anomalies.sum(axis=0)
 
-        # Append the results to the list
-        anomaly_data_list.append(
+    results = []
+    decompositions = []
+    for j, request_type in enumerate(request_types):
+        n_days = int(stops[j] - starts[j])
+        results.append(
             {
                 "Request type": request_type,
-                "Number of days with anomalous daily total case duration": anomaly_count,
-                "Total requests": len(group),
-                "Total number of days": len(daily_total_case_durations),
-                "Anomaly Rate": anomaly_count / len(daily_total_case_durations)
+                "Number of days with anomalous daily total case duration": anomaly_counts[j],
+                "Total requests": total_requests[j],
+                "Total number of days": n_days,
+                "Anomaly Rate": anomaly_counts[j] / n_days
             }
         )
+        decompositions.append((decomposition.column(j), median[j], mad[j]))
+    return results, decompositions
+
+
+def _analyze_types_args(args):
+    return analyze_types(*args)
+
+
+def type_batches(daily, columns, n_batches):
+    """
+    Split the given DailyMatrix columns into at most n_batches contiguous batches, each holding
+    only the rows spanned by its types, as arguments for analyze_types.
+    """
+    batches = []
+    for batch_columns in np.array_split(columns, min(n_batches, len(columns))):
+        starts = daily.first_day[batch_columns]
+        stops = daily.last_day[batch_columns] + 1
+        first_row, last_row = starts.min(), stops.max()
+        batches.append(
+            (
+                list(daily.types[batch_columns]),
+                daily.sums[first_row:last_row, batch_columns],
+                starts - first_row,
+                stops - first_row,
+                daily.counts[:, batch_columns].sum(axis=0),
+            )
+        )
+    return batches
+
+
+def analyze_all_types(daily, columns, workers):
+    """
+    Run analyze_types over the given DailyMatrix columns, split into one batch per worker process
+    when workers > 1. Results and decompositions are returned in the same order as columns.
+    """
+    if len(columns) == 0:
+        return [], []
 
-    print("Saving anomaly counts to CSV file...")
-    # Save the anomaly counts for all types to a CSV file
-    anomaly_data = pd.DataFrame(anomaly_data_list)
-    anomaly_data.to_csv("./output/anomaly_count.csv", index=False)
+    batches = type_batches(daily, columns, workers)
+    if workers == 1:
+        return analyze_types(*batches[0])
+
+    results, decompositions = [], []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Batches are returned in submission order, keeping the output deterministic
+        for batch_results, batch_decompositions in executor.map(_analyze_types_args, batches):
+            results.extend(batch_results)
+            decompositions.extend(batch_decompositions)
+    return results, decompositions
+
+
+def save_decompositions(daily, columns, decompositions, path=DECOMPOSITION_FILE):
+    """Save the decompositions returned by analyze_all_types to a DecompositionStore."""
+    store = DecompositionStore.from_decompositions(
+        daily.types[columns],
+        daily.days[daily.first_day[columns]].to_numpy(dtype="datetime64[D]"),
+        [series for series, _, _ in decompositions],
+        [median for _, median, _ in decompositions],
+        [mad for _, _, mad in decompositions],
+        data_version(daily),
+    )
+    store.save(path)
+    return store
+
+
+def recent_anomalies(daily, columns, decompositions, since):
+    """
+    List the anomalous days on or after the day since, for the given DailyMatrix columns, from
+    their decompositions as returned by analyze_all_types. Returns a DataFrame with one row per
+    anomalous day and type.
+    """
+    window_start = daily.days.searchsorted(since)
+    types, rows, observed, residuals, medians, mads = [], [], [], [], [], []
+    for column, ((series_observed, _, _, resid), median, mad) in zip(columns, decompositions):
+        # The series of a type starts at its first day
+        first_day = daily.first_day[column]
+        offset = max(window_start - first_day, 0)
+        anomalous = np.flatnonzero(np.abs(resid[offset:] - median) > 3 * mad) + offset
+        types.append(np.repeat(daily.types[column], len(anomalous)))
+        rows.append(first_day + anomalous)
+        observed.append(series_observed[anomalous])
+        residuals.append(resid[anomalous])
+        medians.append(np.repeat(median, len(anomalous)))
+        mads.append(np.repeat(mad, len(anomalous)))
+
+    def joined(arrays, dtype=np.float64):
+        return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+
+    return pd.DataFrame(
+        {
+            "Request type": joined(types, object),
+            "Date": daily.days[joined(rows, np.int64)],
+            "Daily total case duration (hours)": joined(observed),
+            "Residual": joined(residuals),
+            "Median residual": joined(medians),
+            "MAD": joined(mads),
+        }
+    ).sort_values(["Date", "Request type"])
+
+
+def main(dataset_csv, workers=None, incremental=False, state_file=STATE_FILE, use_cache=True):
+    print("Loading data...")
+    df = load_dataset(
+        dataset_csv,
+        columns=STATE_COLUMNS,
+        filters={"Subject": "Service Request"},
+        use_cache=use_cache,
+    )
+
+    changed_since = None
+    if incremental and os.path.exists(state_file):
+        print(f"Ingesting new data into {state_file}...")
+        with stage("group"):
+            state = AnomalyState.load(state_file)
+            changed_since = state.update(df)
+        if changed_since is None:
+            print("No new closed cases found.")
+    else:
+        print("Aggregating daily case durations by request type...")
+        with stage("group"):
+            state = AnomalyState.from_frame(df)
+    with stage("write"):
+        state.save(state_file)
+    daily = state.daily
+
+    n_days = daily.last_day - daily.first_day + 1
+    for request_type in daily.types[n_days < MIN_DAYS]:
+        print(f"Skipping group: {request_type}")
+    columns = np.flatnonzero(n_days >= MIN_DAYS)
+
+    workers = workers or 1
+    print(f"Analyzing {len(columns)} request types with {workers} worker(s)...")
+    with stage("decompose"):
+        anomaly_data_list, decompositions = analyze_all_types(daily, columns, workers)
+
+    with stage("write"):
+        store = save_decompositions(daily, columns, decompositions)
+        print(f"Saved decompositions (data version {store.version}) to {DECOMPOSITION_FILE}")
+
+        print("Saving anomaly counts to CSV file...")
+        # Save the anomaly counts for all types to a CSV file
+        anomaly_data = pd.DataFrame(anomaly_data_list)
+        anomaly_data.to_csv("./output/anomaly_count.csv", index=False)
+
+    if changed_since is not None:
+        # A day's trend (and so its residual) depends on the days up to PERIOD // 2 either side
+        since = changed_since - pd.Timedelta(days=PERIOD // 2)
+        print(f"Evaluating anomalies since {since.date()}...")
+        with stage("recent anomalies"):
+            recent = recent_anomalies(daily, columns, decompositions, since)
+        recent.to_csv("./output/recent_anomalies.csv", index=False)
+        print(f"{len(recent)} anomalous days saved to ./output/recent_anomalies.csv")
 
 
 if __name__ == "__main__":
-    dataset_csv = sys.argv[1]
-    main(dataset_csv)
+    parser = argparse.ArgumentParser(
+        description="Count days with anomalous total case durations for each request type."
+    )
+    parser.add_argument("dataset_csv", help="Path to the 311 dataset CSV file")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (defaults to 1)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=f"Add only new data to the aggregates saved in {STATE_FILE} by the previous run",
+    )
+    add_cache_argument(parser)
+    add_arguments(parser)
+    args = parser.parse_args()
+    with run(args):
+        main(
+            args.dataset_csv,
+            workers=args.workers,
+            incremental=args.incremental,
+            use_cache=not args.no_cache,
+        )
@@ -1,49 +1,327 @@
+"""
+This script creates an interactive heatmap of the locations of service requests.
+
+Instead of sending every request to the map, the requests are first totalled in a grid of square
+cells (see spatial.py), and each occupied cell is drawn as one weighted heatmap point. The cells
+span a few screen pixels at the map's initial zoom level, so the map looks the same as a heatmap
+of every request while the HTML file stays small regardless of the size of the dataset.
+
+With --pyramid, one layer is built for each zoom level from PYRAMID_ZOOMS, each with cells twice
+as large as the next zoom level's, and the map shows the layer matching its current zoom level.
+Layers with more than MAX_CELLS cells are coarsened, so the HTML file stays a few MB at most.
+
+The requests can be restricted to one request type (--type), one ward (--ward) and a range of
+months (--start and --end). With --by type, --by ward or --by month, one heat map is created for
+every request type, ward or month: the requests are loaded once and indexed by month, grid cell,
+type and ward (see SpatialIndex in spatial.py), and each heat map is totalled from the index.
+The heat maps are saved as layers of a single map, with a control to switch between them, or with
+--separate, as separate files.
+
+Usage:
+    python create_request_heat_map.py <csv_filename> [--cell-size METRES] [--pyramid]
+        [--type TYPE] [--ward WARD] [--start YYYY-MM] [--end YYYY-MM]
+        [--by {type,ward,month} ...] [--separate] [--no-cache]
+
+Output:
+    './output/heatmap.html', or with --by and --separate, one file per heat map in
+    './output/heatmaps/', named after the heat map (e.g. 'type_pothole.html'). Heat maps whose
+    names only differ in punctuation or case get a short hash of their name appended.
+"""
+
+import argparse
+import hashlib
+import os
+import re
 import folium
+from branca.element import MacroElement
 from folium.plugins import HeatMap
+from jinja2 import Template
+import numpy as np
 import pandas as pd
-import sys
+from ingest import add_cache_argument, load_dataset
+from instrument import add_arguments, run, stage
+from spatial import Grid, SpatialIndex, bin_points, cell_size_for_zoom, heat_data, pyramid
 
-def main(csv_filename):
-    print("Reading CSV...")
-    # Load data from CSV
-    df = pd.read_csv(csv_filename)
+ZOOM_START = 12
+# Size of a grid cell in screen pixels, well below the heatmap radius
+CELL_PIXELS = 10
+PYRAMID_ZOOMS = range(10, 16)
+# Layers with more cells than this are coarsened, to bound the size of the HTML file
+MAX_CELLS = 25_000
+VIEWS_DIR = "./output/heatmaps"
 
-    print("Filtering data...")
-    df = df[
-        (df["Subject"] == "Service Request")
-        & df["Geometry"].notna()
-    ]
 
-    print("Extracting geolocation..")
-    # Extract latitude and longitude from "Geometry"
-    df[["longitude", "latitude"]] = df["Geometry"].str.extract(
-        r"POINT \(([^ ]+) ([^ ]+)\)"
+class ZoomLayers(MacroElement):
+    """Shows only the map layer built for the zoom level closest to the map's current zoom."""
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            (function() {
+                var map = {{ this._parent.get_name() }};
+                var layers = [
+                    {% for zoom, layer in this.layers %}
+                    [{{ zoom }}, {{ layer.get_name() }}],
+                    {% endfor %}
+                ];
+                function showZoomLayer() {
+                    var zoom = map.getZoom();
+                    var closest = layers[0];
+                    layers.forEach(function(layer) {
+                        if (Math.abs(layer[0] - zoom) < Math.abs(closest[0] - zoom)) {
+                            closest = layer;
+                        }
+                    });
+                    layers.forEach(function(layer) {
+                        if (layer === closest) {
+                            map.addLayer(layer[1]);
+                        } else {
+                            map.removeLayer(layer[1]);
+                        }
+                    });
+                }
+                map.on("zoomend", showZoomLayer);
+                showZoomLayer();
+            })();
+        {% endmacro %}
+        """
     )
-    df["latitude"] = df["latitude"].astype(float)
-    df["longitude"] = df["longitude"].astype(float)
 
-    print("Creating heat map...")
-    # Create a base map
-    if not df.empty:
-        base_map = folium.Map(
-            location=[df["latitude"].mean(), df["longitude"].mean()], zoom_start=12
-        )
+    def __init__(self, layers):
+        super().__init__()
+        self._name = "ZoomLayers"
+        self.layers = layers
+
+
+def add_heat_layers(base_map, latitudes, longitudes, cell_size=None, use_pyramid=False):
+    """Add the binned heatmap layer(s) of the given points to base_map. Returns the cell count."""
+    latitude = float(latitudes.mean())
+    zooms = list(PYRAMID_ZOOMS) if use_pyramid else [ZOOM_START]
+    if cell_size is None:
+        cell_size = cell_size_for_zoom(latitude, max(zooms), CELL_PIXELS)
+
+    grid, cells, totals = bin_points(latitudes, longitudes, cell_size)
+    levels = pyramid(grid, cells, totals, len(zooms) - 1)
+    # The finest level is for the highest zoom level
+    levels = list(zip(sorted(zooms, reverse=True), levels))
+
+    # Drop levels that are too detailed; their zoom levels use the closest remaining level instead
+    while len(levels) > 1 and len(levels[0][1][1]) > MAX_CELLS:
+        levels.pop(0)
+    while len(levels[0][1][1]) > MAX_CELLS:
+        zoom, level = levels[0]
+        levels[0] = (zoom, pyramid(*level, 1)[1])
+
+    if not use_pyramid:
+        HeatMap(heat_data(*levels[0][1]), radius=60, blur=55).add_to(base_map)
+        return len(levels[0][1][1])
+
+    layers = []
+    for zoom, level in levels:
+        layer = HeatMap(heat_data(*level), name=f"Zoom {zoom}", radius=60, blur=55, show=False)
+        layer.add_to(base_map)
+        layers.append((zoom, layer))
+    ZoomLayers(layers).add_to(base_map)
+    return sum(len(level[1]) for _, level in levels)
+
+
+def bounded_grid(latitudes, longitudes, cell_size):
+    """Return a grid of cell_size metres covering the points, coarsened to MAX_CELLS cells."""
+    grid = Grid.covering(latitudes, longitudes, cell_size)
+    cells = np.unique(grid.cells(latitudes, longitudes))
+    while len(cells) > MAX_CELLS:
+        cells = np.unique(grid.coarse_cells(cells, 2))
+        grid = grid.coarsen(2)
+    return grid
+
+
+def heatmap_views(index, views_by):
+    """
+    Yield the (name, cells, totals) of every heatmap view: one per request type, ward or month, for
+    each dimension in views_by.
+    """
+    for dimension in views_by:
+        if dimension == "type":
+            for request_type in index.type_names:
+                yield f"Type: {request_type}", *index.query(request_type=request_type)
+        elif dimension == "ward":
+            for ward in index.ward_names:
+                yield f"Ward: {ward}", *index.query(ward=ward)
+        elif dimension == "month":
+            for month in index.month_range():
+                start = month.to_timestamp()
+                yield f"Month: {month}", *index.query(start=start, end=start)
+
+
+def view_file_name(name, used=()):
+    """
+    Return the file name of a view's heat map. Names are simplified to lowercase letters, digits
+    and underscores, so different views can map to the same name; a file name already in used gets
+    a short hash of the view's name appended instead.
+    """
+    stem = re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_").lower()
+    if stem + ".html" in used:
+        stem += "_" + hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+    return stem + ".html"
 
-        # Add heat map with adjusted radius and blur
-        heat_data = df[["latitude", "longitude"]].values.tolist()
-        HeatMap(heat_data, radius=60, blur=55).add_to(base_map)
 
-        # Save or display the map
+def save_views(df, views_by, cell_size=None, separate=False):
+    """
+    Build the spatial index of the requests in df once, and save a heatmap of every view in
+    views_by, either as layers of a single map or as separate files. Returns the number of views.
+    """
+    latitudes = df["Latitude"].to_numpy()
+    longitudes = df["Longitude"].to_numpy()
+    location = [latitudes.mean(), longitudes.mean()]
+    if cell_size is None:
+        cell_size = cell_size_for_zoom(location[0], ZOOM_START, CELL_PIXELS)
+
+    grid = bounded_grid(latitudes, longitudes, cell_size)
+    index = SpatialIndex.build(
+        grid, latitudes, longitudes, df["Open Date"], df["Type"], df["Ward"]
+    )
+    print(f"Indexed {len(df)} requests in {len(index.counts)} (month, cell, type, ward) entries.")
+
+    base_map = None
+    n_views = 0
+    file_names = set()
+    os.makedirs(VIEWS_DIR if separate else "./output", exist_ok=True)
+    for name, cells, totals in heatmap_views(index, views_by):
+        if len(cells) == 0:
+            continue
+        if separate:
+            view_map = folium.Map(location=location, zoom_start=ZOOM_START)
+            HeatMap(heat_data(grid, cells, totals), radius=60, blur=55).add_to(view_map)
+            file_name = view_file_name(name, file_names)
+            file_names.add(file_name)
+            view_map.save(os.path.join(VIEWS_DIR, file_name))
+        else:
+            if base_map is None:
+                base_map = folium.Map(location=location, zoom_start=ZOOM_START)
+            HeatMap(
+                heat_data(grid, cells, totals), name=name, radius=60, blur=55, show=n_views == 0
+            ).add_to(base_map)
+        n_views += 1
+
+    if base_map is not None:
+        folium.LayerControl().add_to(base_map)
         base_map.save("./output/heatmap.html")
+    return n_views
+
+
+def main(
+    csv_filename,
+    cell_size=None,
+    use_pyramid=False,
+    views_by=None,
+    request_type=None,
+    ward=None,
+    start=None,
+    end=None,
+    separate=False,
+    use_cache=True,
+):
+    print("Reading CSV...")
+    # Load the coordinates of service requests, decoded from their Geometry by the columnar cache
+    filters = {"Subject": "Service Request"}
+    if request_type is not None:
+        filters["Type"] = request_type
+    if ward is not None:
+        filters["Ward"] = ward
+    columns = ["Longitude", "Latitude"]
+    if views_by or start is not None or end is not None:
+        columns += ["Open Date", "Type", "Ward"]
+    df = load_dataset(csv_filename, columns=columns, filters=filters, use_cache=use_cache)
+
+    print("Filtering data...")
+    # Requests without a Geometry, or with a malformed one, have no coordinates
+    n_requests = len(df)
+    df = df.dropna(subset=["Latitude", "Longitude"])
+    if len(df) < n_requests:
+        print(f"Skipped {n_requests - len(df)} requests without a valid location.")
+    # Keep the requests opened from the start month to the end month
+    if start is not None:
+        df = df[df["Open Date"] >= pd.Timestamp(start).to_period("M").to_timestamp()]
+    if end is not None:
+        df = df[df["Open Date"] < (pd.Timestamp(end).to_period("M") + 1).to_timestamp()]
 
-    else:
+    print("Creating heat map...")
+    if df.empty:
         print("No data available for the specified filters.")
+        return
+
+    if views_by:
+        with stage("bin"):
+            n_views = save_views(df, views_by, cell_size=cell_size, separate=separate)
+        print(f"Created {n_views} heat maps.")
+        return
+
+    # Create a base map
+    base_map = folium.Map(
+        location=[df["Latitude"].mean(), df["Longitude"].mean()], zoom_start=ZOOM_START
+    )
+
+    # Add the heat map of the requests binned into grid cells
+    with stage("bin"):
+        n_cells = add_heat_layers(
+            base_map,
+            df["Latitude"].to_numpy(),
+            df["Longitude"].to_numpy(),
+            cell_size=cell_size,
+            use_pyramid=use_pyramid,
+        )
+    print(f"Binned {len(df)} requests into {n_cells} cells.")
+
+    # Save or display the map
+    with stage("write"):
+        base_map.save("./output/heatmap.html")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(
-            "Usage: python create_request_heat_map.py <csv_filename>"
+    parser = argparse.ArgumentParser(
+        description="Create a heatmap of the locations of service requests."
+    )
+    parser.add_argument("csv_filename", help="Path to the 311 dataset CSV file")
+    parser.add_argument(
+        "--cell-size",
+        type=float,
+        default=None,
+        help="Grid cell size in metres (defaults to a few pixels at the finest zoom level)",
+    )
+    parser.add_argument(
+        "--pyramid",
+        action="store_true",
+        help="Build one layer per zoom level and switch between them as the map is zoomed",
+    )
+    parser.add_argument(
+        "--by",
+        action="append",
+        choices=["type", "ward", "month"],
+        dest="views_by",
+        help="Create one heat map per request type, ward or month (can be repeated)",
+    )
+    parser.add_argument("--type", dest="request_type", help="Only include this request type")
+    parser.add_argument("--ward", help="Only include requests in this ward")
+    parser.add_argument("--start", help="Only include requests opened from this month (YYYY-MM)")
+    parser.add_argument("--end", help="Only include requests opened until this month (YYYY-MM)")
+    parser.add_argument(
+        "--separate",
+        action="store_true",
+        help="With --by, save each heat map to its own file instead of layers of a single map",
+    )
+    add_cache_argument(parser)
+    add_arguments(parser)
+    args = parser.parse_args()
+    with run(args):
+        main(
+            args.csv_filename,
+            cell_size=args.cell_size,
+            use_pyramid=args.pyramid,
+            views_by=args.views_by,
+            request_type=args.request_type,
+            ward=args.ward,
+            start=args.start,
+            end=args.end,
+            separate=args.separate,
+            use_cache=not args.no_cache,
         )
-    else:
-        main(sys.argv[1])
@@ -0,0 +1,120 @@
+"""
+This module builds the daily totals of every service request type in one vectorised pass over the
+311 dataset, as a dense (days x types) matrix shared by the anomaly detection scripts and plots.
+
+Every row is assigned to a cell by flooring its Open Date to the day and combining the day offset
+with the integer code of its Type, and the cells are totalled with np.bincount. Days without any
+requests are therefore already present, with a count and total of 0, so a type's zero-filled
+daily series is simply a slice of its column.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class DailyMatrix:
+    """
+    Daily request counts and value totals for every request type.
+
+    Attributes:
+        days: DatetimeIndex of every day from the first to the last request, one per matrix row.
+        types: Index of the request types, one per matrix column, in sorted order.
+        counts: (days x types) int64 array of the number of requests opened on each day.
+        sums: (days x types) float64 array of the total value (e.g. case duration) of those
+            requests, or None if the matrix was built without a value column.
+    """
+
+    def __init__(self, days, types, counts, sums=None):
+        self.days = days
+        self.types = types
+        self.counts = counts
+        self.sums = sums
+
+        # First and last day with requests, for each type
+        active = counts > 0
+        self.first_day = np.argmax(active, axis=0)
+        self.last_day = len(days) - 1 - np.argmax(active[::-1], axis=0)
+
+    @classmethod
+    def from_frame(cls, df, value_column=None, date_column="Open Date", type_column="Type"):
+        """Build the matrix from a DataFrame with datetime64 dates and a request type column."""
+        types_column = df[type_column]
+        if isinstance(types_column.dtype, pd.CategoricalDtype):
+            types_column = types_column.cat.remove_unused_categories()
+            types_column = types_column.cat.reorder_categories(
+                types_column.cat.categories.sort_values()
+            )
+            type_codes = types_column.cat.codes.to_numpy().astype(np.int64)
+            types = pd.Index(types_column.cat.categories)
+        else:
+            type_codes, types = pd.factorize(types_column, sort=True)
+            type_codes = type_codes.astype(np.int64)
+
+        day_values = df[date_column].to_numpy().astype("datetime64[D]")
+        if len(day_values) == 0:
+            raise ValueError("Cannot build a daily matrix from an empty dataset.")
+        first, last = day_values.min(), day_values.max()
+        day_offsets = (day_values - first).astype(np.int64)
+        n_days = int((last - first).astype(np.int64)) + 1
+        n_types = len(types)
+
+        cells = day_offsets * n_types + type_codes
+        counts = np.bincount(cells, minlength=n_days * n_types).reshape(n_days, n_types)
+        sums = None
+        if value_column is not None:
+            sums = np.bincount(
+                cells,
+                weights=df[value_column].to_numpy(dtype=np.float64),
+                minlength=n_days * n_types,
+            ).reshape(n_days, n_types)
+
+        days = pd.date_range(start=pd.Timestamp(first), periods=n_days, freq="D")
+        return cls(days, types, counts, sums)
+
+    def merge(self, other):
+        """
+        Return a new DailyMatrix holding the totals of both matrices, covering every day and type
+        of either one.
+        """
+        first = min(self.days[0], other.days[0])
+        last = max(self.days[-1], other.days[-1])
+        days = pd.date_range(start=first, end=last, freq="D")
+        types = self.types.union(other.types)
+
+        counts = np.zeros((len(days), len(types)), dtype=np.int64)
+        has_sums = self.sums is not None and other.sums is not None
+        sums = np.zeros((len(days), len(types))) if has_sums else None
+        for matrix in (self, other):
+            rows = slice(days.get_loc(matrix.days[0]), days.get_loc(matrix.days[-1]) + 1)
+            columns = types.get_indexer(matrix.types)
+            counts[rows, columns] += matrix.counts
+            if has_sums:
+                sums[rows, columns] += matrix.sums
+
+        return DailyMatrix(days, types, counts, sums)
+
+    def column(self, request_type):
+        return self.types.get_loc(request_type)
+
+    def span(self, request_type):
+        """Return the (start, stop) row slice bounds from a type's first to its last request day."""
+        j = self.column(request_type)
+        return int(self.first_day[j]), int(self.last_day[j]) + 1
+
+    def total_requests(self, request_type):
+        return int(self.counts[:, self.column(request_type)].sum())
+
+    def daily_series(self, request_type, kind="sums", fill_missing=True):
+        """
+        Return a type's daily counts or sums (kind="counts" or "sums") as a Series indexed by day.
+
+        With fill_missing, every day from the type's first to its last request is included, with
+        0 for days without requests. Otherwise only the days with requests are included.
+        """
+        values = self.sums if kind == "sums" else self.counts
+        j = self.column(request_type)
+        start, stop = self.span(request_type)
+        series = pd.Series(values[start:stop, j], index=self.days[start:stop])
+        if not fill_missing:
+            series = series[self.counts[start:stop, j] > 0]
+        return series
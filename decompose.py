@@ -0,0 +1,113 @@
+"""
+This module implements additive seasonal decomposition for many daily time series at once, as a
+batched equivalent of statsmodels' seasonal_decompose(x, model="additive", period=period).
+
+The series are the columns of a 2-D array of aligned days, such as DailyMatrix.sums, and each
+column may start and end on different rows. The centered moving average (trend) of every column is
+computed from a single cumulative sum, and the mean of the detrended values for each position in
+the seasonal cycle is computed for every column with one np.bincount, so the whole decomposition
+is a handful of NumPy operations regardless of the number of series.
+
+As in statsmodels, the trend is undefined for the first and last period // 2 days of each series,
+and the seasonal cycle of each series starts on its first day.
+"""
+
+import numpy as np
+
+
+class BatchDecomposition:
+    """
+    Trend, seasonal and residual components of every column of a decomposed array. Each component
+    has the same shape as the input, with NaN outside each column's series and, for the trend and
+    residuals, where the trend is undefined.
+    """
+
+    def __init__(self, observed, trend, seasonal, resid, starts, stops, period):
+        self.observed = observed
+        self.trend = trend
+        self.seasonal = seasonal
+        self.resid = resid
+        self.starts = starts
+        self.stops = stops
+        self.period = period
+
+    def column(self, j):
+        """Return the (observed, trend, seasonal, resid) arrays of column j's series."""
+        start, stop = self.starts[j], self.stops[j]
+        return (
+            self.observed[start:stop, j],
+            self.trend[start:stop, j],
+            self.seasonal[start:stop, j],
+            self.resid[start:stop, j],
+        )
+
+
+def _moving_average(values, period, defined):
+    """
+    Centered moving average of every column, using the same weights as statsmodels: equal weights
+    over period days for odd periods, and period + 1 days with half weights at both ends for even
+    periods.
+    """
+    n_rows, n_columns = values.shape
+    half = period // 2
+
+    # Centre each column before summing to limit the rounding error of the cumulative sum
+    offset = values.mean(axis=0)
+    centred = values - offset
+    cumulative = np.zeros((n_rows + 1, n_columns))
+    np.cumsum(centred, axis=0, out=cumulative[1:])
+
+    trend = np.full((n_rows, n_columns), np.nan)
+    if n_rows <= 2 * half:
+        return trend
+
+    # Window sums over rows [t - half, t + half] for every t with a complete window
+    window = cumulative[2 * half + 1:] - cumulative[: n_rows - 2 * half]
+    if period % 2 == 0:
+        window -= 0.5 * (centred[: n_rows - 2 * half] + centred[2 * half:])
+    trend[half : n_rows - half] = window / period + offset
+
+    trend[~defined] = np.nan
+    return trend
+
+
+def seasonal_decompose_batch(values, period, starts=None, stops=None):
+    """
+    Decompose every column of a 2-D array of aligned daily values with an additive model.
+
+    Column j's series occupies rows starts[j]:stops[j] (the whole column by default); values
+    outside that range are ignored. Returns a BatchDecomposition.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim != 2:
+        raise ValueError("values must be a 2-D array with one series per column.")
+    n_rows, n_columns = values.shape
+    starts = np.zeros(n_columns, dtype=np.int64) if starts is None else np.asarray(starts)
+    stops = np.full(n_columns, n_rows, dtype=np.int64) if stops is None else np.asarray(stops)
+    if np.any(stops - starts < 2 * period):
+        raise ValueError(f"Every series must have at least {2 * period} observations.")
+
+    rows = np.arange(n_rows)[:, None]
+    in_series = (rows >= starts) & (rows < stops)
+    observed = np.where(in_series, values, np.nan)
+
+    half = period // 2
+    trend_defined = (rows >= starts + half) & (rows < stops - half)
+    trend = _moving_average(np.where(in_series, values, 0.0), period, trend_defined)
+    detrended = observed - trend
+
+    # Mean detrended value for each position in the seasonal cycle of each column
+    phase = (rows - starts) % period
+    cells = phase * n_columns + np.arange(n_columns)
+    finite = np.isfinite(detrended)
+    totals = np.bincount(
+        cells[finite], weights=detrended[finite], minlength=period * n_columns
+    ).reshape(period, n_columns)
+    counts = np.bincount(cells[finite], minlength=period * n_columns).reshape(period, n_columns)
+    period_averages = totals / counts
+    period_averages -= period_averages.mean(axis=0)
+
+    seasonal = np.where(in_series, period_averages[phase, np.arange(n_columns)], np.nan)
+    resid = detrended - seasonal
+
+    return BatchDecomposition(observed, trend, seasonal, resid, starts, stops, period)
@@ -0,0 +1,131 @@
+"""
+This module persists the seasonal decompositions computed by count_anomaly_by_case_duration_mad.py
+so that they can be plotted by visualize_anomaly_detection.py without re-reading the 311 dataset.
+
+For every analysed request type, the store holds its daily total case durations (observed), their
+trend, seasonal and residual components, and the median and MAD of the residuals. The series of
+all types are concatenated into one array per component, with the offset and first day of every
+type's series, so the store is a single compressed NPZ file ('./output/anomaly_decompositions.npz'
+by default).
+
+The store is keyed by data version: a hash of the daily aggregates the decompositions were
+computed from, which changes whenever new data is added.
+"""
+
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+DECOMPOSITION_FILE = "./output/anomaly_decompositions.npz"
+COMPONENTS = ["observed", "trend", "seasonal", "resid"]
+# Days whose residual is more than this many MADs above the median are anomalous
+MAD_THRESHOLD = 3
+
+
+def data_version(daily):
+    """Return a short hash identifying the contents of a DailyMatrix."""
+    digest = hashlib.sha256()
+    digest.update(str(daily.days[0].date()).encode())
+    digest.update("\n".join(map(str, daily.types)).encode())
+    digest.update(np.ascontiguousarray(daily.counts).tobytes())
+    if daily.sums is not None:
+        digest.update(np.ascontiguousarray(daily.sums).tobytes())
+    return digest.hexdigest()[:16]
+
+
+class DecompositionStore:
+    """
+    Decomposed daily series of many request types.
+
+    Attributes:
+        types: Index of the request types.
+        first_days: datetime64[D] array of the first day of every type's series.
+        offsets: int64 array; the series of type i are rows offsets[i]:offsets[i + 1] of the
+            component arrays.
+        components: dictionary of the concatenated float64 arrays of every component (COMPONENTS).
+        median, mad: float64 arrays of the median and MAD of every type's residuals.
+        version: data version of the daily aggregates the series were decomposed from.
+    """
+
+    def __init__(self, types, first_days, offsets, components, median, mad, version):
+        self.types = pd.Index(types)
+        self.first_days = first_days
+        self.offsets = offsets
+        self.components = components
+        self.median = median
+        self.mad = mad
+        self.version = version
+
+    @property
+    def thresholds(self):
+        """Residual value above which a day is anomalous, for every type."""
+        return self.median + MAD_THRESHOLD * self.mad
+
+    @classmethod
+    def from_decompositions(cls, types, first_days, decompositions, median, mad, version):
+        """
+        Build the store from the decomposed series of every type: decompositions is a list of
+        (observed, trend, seasonal, resid) array tuples, as returned by BatchDecomposition.column.
+        """
+        lengths = np.array([len(series[0]) for series in decompositions], dtype=np.int64)
+        offsets = np.zeros(len(decompositions) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        components = {
+            name: np.concatenate(
+                [series[i] for series in decompositions] + [np.empty(0)]
+            ).astype(np.float64)
+            for i, name in enumerate(COMPONENTS)
+        }
+        return cls(
+            types,
+            np.asarray(first_days, dtype="datetime64[D]"),
+            offsets,
+            components,
+            np.asarray(median, dtype=np.float64),
+            np.asarray(mad, dtype=np.float64),
+            version,
+        )
+
+    def series(self, request_type):
+        """Return a type's decomposition as a DataFrame with one column per component, by day."""
+        if request_type not in self.types:
+            raise KeyError(f"No decomposition stored for request type: {request_type!r}")
+        i = self.types.get_loc(request_type)
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+        days = pd.date_range(
+            start=pd.Timestamp(self.first_days[i]), periods=rows.stop - rows.start, freq="D"
+        )
+        return pd.DataFrame(
+            {name: self.components[name][rows] for name in COMPONENTS}, index=days
+        )
+
+    def save(self, path=DECOMPOSITION_FILE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # np.savez appends .npz to names without it, so write through a file handle instead
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                types=np.array(self.types, dtype=str),
+                first_days=self.first_days,
+                offsets=self.offsets,
+                median=self.median,
+                mad=self.mad,
+                version=self.version,
+                **self.components,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DECOMPOSITION_FILE):
+        with np.load(path) as data:
+            return cls(
+                data["types"],
+                data["first_days"],
+                data["offsets"],
+                {name: data[name] for name in COMPONENTS},
+                data["median"],
+                data["mad"],
+                str(data["version"]),
+            )
@@ -1,5 +1,6 @@
 import os
 import pandas as pd
+from fast_datetime import parse_datetimes
 import matplotlib.pyplot as plt
 from sklearn.ensemble import IsolationForest
 from statsmodels.tsa.seasonal import seasonal_decompose
@@ -18,7 +19,7 @@ os.makedirs('./output', exist_ok=True)
 
 print("Parsing dates...")
 # Ensure date columns are properly parsed
-df['Open Date'] = pd.to_datetime(df['Open Date'], format="%m/%d/%Y %I:%M:%S %p")
+df['Open Date'] = parse_datetimes(df['Open Date'], errors="raise")
 
 print("Aggregating by dates...")
 # Step 1: Aggregate data by day
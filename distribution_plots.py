@@ -0,0 +1,139 @@
+"""
+This module plots the distribution of the daily totals of every service request type, as one
+histogram per type, for the study_distribution scripts.
+
+The histogram of every type is computed with a single np.histogram call over its column of a
+DailyMatrix, keeping only the days with at least one request. The histograms are then rendered
+without a GUI: figures are drawn on the Agg canvas directly (not through pyplot), and a single
+figure is reused for every type, updating only its data. They are saved either as one image file
+per type in a directory, optionally split across several worker processes, or as the pages of a
+single PDF file.
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib.figure import Figure
+
+FIGURE_SIZE = (12, 6)
+IMAGE_FORMAT = "png"
+# Fraction of the data range left empty on either side of the bars, as in matplotlib
+AXIS_MARGIN = 0.05
+
+
+def histogram_bins(values):
+    """Return the number of histogram bins for a type's daily totals (at least 10)."""
+    min_value = values.min()
+    max_value = values.max()
+
+    # Calculate bin width with a check for potential division by zero
+    if max_value > min_value:
+        bin_width = (max_value - min_value) / max(1, len(values) - 1)
+        return max(10, int(bin_width))
+    return 10
+
+
+def type_histograms(daily, kind="sums"):
+    """
+    Compute the histogram of the daily counts or sums (kind="counts" or "sums") of every type of a
+    DailyMatrix, over the days with requests. Returns a list of (type, frequencies, bin edges).
+    """
+    values = daily.sums if kind == "sums" else daily.counts
+    histograms = []
+    for j, request_type in enumerate(daily.types):
+        start, stop = int(daily.first_day[j]), int(daily.last_day[j]) + 1
+        daily_totals = values[start:stop, j][daily.counts[start:stop, j] > 0]
+        if len(daily_totals) == 0:
+            continue
+        frequencies, edges = np.histogram(daily_totals, bins=histogram_bins(daily_totals))
+        histograms.append((request_type, frequencies, edges))
+    return histograms
+
+
+def file_name(index, request_type):
+    """Return the image file name of a type's histogram, numbered to keep names unique."""
+    safe_name = re.sub(r"[^\w\-]+", "_", str(request_type)).strip("_")
+    return f"{index:03d}_{safe_name}.{IMAGE_FORMAT}"
+
+
+class HistogramFigure:
+    """
+    A figure drawing one histogram at a time. The histogram's artist, axis labels and margins are
+    created once, and only its data, limits and title are updated for every type, which is much
+    faster than clearing the axes and recomputing the layout of a new figure each time.
+    """
+
+    def __init__(self, title, xlabel):
+        self.title = title
+        self.fig = Figure(figsize=FIGURE_SIZE)
+        self.fig.subplots_adjust(left=0.07, right=0.98, bottom=0.09, top=0.93)
+        self.ax = self.fig.add_subplot()
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel("Frequency")
+        self.bars = self.ax.stairs([0], [0, 1], fill=True, color="blue", alpha=0.7)
+
+    def draw(self, request_type, frequencies, edges):
+        self.bars.set_data(frequencies, edges)
+        # Leave the same margins around the bars as matplotlib's automatic limits
+        margin = (edges[-1] - edges[0]) * AXIS_MARGIN
+        self.ax.set_xlim(edges[0] - margin, edges[-1] + margin)
+        self.ax.set_ylim(0, max(frequencies.max(), 1) * (1 + AXIS_MARGIN))
+        self.ax.set_title(self.title.format(request_type=request_type))
+
+
+def _save_images(histograms, output_dir, title, xlabel):
+    """Render (index, type, frequencies, edges) histograms to image files, reusing one figure."""
+    figure = HistogramFigure(title, xlabel)
+    for index, request_type, frequencies, edges in histograms:
+        figure.draw(request_type, frequencies, edges)
+        figure.fig.savefig(os.path.join(output_dir, file_name(index, request_type)))
+    return len(histograms)
+
+
+def save_histograms(histograms, output, title, xlabel, workers=1):
+    """
+    Render histograms from type_histograms to output: a PDF file with one page per type if output
+    ends with ".pdf", or otherwise a directory with one image per type. title is formatted with
+    the request_type of each histogram. Images can be rendered by several worker processes; a PDF
+    is always written by the main process.
+    """
+    if output.lower().endswith(".pdf"):
+        from matplotlib.backends.backend_pdf import PdfPages
+
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        figure = HistogramFigure(title, xlabel)
+        with PdfPages(output) as pdf:
+            for request_type, frequencies, edges in histograms:
+                figure.draw(request_type, frequencies, edges)
+                pdf.savefig(figure.fig)
+        return
+
+    os.makedirs(output, exist_ok=True)
+    numbered = [(i + 1, *histogram) for i, histogram in enumerate(histograms)]
+    if workers <= 1 or len(numbered) <= 1:
+        _save_images(numbered, output, title, xlabel)
+        return
+
+    # Types are dealt out in turn, so every worker gets a similar mix of large and small types
+    batches = [numbered[i::workers] for i in range(min(workers, len(numbered)))]
+    with ProcessPoolExecutor(max_workers=len(batches)) as executor:
+        futures = [
+            executor.submit(_save_images, batch, output, title, xlabel) for batch in batches
+        ]
+        for future in futures:
+            future.result()
+
+
+def show_histograms(histograms, title, xlabel):
+    """Display the histograms one at a time in interactive windows."""
+    import matplotlib.pyplot as plt
+
+    for request_type, frequencies, edges in histograms:
+        plt.figure(figsize=FIGURE_SIZE)
+        plt.stairs(frequencies, edges, fill=True, color="blue", alpha=0.7)
+        plt.title(title.format(request_type=request_type))
+        plt.xlabel(xlabel)
+        plt.ylabel("Frequency")
+        plt.tight_layout()
+        plt.show()
@@ -1,22 +1,18 @@
 import csv
 import sys
 import os
+from pattern_store import PatternStore
 
 
 def filter_patterns(input_file, output_file):
-    with (
-        open(input_file, mode="r", newline="") as infile,
-        open(output_file, mode="w", newline="") as outfile,
-    ):
-        reader = csv.reader(infile)
-        writer = csv.writer(outfile)
+    store = PatternStore.from_csv(input_file)
+
+    # Keep patterns with a neighbourhood ('_N') and a reason or type ('_R' or '_T')
+    pattern_ids = store.query(categories="N", any_categories="RT")
 
-        for row in reader:
-            # Check if any cell ends with '_N' and any other cell ends with '_R' or '_T'
-            if any(cell.endswith("_N") for cell in row) and any(
-                cell.endswith("_R") or cell.endswith("_T") for cell in row
-            ):
-                writer.writerow(row)
+    with open(output_file, mode="w", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerows(store.rows(pattern_ids))
 
 
 if __name__ == "__main__":
@@ -7,52 +7,134 @@ and transactions to two separate text files. The output files are saved to
 './output/formatted_data.txt' and './output/keys.txt'.
 
 Usage:
-    python format.py <input_csv_file>
+    python format.py <input_csv_file> [--minsup <minsup>]
+
+    With --minsup, the encoded transactions are also mined for frequent itemsets in memory with
+    fpgrowth.py, without re-reading formatted_data.txt, and the patterns are written to
+    './output/results_alpha_<minsup>.txt'.
 
 Output:
     `./output/keys.txt' - A mapping of domain item IDs to their names
     './output/formatted_data.txt' - The transactions, with the item names replaced with their item
     IDs
+    './output/results_alpha_<minsup>.txt' - The frequent patterns, when --minsup is given
+
+The dataset is read in chunks. Each chunk is factorized into integer item IDs in one vectorised
+step, each transaction's IDs are sorted with NumPy, and the chunk's transactions are written to the
+output file as a single block, so memory use stays flat regardless of the dataset size.
 """
 
+import argparse
+import numpy as np
 import pandas as pd
-import sys
+from fpgrowth import TransactionCounter, mine_frequent_patterns, write_patterns
+from instrument import add_arguments, configure, run, stage
 
+CHUNK_SIZE = 1_000_000
 
-def main():
-    args = sys.argv[1:]
-    # Load dataset from CSV file
-    file_path = args[0]
 
-    print("Loading dataset...")
-    data = pd.read_csv(file_path)
+class ItemEncoder:
+    """
+    Assigns integer IDs (starting from 1) to items in order of first appearance, reading each
+    transaction's items from left to right.
+    """
 
-    print("Extracting unique items...")
-    # Extract unique items from each column
-    unique_items = pd.unique(data.values.ravel())
+    def __init__(self):
+        self.item_ids = {}
+        self.items = []
+        # Text form of every assigned ID, indexed by ID, for writing transactions in bulk
+        self.id_strings = np.array([""], dtype=object)
 
-    print("Creating item mappings...")
-    # Create a dictionary to map each unique item to a unique integer ID
-    item_mapping = {item: idx + 1 for idx, item in enumerate(unique_items)}
+    def encode(self, data):
+        """
+        Encode a DataFrame of transactions (one per row) into an array of item IDs with the same
+        shape, with the IDs of each row sorted in ascending order.
+        """
+        # Factorize in row-major order so new items are numbered in order of first appearance
+        codes, uniques = pd.factorize(data.to_numpy().ravel(), use_na_sentinel=False)
+
+        lookup = np.empty(len(uniques), dtype=np.int64)
+        for i, item in enumerate(uniques):
+            item_id = self.item_ids.get(item)
+            if item_id is None:
+                self.items.append(item)
+                item_id = len(self.items)
+                self.item_ids[item] = item_id
+            lookup[i] = item_id
+
+        if len(self.items) >= len(self.id_strings):
+            self.id_strings = np.array(
+                [str(item_id) for item_id in range(len(self.items) + 1)], dtype=object
+            )
+
+        transactions = lookup[codes].reshape(data.shape)
+        transactions.sort(axis=1)
+        return transactions
+
+    def write_keys(self, f):
+        f.write("@CONVERTED_FROM_TEXT\n")
+        for item_id, item in enumerate(self.items, start=1):
+            f.write(f"@ITEM={item_id}={item}\n")
+
+    def write_transactions(self, transactions, f):
+        """Write a block of encoded transactions to f, one space-separated line per transaction."""
+        if len(transactions) == 0:
+            return
+        columns = [self.id_strings[transactions[:, j]] for j in range(transactions.shape[1])]
+        f.write("\n".join(map(" ".join, zip(*columns))))
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Format the cleaned dataset for SPMF.")
+    parser.add_argument("input_csv_file", help="Cleaned dataset produced by clean_for_fp.py")
+    parser.add_argument(
+        "--minsup", type=float, help="Also mine frequent itemsets with this minimum support"
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+    # Load dataset from CSV file
+    file_path = args.input_csv_file
 
-    print("Formatting data...")
-    # Write the mapping and transactions to a text file
     output_file = "./output/formatted_data.txt"
     key_file = "./output/keys.txt"
-    with open(output_file, "w") as f1, open(key_file, "w") as f2:
-        # Write item mappings
-        f2.write("@CONVERTED_FROM_TEXT\n")
-        for item, idx in item_mapping.items():
-            line = f"@ITEM={idx}={item}\n"
-            f2.write(line)
-
-        # Write transactions
-        for _, row in data.iterrows():
-            transaction = sorted(item_mapping[value] for value in row)
-            f1.write(" ".join(map(str, transaction)) + "\n")
+    encoder = ItemEncoder()
+    counter = TransactionCounter() if args.minsup is not None else None
+
+    print("Formatting data...")
+    with open(output_file, "w") as f1:
+        chunks = iter(pd.read_csv(file_path, dtype=str, chunksize=CHUNK_SIZE))
+        while True:
+            with stage("read"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            # Map each item to its integer ID and write the chunk's transactions
+            with stage("encode"):
+                transactions = encoder.encode(chunk)
+            with stage("write"):
+                encoder.write_transactions(transactions, f1)
+            if counter is not None:
+                with stage("count"):
+                    counter.add_block(transactions)
+
+    print("Writing item mappings...")
+    with stage("write"), open(key_file, "w") as f2:
+        encoder.write_keys(f2)
 
     print(f"Formatted data saved to {output_file}")
 
+    if counter is not None:
+        print("Mining frequent patterns...")
+        results_file = f"./output/results_alpha_{args.minsup}.txt"
+        with stage("mine"):
+            patterns = mine_frequent_patterns(counter, args.minsup)
+        with stage("write"):
+            write_patterns(patterns, results_file)
+        print(f"{len(patterns)} frequent patterns saved to {results_file}")
+
 
 if __name__ == "__main__":
-    main()
+    with run():
+        main()
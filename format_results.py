@@ -7,8 +7,13 @@ It reads the frequent patterns from a text file, maps each item in the patterns
 corresponding name using a keys file, sorts the patterns based on their length and support, and
 writes the formatted patterns to a CSV file.
 
+With --stream, the patterns are processed in chunks of --chunk-size patterns, so the results file
+can be larger than the available memory: each chunk is formatted and sorted on its own and written
+to a temporary file, and the sorted chunks are then merged into the output file. Items are named
+through an array indexed by item number. The output is identical to the default mode.
+
 Usage:
-    python format_results.py <keys.txt> <results.txt> <output.csv>
+    python format_results.py <keys.txt> <results.txt> <output.csv> [--stream] [--chunk-size N]
 
 Where:
     <keys.txt> is the file containing the mapping of item numbers to their names.
@@ -17,10 +22,18 @@ Where:
     <output.csv> is the file where the formatted patterns will be written.
 """
 
-import sys
+import argparse
 import csv
+import heapq
+import io
+import os
+import tempfile
+import numpy as np
+from instrument import add_arguments, configure, run, stage
 
 item_sort_order = {"_R": 0, "_T": 1, "_N": 2, "_W": 3}
+# Maximum number of sorted runs merged at once with --stream
+MAX_OPEN_RUNS = 128
 
 def parse_keys(keys_txt):
     keys = {}
@@ -60,19 +73,158 @@ def write_to_csv(formatted_patterns, output_csv):
         for item_names, support in formatted_patterns:
             writer.writerow(item_names + [support])
 
+def parse_keys_array(keys_txt):
+    """
+    Parse the keys file into arrays indexed by item number: the name of every item, and the
+    position of its category in item_sort_order.
+    """
+    keys = parse_keys(keys_txt)
+    names = np.full(max(keys, default=-1) + 1, None, dtype=object)
+    orders = np.zeros(len(names), dtype=np.int8)
+    for item_number, item_name in keys.items():
+        names[item_number] = item_name
+        orders[item_number] = item_sort_order[item_name[-2:]]
+    return names, orders
+
+
+def read_pattern_chunks(fp_txt, chunk_size):
+    """
+    Read the frequent patterns in chunks of at most chunk_size patterns. Yields (items, lengths,
+    supports) arrays: the item numbers of every pattern of the chunk concatenated, and the number
+    of items and the support of every pattern.
+    """
+    with open(fp_txt, 'r') as f:
+        while True:
+            items, lengths, supports = [], [], []
+            for line in f:
+                parts = line.split('#SUP:')
+                pattern_items = parts[0].split()
+                items.extend(pattern_items)
+                lengths.append(len(pattern_items))
+                supports.append(int(parts[1]))
+                if len(supports) == chunk_size:
+                    break
+            if not supports:
+                return
+            yield (
+                np.array(items, dtype=np.int64),
+                np.array(lengths, dtype=np.int64),
+                np.array(supports, dtype=np.int64),
+            )
+
+
+def write_sorted_run(items, lengths, supports, names, orders, run_file):
+    """
+    Format a chunk of patterns and write it to run_file, sorted by length and decreasing support.
+    Each line holds the sort key and the CSV row of one pattern.
+    """
+    # Sort the items of every pattern by category, keeping their order within a category
+    pattern_ids = np.repeat(np.arange(len(lengths)), lengths)
+    items = items[np.lexsort((orders[items], pattern_ids))]
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    item_names = names[items].tolist()
+
+    # np.lexsort is stable, so patterns with the same key keep their order in the file
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for i in np.lexsort((-supports, lengths)):
+        buffer.write(f"{lengths[i]} {supports[i]}\t")
+        writer.writerow(item_names[offsets[i]:offsets[i + 1]] + [int(supports[i])])
+    run_file.write(buffer.getvalue())
+
+
+def _run_key(line):
+    length, support = line[:line.index('\t')].split()
+    return int(length), -int(support)
+
+
+def _merge_lines(run_paths):
+    """Yield the lines of sorted runs in merged order."""
+    run_files = [open(path, 'r', newline='') for path in run_paths]
+    try:
+        # heapq.merge takes equal lines from earlier runs first, so the merge is stable
+        yield from heapq.merge(*run_files, key=_run_key)
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+
+def merge_runs(run_paths, output_csv):
+    """
+    Merge sorted runs into the output CSV file. If there are too many runs to open at once, groups
+    of consecutive runs are first merged into larger runs.
+    """
+    while len(run_paths) > MAX_OPEN_RUNS:
+        merged_paths = []
+        for start in range(0, len(run_paths), MAX_OPEN_RUNS):
+            group = run_paths[start:start + MAX_OPEN_RUNS]
+            merged_path = f"{group[0]}.merged"
+            with open(merged_path, 'w', newline='') as merged_file:
+                merged_file.writelines(_merge_lines(group))
+            for path in group:
+                os.remove(path)
+            merged_paths.append(merged_path)
+        run_paths = merged_paths
+
+    with open(output_csv, 'w', newline='') as csvfile:
+        for line in _merge_lines(run_paths):
+            csvfile.write(line[line.index('\t') + 1:-1] + '\r\n')
+
+
+def stream_format_patterns(keys_txt, fp_txt, output_csv, chunk_size=1_000_000):
+    """
+    Format the frequent patterns with bounded memory: sort chunks of chunk_size patterns into
+    temporary runs, then merge the runs into output_csv.
+    """
+    names, orders = parse_keys_array(keys_txt)
+    output_dir = os.path.dirname(os.path.abspath(output_csv))
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+        run_paths = []
+        for items, lengths, supports in read_pattern_chunks(fp_txt, chunk_size):
+            run_path = os.path.join(tmp_dir, f"run_{len(run_paths)}.txt")
+            with stage("sort"), open(run_path, 'w', newline='') as run_file:
+                write_sorted_run(items, lengths, supports, names, orders, run_file)
+            run_paths.append(run_path)
+            print(f"Sorted chunk {len(run_paths)} ({len(lengths)} patterns)")
+        with stage("merge"):
+            merge_runs(run_paths, output_csv)
+
+
 def main():
-    args = sys.argv[1:]
-    if len(args) < 3:
-        print("Usage: python format_results.py <keys.txt> <frequent_patterns.txt> <output.csv>")
-        sys.exit(1)
-    keys_txt = args[0]
-    fp_txt = args[1]
-    output_csv = args[2]
+    parser = argparse.ArgumentParser(
+        description="Format SPMF frequent patterns into a human-readable CSV file."
+    )
+    parser.add_argument("keys_txt", help="File mapping item numbers to their names")
+    parser.add_argument("fp_txt", help="Frequent patterns extracted by SPMF")
+    parser.add_argument("output_csv", help="CSV file to write the formatted patterns to")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Format the patterns in chunks with bounded memory, for very large results files",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1_000_000,
+        help="Number of patterns held in memory at once with --stream",
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
 
-    keys = parse_keys(keys_txt)
-    patterns = parse_frequent_patterns(fp_txt)
-    formatted_patterns = format_patterns(patterns, keys)
-    write_to_csv(formatted_patterns, output_csv)
+    if args.stream:
+        stream_format_patterns(args.keys_txt, args.fp_txt, args.output_csv, args.chunk_size)
+        return
+
+    with stage("read"):
+        keys = parse_keys(args.keys_txt)
+        patterns = parse_frequent_patterns(args.fp_txt)
+    with stage("sort"):
+        formatted_patterns = format_patterns(patterns, keys)
+    with stage("write"):
+        write_to_csv(formatted_patterns, args.output_csv)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with run():
+        main()
@@ -0,0 +1,234 @@
+"""
+This script mines frequent itemsets from the transactions produced by format.py using the
+FP-Growth algorithm, as an in-process replacement for running SPMF's FPGrowth_itemsets by hand.
+
+Identical transactions are counted once and mined as a single weighted transaction, so the FP-tree
+never holds more nodes than the distinct transactions in the dataset. As in SPMF, the minimum
+support is relative to the number of transactions and is rounded up to a whole count.
+
+The patterns are written in the same format as SPMF's output, one pattern per line:
+    <item> <item> ... #SUP: <support>
+so the results can be passed straight to format_results.py.
+
+Usage:
+    python fpgrowth.py <formatted_data.txt> <minsup> <results.txt> [--compare <spmf_results.txt>]
+
+Where:
+    <formatted_data.txt> is the transactions file produced by format.py.
+    <minsup> is the minimum relative support, e.g. 0.007.
+    <results.txt> is the file where the frequent patterns will be written.
+    --compare checks that the mined patterns are identical to those in an SPMF results file.
+"""
+
+import argparse
+import math
+import sys
+import time
+from collections import Counter, defaultdict
+import numpy as np
+from instrument import add_arguments, configure, run, stage
+
+
+class _Node:
+    __slots__ = ("item", "count", "parent", "children")
+
+    def __init__(self, item, parent):
+        self.item = item
+        self.count = 0
+        self.parent = parent
+        self.children = {}
+
+
+class TransactionCounter:
+    """Counts identical transactions so they can be mined as weighted transactions."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.n_transactions = 0
+
+    def add_block(self, transactions):
+        """Add a 2-D array of transactions (one per row), such as a block encoded by format.py."""
+        if len(transactions) == 0:
+            return
+        unique_rows, counts = np.unique(transactions, axis=0, return_counts=True)
+        for row, count in zip(map(tuple, unique_rows.tolist()), counts.tolist()):
+            self.counts[row] += count
+        self.n_transactions += len(transactions)
+
+    def add_file(self, formatted_txt):
+        """Add every transaction in an SPMF transactions file."""
+        line_counts = Counter()
+        with open(formatted_txt, "r") as f:
+            for line in f:
+                if line.strip() and line[0] not in "#%@":
+                    line_counts[line] += 1
+        for line, count in line_counts.items():
+            self.counts[tuple(map(int, line.split()))] += count
+            self.n_transactions += count
+
+    def weighted_transactions(self):
+        return list(self.counts.items())
+
+
+def _build_tree(weighted_transactions, min_count):
+    """
+    Build an FP-tree from (items, count) pairs, keeping only items with a support of at least
+    min_count. Returns the header table (item -> list of nodes) and the frequent item supports.
+    """
+    supports = defaultdict(int)
+    for items, count in weighted_transactions:
+        for item in items:
+            supports[item] += count
+    frequent = {item: support for item, support in supports.items() if support >= min_count}
+
+    # Insert items in descending support order so common prefixes share nodes
+    rank = {
+        item: position
+        for position, item in enumerate(sorted(frequent, key=lambda item: (-frequent[item], item)))
+    }
+
+    root = _Node(None, None)
+    header = defaultdict(list)
+    for items, count in weighted_transactions:
+        path = sorted({item for item in items if item in rank}, key=rank.__getitem__)
+        node = root
+        for item in path:
+            child = node.children.get(item)
+            if child is None:
+                child = _Node(item, node)
+                node.children[item] = child
+                header[item].append(child)
+            child.count += count
+            node = child
+
+    return header, frequent, rank
+
+
+def _mine(weighted_transactions, min_count, suffix):
+    header, frequent, rank = _build_tree(weighted_transactions, min_count)
+
+    # Process the least frequent items first, as in the original FP-Growth algorithm
+    for item in sorted(frequent, key=rank.__getitem__, reverse=True):
+        pattern = suffix + (item,)
+        yield pattern, frequent[item]
+
+        # Build the conditional pattern base: the prefix path of every node holding the item
+        conditional_base = []
+        for node in header[item]:
+            path = []
+            parent = node.parent
+            while parent.item is not None:
+                path.append(parent.item)
+                parent = parent.parent
+            if path:
+                conditional_base.append((path, node.count))
+
+        if conditional_base:
+            yield from _mine(conditional_base, min_count, pattern)
+
+
+def fpgrowth(weighted_transactions, min_count):
+    """
+    Mine all itemsets with a support of at least min_count from (items, count) pairs. Yields
+    (itemset, support) pairs, with the items of each itemset in ascending order.
+    """
+    for pattern, support in _mine(weighted_transactions, min_count, ()):
+        yield tuple(sorted(pattern)), support
+
+
+def min_support_count(minsup, n_transactions):
+    """Convert a relative minimum support into a transaction count, rounding up as SPMF does."""
+    return max(1, math.ceil(minsup * n_transactions))
+
+
+def mine_frequent_patterns(counter, minsup):
+    """Mine the transactions held by a TransactionCounter. Returns a list of (itemset, support)."""
+    min_count = min_support_count(minsup, counter.n_transactions)
+    return list(fpgrowth(counter.weighted_transactions(), min_count))
+
+
+def write_patterns(patterns, results_txt):
+    """Write patterns in SPMF's '<items> #SUP: <support>' format."""
+    with open(results_txt, "w") as f:
+        for items, support in patterns:
+            f.write(f"{' '.join(map(str, items))} #SUP: {support}\n")
+
+
+def read_patterns(results_txt):
+    """Read an SPMF results file into a dictionary mapping each itemset to its support."""
+    patterns = {}
+    with open(results_txt, "r") as f:
+        for line in f:
+            if "#SUP:" not in line:
+                continue
+            parts = line.split("#SUP:")
+            items = frozenset(map(int, parts[0].split()))
+            patterns[items] = int(parts[1].split()[0])
+    return patterns
+
+
+def compare_patterns(patterns, spmf_results_txt):
+    """
+    Compare mined patterns against an SPMF results file. Prints any differences and returns True
+    if both contain exactly the same itemsets with the same supports.
+    """
+    expected = read_patterns(spmf_results_txt)
+    actual = {frozenset(items): support for items, support in patterns}
+
+    missing = expected.keys() - actual.keys()
+    extra = actual.keys() - expected.keys()
+    different = [
+        items for items in expected.keys() & actual.keys() if expected[items] != actual[items]
+    ]
+
+    for items in sorted(missing, key=sorted):
+        print(f"Missing pattern: {sorted(items)} #SUP: {expected[items]}")
+    for items in sorted(extra, key=sorted):
+        print(f"Unexpected pattern: {sorted(items)} #SUP: {actual[items]}")
+    for items in sorted(different, key=sorted):
+        print(f"Support mismatch for {sorted(items)}: {actual[items]} != {expected[items]}")
+
+    return not (missing or extra or different)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mine frequent itemsets with FP-Growth.")
+    parser.add_argument("formatted_txt", help="Transactions file produced by format.py")
+    parser.add_argument("minsup", type=float, help="Minimum relative support, e.g. 0.007")
+    parser.add_argument("results_txt", help="Output file for the frequent patterns")
+    parser.add_argument("--compare", metavar="SPMF_RESULTS", help="SPMF results file to compare against")
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+
+    print("Loading transactions...")
+    start = time.perf_counter()
+    counter = TransactionCounter()
+    with stage("read"):
+        counter.add_file(args.formatted_txt)
+    print(
+        f"Loaded {counter.n_transactions} transactions "
+        f"({len(counter.counts)} distinct) in {time.perf_counter() - start:.2f}s"
+    )
+
+    print("Mining frequent patterns...")
+    start = time.perf_counter()
+    with stage("mine"):
+        patterns = mine_frequent_patterns(counter, args.minsup)
+    print(f"Found {len(patterns)} frequent patterns in {time.perf_counter() - start:.2f}s")
+
+    with stage("write"):
+        write_patterns(patterns, args.results_txt)
+    print(f"Frequent patterns saved to {args.results_txt}")
+
+    if args.compare:
+        print(f"Comparing against {args.compare}...")
+        if compare_patterns(patterns, args.compare):
+            print("Patterns are identical to the SPMF results.")
+        else:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    with run():
+        main()
@@ -0,0 +1,340 @@
+"""
+This module loads the 311 Service Request dataset through a typed columnar cache shared by every
+analysis script.
+
+The first time a CSV file is loaded, it is parsed once and saved as a Parquet file under
+'./output/cache/'. Request categories (Subject, Reason, Type, Neighbourhood and Ward) are stored as
+categoricals and the "Open Date" and "Closed Date" columns are stored as pre-parsed datetimes, using
+the fixed-format parser in fast_datetime.py. The CSV file is converted in chunks with explicit
+column types, so the full dataset is never held in memory at once. The cache is rebuilt whenever
+the source CSV changes, which is detected by its size and modification time, falling back to a
+SHA-256 hash of its contents when only the modification time differs.
+
+The coordinates of each request are decoded from its Geometry once, while the cache is built, and
+stored in "Longitude" and "Latitude" columns (see spatial.py). Requests without a Geometry, or
+with a malformed one, have NaN coordinates; the number of malformed geometries is printed and saved
+in the cache metadata. Case IDs are stored as nullable integers: blank Case IDs are missing, and
+Case IDs that are not integers are missing too and counted and reported the same way.
+
+Scripts load only the columns they need, and can pass row filters (e.g. only service requests)
+that are applied while reading, so rejected rows are never converted into the returned DataFrame.
+Filters are given as a dictionary mapping a column to the value, or list of values, to keep:
+    load_dataset(csv_path, columns=["Type", "Open Date"], filters={"Subject": "Service Request"})
+
+The scripts that load the dataset accept --no-cache (see add_cache_argument), which reads the CSV
+file directly in filtered chunks instead, without building or reading the cache. Both paths return
+the same DataFrame.
+
+Requirements:
+
+The cache is written with pyarrow. Run the following command to install it:
+    pip install pyarrow
+
+Usage:
+    python ingest.py <311_request_dataset.csv>
+
+    Builds (or refreshes) the cache for the given dataset ahead of time.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fast_datetime import parse_datetimes
+from instrument import instrumented, run, stage
+from spatial import parse_points
+
+CACHE_DIR = "./output/cache"
+CACHE_VERSION = 4
+CHUNK_SIZE = 1_000_000
+
+DATE_COLUMNS = ["Open Date", "Closed Date"]
+CATEGORICAL_COLUMNS = ["Subject", "Reason", "Type", "Neighbourhood", "Ward"]
+INTEGER_COLUMNS = ["Case ID"]
+# Columns added to the cache, computed from the given column of the CSV file
+DERIVED_COLUMNS = {"Longitude": "Geometry", "Latitude": "Geometry"}
+
+
+def file_hash(path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_paths(csv_path):
+    """Return the (parquet, metadata) cache paths for a source CSV file."""
+    abs_path = os.path.abspath(csv_path)
+    name = os.path.splitext(os.path.basename(abs_path))[0]
+    key = hashlib.sha1(abs_path.encode("utf-8")).hexdigest()[:12]
+    base = os.path.join(CACHE_DIR, f"{name}-{key}")
+    return base + ".parquet", base + ".json"
+
+
+def _read_metadata(meta_path):
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_metadata(meta_path, metadata):
+    with open(meta_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def _cache_is_valid(csv_path, parquet_path, meta_path):
+    """
+    Check whether the cache for csv_path is up to date. A matching size and modification time is
+    trusted as is; if only the modification time differs, the contents are hashed and compared.
+    """
+    metadata = _read_metadata(meta_path)
+    if (
+        metadata is None
+        or metadata.get("version") != CACHE_VERSION
+        or not os.path.exists(parquet_path)
+    ):
+        return False
+
+    stat = os.stat(csv_path)
+    if stat.st_size != metadata["size"]:
+        return False
+    if stat.st_mtime_ns == metadata["mtime_ns"]:
+        return True
+
+    if file_hash(csv_path) != metadata["sha256"]:
+        return False
+
+    # Same contents, just touched - remember the new modification time
+    metadata["mtime_ns"] = stat.st_mtime_ns
+    _write_metadata(meta_path, metadata)
+    return True
+
+
+def csv_dtypes():
+    """
+    Return the explicit column types used to read the CSV file: categoricals for the request
+    categories and plain strings for everything else (including dates and IDs, which are parsed
+    afterwards).
+    """
+    dtypes = defaultdict(lambda: str)
+    dtypes.update({column: "category" for column in CATEGORICAL_COLUMNS})
+    return dtypes
+
+
+def parse_integers(values):
+    """
+    Parse a Series of integer strings. Returns (integers, malformed): a nullable Int64 Series, with
+    NA for missing and malformed values, and a boolean Series marking the values that are present
+    but not integers.
+    """
+    numbers = pd.to_numeric(values, errors="coerce")
+    # Non-integral numbers such as "12.5" are malformed too
+    numbers = numbers.where(np.floor(numbers) == numbers)
+    return numbers.astype("Int64"), values.notna() & numbers.isna()
+
+
+def read_csv_chunks(csv_path, columns=None, chunksize=CHUNK_SIZE):
+    """Read the given columns (all columns if None) of the CSV file in chunks of typed rows."""
+    return pd.read_csv(csv_path, usecols=columns, dtype=csv_dtypes(), chunksize=chunksize)
+
+
+def convert_to_columnar(df):
+    """
+    Convert a chunk of the raw 311 data to the typed layout stored in the cache. Returns the
+    converted chunk and a Counter of the number of malformed values in it, by column.
+    """
+    with stage("parse dates"):
+        for column in DATE_COLUMNS:
+            if column in df.columns:
+                df[column] = parse_datetimes(df[column], errors="coerce")
+    malformed = Counter()
+    for column in INTEGER_COLUMNS:
+        if column in df.columns:
+            df[column], is_malformed = parse_integers(df[column])
+            malformed[column] = int(is_malformed.sum())
+    if "Geometry" in df.columns:
+        with stage("parse geometry"):
+            longitudes, latitudes, is_malformed = parse_points(df["Geometry"])
+        df["Longitude"] = longitudes
+        df["Latitude"] = latitudes
+        malformed["Geometry"] = int(is_malformed.sum())
+    for column in df.columns:
+        # Parquet needs a single type per column; free-form text columns are kept as strings
+        if df[column].dtype == object:
+            df[column] = df[column].astype("string")
+    return df, malformed
+
+
+def _cache_schema(schema):
+    """
+    Return the schema used for every chunk written to the cache. Categorical columns are stored
+    with 32-bit dictionary indices, so chunks with different numbers of categories share a schema.
+    """
+    fields = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+@instrumented("build cache")
+def build_cache(csv_path):
+    """Parse the source CSV once and write it to the columnar cache. Returns the Parquet path."""
+    parquet_path, meta_path = cache_paths(csv_path)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    print(f"Building columnar cache for {csv_path}...")
+    stat = os.stat(csv_path)
+
+    # Write to a temporary file first so an interrupted build never leaves a partial cache behind
+    tmp_path = parquet_path + ".tmp"
+    writer = None
+    schema = None
+    rows = 0
+    malformed = Counter()
+    try:
+        for chunk in read_csv_chunks(csv_path):
+            chunk, chunk_malformed = convert_to_columnar(chunk)
+            malformed.update(chunk_malformed)
+            with stage("write"):
+                if writer is None:
+                    schema = _cache_schema(pa.Schema.from_pandas(chunk, preserve_index=False))
+                    writer = pq.ParquetWriter(tmp_path, schema)
+                writer.write_table(
+                    pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                )
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError(f"{csv_path} does not contain any rows.")
+    os.replace(tmp_path, parquet_path)
+    if malformed["Geometry"]:
+        print(f"Warning: {malformed['Geometry']} rows have a malformed Geometry (no coordinates).")
+    if malformed["Case ID"]:
+        print(f"Warning: {malformed['Case ID']} rows have a malformed Case ID (no Case ID).")
+
+    _write_metadata(
+        meta_path,
+        {
+            "version": CACHE_VERSION,
+            "source": os.path.abspath(csv_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_hash(csv_path),
+            "rows": rows,
+            "malformed_geometries": malformed["Geometry"],
+            "malformed_case_ids": malformed["Case ID"],
+        },
+    )
+    return parquet_path
+
+
+def ensure_cache(csv_path):
+    """Return the path of an up-to-date columnar cache for csv_path, building it if needed."""
+    parquet_path, meta_path = cache_paths(csv_path)
+    if not _cache_is_valid(csv_path, parquet_path, meta_path):
+        parquet_path = build_cache(csv_path)
+    return parquet_path
+
+
+def _filter_values(value):
+    return list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+
+
+def _parquet_filters(filters):
+    if not filters:
+        return None
+    return [(column, "in", _filter_values(value)) for column, value in filters.items()]
+
+
+def _concat_chunks(chunks, columns):
+    """Concatenate filtered chunks, merging the categories of categorical columns."""
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype=object) for column in columns or []})
+
+    df = pd.concat(chunks, ignore_index=True)
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            df[column] = pd.api.types.union_categoricals(
+                [chunk[column] for chunk in chunks], sort_categories=True
+            )
+    return df
+
+
+def read_csv_filtered(csv_path, columns=None, filters=None, chunksize=CHUNK_SIZE):
+    """
+    Load the given columns of the CSV file directly, without the cache, keeping only the rows that
+    match filters. Only the needed columns are parsed, and each chunk is filtered before its dates
+    are parsed and before it is kept.
+    """
+    filters = filters or {}
+    usecols = None
+    if columns is not None:
+        source_columns = [DERIVED_COLUMNS.get(column, column) for column in columns]
+        usecols = list(dict.fromkeys(source_columns + list(filters)))
+
+    chunks = []
+    for chunk in read_csv_chunks(csv_path, columns=usecols, chunksize=chunksize):
+        with stage("filter"):
+            for column, value in filters.items():
+                chunk = chunk[chunk[column].isin(_filter_values(value))]
+        chunk, _ = convert_to_columnar(chunk.copy())
+        if columns is not None:
+            chunk = chunk[list(columns)]
+        chunks.append(chunk)
+    return _concat_chunks(chunks, columns)
+
+
+def add_cache_argument(parser):
+    """Add the --no-cache option of the scripts that load the dataset to an argparse parser."""
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Read the CSV file directly instead of through the columnar cache",
+    )
+
+
+@instrumented("load")
+def load_dataset(csv_path, columns=None, filters=None, use_cache=True):
+    """
+    Load the 311 dataset, reading only the given columns (all columns if None) and only the rows
+    matching filters, a dictionary mapping columns to the value or list of values to keep. Date
+    columns are returned as datetime64 and request categories as categoricals.
+
+    By default the data is read from the columnar cache, which is built first if needed; with
+    use_cache=False, the CSV file is read directly in filtered chunks.
+    """
+    if not use_cache:
+        return read_csv_filtered(csv_path, columns=columns, filters=filters)
+
+    parquet_path = ensure_cache(csv_path)
+    # Rows are filtered while the cache is read
+    with stage("read cache"):
+        return pd.read_parquet(parquet_path, columns=columns, filters=_parquet_filters(filters))
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) != 1:
+        print("Usage: python ingest.py <311_request_dataset.csv>")
+        sys.exit(1)
+
+    parquet_path = ensure_cache(args[0])
+    print(f"Columnar cache ready: {parquet_path}")
+
+
+if __name__ == "__main__":
+    with run():
+        main()
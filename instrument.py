@@ -0,0 +1,372 @@
+"""
+This module records the wall time, CPU time and peak memory of the stages of a script run (loading,
+filtering, date parsing, grouping, decomposition, writing...), and saves them as a JSON report.
+
+A script wraps its run in run() and its stages in stage() (or decorates functions with
+instrumented()). Stages can be nested, and a stage entered several times (e.g. once per chunk) is
+reported once with its number of calls and total times.
+
+Recording is opt-in: it is enabled by the --report, --profile and --trace-memory options added by
+add_arguments(), or for any script by the INSTRUMENT_REPORT, INSTRUMENT_PROFILE and
+INSTRUMENT_TRACE_MEMORY environment variables. Otherwise, run() and stage() do nothing: no report
+is written and the process is left untouched, so library functions can be instrumented at no cost.
+
+For every stage, the report holds:
+    - wall_s: elapsed wall-clock time,
+    - cpu_s: CPU time of the process (all threads),
+    - child_cpu_s: CPU time of finished child processes (e.g. process pool workers),
+    - peak_rss_mb: peak resident memory of the process during the stage. On Linux, the peak is
+      reset when each stage starts (through /proc/self/clear_refs); where it cannot be reset, it is
+      the peak since the process started, and where it cannot be read (e.g. Windows without the
+      resource module), it is null. The report's peak_rss_scope tells which applies.
+
+One stage can also be profiled with cProfile (--profile STAGE), and the memory allocations of one
+stage traced with tracemalloc (--trace-memory STAGE). Stage names match either the full name of a
+nested stage ("load/parse dates") or its last part ("parse dates").
+
+Reports are saved to './output/reports/<script>-<date>-<time>-<pid>.json', with the cProfile
+statistics of the profiled stage next to them (.prof).
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: CPU times of child processes and peak memory are not recorded
+    resource = None
+
+REPORTS_DIR = "./output/reports"
+REPORT_ENV = "INSTRUMENT_REPORT"
+PROFILE_ENV = "INSTRUMENT_PROFILE"
+TRACE_MEMORY_ENV = "INSTRUMENT_TRACE_MEMORY"
+# Number of functions and source lines listed in the report for profiled and traced stages
+TOP_ENTRIES = 20
+
+_current_run = None
+# Start times and script name of the run in progress, whether or not it is recorded
+_run_start = None
+
+
+def _read_peak_rss():
+    """
+    Return the peak resident memory of the process in bytes (0 if it cannot be read), and whether
+    it is read from /proc, where it can be reset.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024, True
+    except OSError:
+        pass
+    return _max_rss(), False
+
+
+def _max_rss():
+    """Return the peak resident memory of the process since it started, in bytes (0 if unknown)."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _reset_peak_rss():
+    """Reset the peak resident memory of the process to its current size (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _child_cpu_time():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").lower() not in ("", "0", "false", "no")
+
+
+def git_commit():
+    """Return the commit of the repository the scripts are run from, or None."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Run:
+    """The stages recorded during a script run."""
+
+    def __init__(self, script, profile=None, trace_memory=None):
+        self.script = script
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.total = {}
+        self.stages = {}
+        # Stack of (path, peak RSS seen so far) of the stages being run
+        self.stack = []
+        # Peak RSS of the whole run, as resetting the peak for each stage loses the process's peak
+        self.peak_rss, from_proc = _read_peak_rss()
+        if from_proc and _reset_peak_rss():
+            self.peak_rss_scope = "stage"
+        elif from_proc:
+            self._warn_no_reset()
+            self.peak_rss_scope = "process"
+        else:
+            self.peak_rss_scope = "process" if self.peak_rss else "unavailable"
+        self.profiler = None
+        self.memory_stats = None
+        self.traced_peak = 0
+
+    def _warn_no_reset(self):
+        print(
+            "Peak memory cannot be reset (/proc/self/clear_refs is not writable): "
+            "stage peaks are the peak of the process so far."
+        )
+
+    def _matches(self, path, name):
+        return name is not None and (path == name or path.rsplit("/", 1)[-1] == name)
+
+    def _peak_mb(self, peak):
+        return None if self.peak_rss_scope == "unavailable" else peak / 2**20
+
+    @contextmanager
+    def stage(self, name):
+        path = f"{self.stack[-1][0]}/{name}" if self.stack else name
+        peak, _ = _read_peak_rss()
+        self.peak_rss = max(self.peak_rss, peak)
+        if self.stack:
+            # Resetting the peak for this stage must not lose the peak of the enclosing stage
+            self.stack[-1][1] = max(self.stack[-1][1], peak)
+        if self.peak_rss_scope == "stage" and not _reset_peak_rss():
+            self._warn_no_reset()
+            self.peak_rss_scope = "process"
+        self.stack.append([path, 0])
+
+        profiled = self._matches(path, self.profile)
+        traced = self._matches(path, self.trace_memory) and not tracemalloc.is_tracing()
+        if profiled:
+            self.profiler = self.profiler or cProfile.Profile()
+            self.profiler.enable()
+        if traced:
+            tracemalloc.start()
+
+        wall, cpu, child_cpu = time.perf_counter(), time.process_time(), _child_cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            child_cpu = _child_cpu_time() - child_cpu
+            if profiled:
+                self.profiler.disable()
+            if traced:
+                snapshot = tracemalloc.take_snapshot()
+                self.traced_peak = max(self.traced_peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                self.memory_stats = [
+                    str(statistic) for statistic in snapshot.statistics("lineno")[:TOP_ENTRIES]
+                ]
+
+            _, stage_peak = self.stack.pop()
+            stage_peak = max(stage_peak, _read_peak_rss()[0])
+            self.peak_rss = max(self.peak_rss, stage_peak)
+            if self.stack:
+                self.stack[-1][1] = max(self.stack[-1][1], stage_peak)
+
+            record = self.stages.setdefault(
+                path,
+                {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "child_cpu_s": 0.0, "peak_rss_mb": None},
+            )
+            record["calls"] += 1
+            record["wall_s"] += wall
+            record["cpu_s"] += cpu
+            record["child_cpu_s"] += child_cpu
+            stage_peak = self._peak_mb(stage_peak)
+            if stage_peak is not None:
+                record["peak_rss_mb"] = max(record["peak_rss_mb"] or 0.0, stage_peak)
+
+    def report(self):
+        stages = {
+            path: {
+                key: round(value, 4) if isinstance(value, float) else value
+                for key, value in record.items()
+            }
+            for path, record in self.stages.items()
+        }
+        return {
+            "script": self.script,
+            "argv": sys.argv[1:],
+            "started": self.started,
+            "git_commit": git_commit(),
+            "python": sys.version.split()[0],
+            "peak_rss_scope": self.peak_rss_scope,
+            "total": self.total,
+            "stages": stages,
+        }
+
+    def save(self, reports_dir=REPORTS_DIR):
+        """Save the report (and cProfile statistics) to reports_dir. Returns the report's path."""
+        os.makedirs(reports_dir, exist_ok=True)
+        base = os.path.join(
+            reports_dir, f"{self.script}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        )
+        report = self.report()
+
+        if self.profiler is not None:
+            self.profiler.dump_stats(base + ".prof")
+            text = io.StringIO()
+            pstats.Stats(self.profiler, stream=text).sort_stats("cumulative").print_stats(
+                TOP_ENTRIES
+            )
+            report["profile"] = {
+                "stage": self.profile,
+                "stats_file": base + ".prof",
+                "top_functions": [line for line in text.getvalue().splitlines() if line.strip()],
+            }
+        if self.memory_stats is not None:
+            report["memory_trace"] = {
+                "stage": self.trace_memory,
+                "traced_peak_mb": round(self.traced_peak / 2**20, 1),
+                "top_allocations": self.memory_stats,
+            }
+
+        with open(base + ".json", "w") as f:
+            json.dump(report, f, indent=2)
+        return base + ".json"
+
+
+def _options(args):
+    """Return the (report, profile, trace_memory) options of parsed arguments, or of the env."""
+    return (
+        getattr(args, "report", False) or _env_flag(REPORT_ENV),
+        getattr(args, "profile", None) or os.environ.get(PROFILE_ENV),
+        getattr(args, "trace_memory", None) or os.environ.get(TRACE_MEMORY_ENV),
+    )
+
+
+def _start(args):
+    """Start recording the current run if reporting was asked for by args or the environment."""
+    global _current_run
+    report, profile, trace_memory = _options(args)
+    if _current_run is None and (report or profile or trace_memory):
+        _current_run = Run(_run_start["script"], profile=profile, trace_memory=trace_memory)
+
+
+@contextmanager
+def run(args=None, script=None, reports_dir=REPORTS_DIR):
+    """
+    Wrap a script run, recording its stages and saving its report when it ends (even if it fails)
+    if reporting is enabled by the options parsed in args (see add_arguments) or the environment.
+    """
+    global _current_run, _run_start
+    if script is None:
+        script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+    _run_start = {
+        "script": script,
+        "wall": time.perf_counter(),
+        "cpu": time.process_time(),
+        "child_cpu": _child_cpu_time(),
+    }
+    _start(args)
+    try:
+        yield _current_run
+    finally:
+        if _current_run is not None:
+            peak = max(_current_run.peak_rss, _read_peak_rss()[0])
+            peak = _current_run._peak_mb(peak)
+            _current_run.total = {
+                "wall_s": round(time.perf_counter() - _run_start["wall"], 4),
+                "cpu_s": round(time.process_time() - _run_start["cpu"], 4),
+                "child_cpu_s": round(_child_cpu_time() - _run_start["child_cpu"], 4),
+                "peak_rss_mb": None if peak is None else round(peak, 4),
+            }
+            path = _current_run.save(reports_dir)
+            print(f"Timing report saved to {path}")
+        _current_run = None
+        _run_start = None
+
+
+@contextmanager
+def stage(name):
+    """Record a stage of the current run, if any."""
+    if _current_run is None:
+        yield
+    else:
+        with _current_run.stage(name):
+            yield
+
+
+def instrumented(name=None):
+    """Decorator recording every call of a function as a stage (named after it by default)."""
+
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _current_run is None:
+                return function(*args, **kwargs)
+            with _current_run.stage(stage_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def configure(args):
+    """
+    Apply the options parsed by a parser with add_arguments to the current run, for scripts that
+    parse their arguments after the run has started.
+    """
+    if _run_start is None:
+        return
+    if _current_run is None:
+        _start(args)
+    else:
+        _, profile, trace_memory = _options(args)
+        _current_run.profile = profile or _current_run.profile
+        _current_run.trace_memory = trace_memory or _current_run.trace_memory
+
+
+def add_arguments(parser):
+    """Add the --report, --profile and --trace-memory options to an argparse parser."""
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help=f"Save a timing report of the run's stages to {REPORTS_DIR}",
+    )
+    parser.add_argument(
+        "--profile", metavar="STAGE", default=None, help="Profile a stage with cProfile"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        metavar="STAGE",
+        default=None,
+        help="Trace the memory allocations of a stage with tracemalloc",
+    )
@@ -4,45 +4,138 @@ value from each Excel file that contains census data for a Winnipeg neighbourhoo
 
 The neighbourhood populations are outputted as a CSV file 'winnipeg_neighbourhood_populations.xlsx'.
 
+The population is read from cell B55 of each workbook, which is opened in read-only mode so only
+the rows up to that cell are parsed. Workbooks are read in parallel in a pool of worker processes,
+and the population of each one is cached in './output/cache/population_cache.json' by the
+SHA-256 hash of the file, so workbooks that have not changed are skipped when the script is rerun.
+
 Usage:
-    python parse_population.py <directory_containting_excel_files>
+    python parse_population.py <directory_containting_excel_files> [--workers N]
 """
 
-import sys
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+from openpyxl import load_workbook
+from instrument import add_arguments, run, stage
 from pathlib import Path
 
-def extract_population_data(directory):
+CACHE_FILE = './output/cache/population_cache.json'
+# The population is in cell B55 of the first worksheet
+POPULATION_ROW = 55
+POPULATION_COLUMN = 2
+
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_population(excel_file):
+    """
+    Read the population cell of an Excel file. The workbook is opened in read-only mode, which
+    streams the worksheet and stops at the population row instead of loading every cell.
+    Returns the population as an integer, or None if the cell is empty.
+    """
+    workbook = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(
+            min_row=POPULATION_ROW,
+            max_row=POPULATION_ROW,
+            min_col=POPULATION_COLUMN,
+            max_col=POPULATION_COLUMN,
+            values_only=True,
+        )
+        population = next(rows, (None,))[0]
+    finally:
+        workbook.close()
+
+    if population is None or (isinstance(population, str) and not population.strip()):
+        return None
+    return int(population)
+
+
+def _read_population_safely(excel_file):
+    """Return (population, error message) for an Excel file, for use in worker processes."""
+    try:
+        return read_population(excel_file), None
+    except Exception as e:
+        return None, str(e)
+
+
+def load_cache(cache_file):
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_cache(cache_file, cache):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with open(cache_file, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def extract_population_data(directory, workers=None, cache_file=CACHE_FILE):
     """
     Recursively search through directory for xlsx files and extract population data.
     Returns a list of tuples containing (neighbourhood_name, population).
+
+    Workbooks are read in a pool of worker processes. The population of every workbook is cached
+    by the hash of its contents, so unchanged workbooks are not read again on later runs.
     """
-    population_data = []
-    
     # Use pathlib to recursively find all xlsx files
-    for excel_file in Path(directory).rglob('*.xlsx'):
-        try:
-            # Get neighbourhood name from filename (without extension)
-            neighbourhood = excel_file.stem
-            
-            # Read the Excel file
-            df = pd.read_excel(excel_file, header=None)
-            
-            # Extract population from cell B55 (0-based indexing, so row 54, column 1)
-            population = df.iloc[54, 1]
-            
-            # Convert to integer and handle any potential NaN values
-            if pd.notna(population):
-                population = int(population)
-                population_data.append((neighbourhood, population))
-                print(f"Processed {neighbourhood}: Population = {population}")
-            else:
-                print(f"Warning: No population data found in {excel_file}")
-                
-        except Exception as e:
-            print(f"Error processing {excel_file}: {str(e)}")
+    excel_files = sorted(Path(directory).rglob('*.xlsx'))
+    cache = load_cache(cache_file)
+    digests = [file_hash(excel_file) for excel_file in excel_files]
+
+    # Read the workbooks that are not cached yet
+    to_read = sorted({
+        digest: excel_file for excel_file, digest in zip(excel_files, digests)
+        if digest not in cache
+    }.items())
+    results = {}
+    if to_read:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            read = executor.map(
+                _read_population_safely,
+                [excel_file for _, excel_file in to_read],
+                chunksize=max(1, len(to_read) // (4 * (workers or os.cpu_count() or 1))),
+            )
+            for (digest, _), result in zip(to_read, read):
+                results[digest] = result
+                population, error = result
+                if error is None:
+                    cache[digest] = population
+        save_cache(cache_file, cache)
+    print(f"Read {len(to_read)} workbooks, {len(excel_files) - len(to_read)} unchanged (cached).")
+
+    population_data = []
+    for excel_file, digest in zip(excel_files, digests):
+        # Get neighbourhood name from filename (without extension)
+        neighbourhood = excel_file.stem
+
+        if digest in cache:
+            population = cache[digest]
+        else:
+            print(f"Error processing {excel_file}: {results[digest][1]}")
             continue
-    
+
+        if population is not None:
+            population_data.append((neighbourhood, population))
+            print(f"Processed {neighbourhood}: Population = {population}")
+        else:
+            print(f"Warning: No population data found in {excel_file}")
+
     return population_data
 
 def create_summary_spreadsheet(population_data, output_file):
@@ -66,23 +159,41 @@ def create_summary_spreadsheet(population_data, output_file):
     print(f"Total Population: {total_population:,.0f}")
     print(f"Average Neighbourhood Population: {avg_population:,.1f}")
 
-def main():
+def main(input_dir='winnipeg_census_2021', workers=None):
     # Directory containing the census data
-    args = sys.argv[1:]
-    input_dir = args[0] if args else 'winnipeg_census_2021'
     output_file = 'winnipeg_neighbourhood_populations.xlsx'
     
     print(f"Searching for Excel files in {input_dir}...")
     
     # Extract population data
-    population_data = extract_population_data(input_dir)
+    with stage("parse"):
+        population_data = extract_population_data(input_dir, workers=workers)
     
     if population_data:
         print(f"\nCreating summary spreadsheet...")
-        create_summary_spreadsheet(population_data, output_file)
+        with stage("write"):
+            create_summary_spreadsheet(population_data, output_file)
         print(f"\nSummary spreadsheet created: {output_file}")
     else:
         print("No population data found.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Extract neighbourhood populations from the census Excel files."
+    )
+    parser.add_argument(
+        "input_dir",
+        nargs="?",
+        default="winnipeg_census_2021",
+        help="Directory containing the census Excel files",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (defaults to the number of CPUs)",
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+    with run(args):
+        main(args.input_dir, workers=args.workers)
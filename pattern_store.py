@@ -0,0 +1,311 @@
+"""
+This module loads frequent patterns into compact NumPy arrays that can be queried repeatedly, for
+exploring the results of FP-Growth without rescanning them.
+
+Patterns are read once, either from an SPMF results file and its keys file (as written by
+format.py and fpgrowth.py or SPMF) or from a CSV file of formatted patterns (as written by
+format_results.py), and stored as:
+    - the items of every pattern, concatenated in one int32 array with the offset of each pattern
+      (compressed sparse rows), and the support of every pattern,
+    - the name of every item, in an array indexed by item ID,
+    - a bitmask of the item categories present in every pattern, from the suffix of each item
+      name: _R (Reason), _T (Type), _N (Neighbourhood) and _W (Ward),
+    - an inverted index from every item to the sorted IDs of the patterns containing it, and from
+      every category bitmask to the IDs of the patterns with that mask.
+
+A query intersects the pattern lists of the requested items, or gathers the patterns of the
+matching category masks, and then filters by support, so most queries only touch the patterns
+they return. The arrays can be saved to and loaded from an NPZ file.
+
+Usage:
+    python pattern_store.py <keys.txt> <results.txt> [--item NAME ...] [--min-support S]
+        [--categories RTNW] [--any-categories RTNW] [--limit N]
+
+    Loads the patterns and prints those matching the query, e.g. all patterns containing a
+    neighbourhood and a type with support of at least 1000:
+        python pattern_store.py output/keys.txt output/results.txt --categories NT --min-support 1000
+"""
+
+import argparse
+import csv
+import time
+import numpy as np
+
+CATEGORY_SUFFIXES = ["_R", "_T", "_N", "_W"]
+CATEGORY_BITS = {suffix[1]: 1 << i for i, suffix in enumerate(CATEGORY_SUFFIXES)}
+# Items within a pattern are listed by category, in the order used by format_results.py
+ITEM_SORT_ORDER = {suffix: i for i, suffix in enumerate(CATEGORY_SUFFIXES)}
+
+
+def category_mask(categories):
+    """Return the bitmask of a string of category letters, e.g. "NT"."""
+    mask = 0
+    for letter in categories.upper():
+        if letter not in CATEGORY_BITS:
+            raise ValueError(f"Unknown item category: {letter!r} (expected one of R, T, N, W)")
+        mask |= CATEGORY_BITS[letter]
+    return mask
+
+
+def item_category(name):
+    """Return the category bit of an item name from its suffix, or 0 if it has none."""
+    return CATEGORY_BITS.get(name[-1], 0) if name[-2:-1] == "_" else 0
+
+
+def _inverted_index(keys, n_keys, values):
+    """
+    Group values by their key. Returns (offsets, grouped): the values with key k are
+    grouped[offsets[k]:offsets[k + 1]], in their original order.
+    """
+    order = np.argsort(keys, kind="stable")
+    offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n_keys), out=offsets[1:])
+    return offsets, values[order]
+
+
+class PatternStore:
+    """
+    Frequent patterns in compressed sparse rows, with an inverted index by item and by category.
+
+    Attributes:
+        item_names: array of the name of every item, indexed by item ID.
+        offsets: int64 array; the items of pattern i are items[offsets[i]:offsets[i + 1]].
+        items: int32 array of the item IDs of every pattern, concatenated.
+        supports: int64 array of the support of every pattern.
+    """
+
+    def __init__(self, item_names, offsets, items, supports):
+        self.item_names = np.asarray(item_names, dtype=object)
+        self.offsets = offsets
+        self.items = items
+        self.supports = supports
+        self.item_ids = {name: i for i, name in enumerate(self.item_names) if name is not None}
+
+        lengths = np.diff(offsets)
+        pattern_ids = np.repeat(np.arange(len(supports), dtype=np.int64), lengths)
+        self.lengths = lengths
+
+        # Category bitmask of every item, and of every pattern
+        item_masks = np.array(
+            [item_category(name) if name is not None else 0 for name in self.item_names],
+            dtype=np.uint8,
+        )
+        self.masks = np.zeros(len(supports), dtype=np.uint8)
+        np.bitwise_or.at(self.masks, pattern_ids, item_masks[items])
+
+        self.item_offsets, self.item_patterns = _inverted_index(
+            items, len(self.item_names), pattern_ids
+        )
+        self.mask_offsets, self.mask_patterns = _inverted_index(
+            self.masks, 1 << len(CATEGORY_SUFFIXES), np.arange(len(supports), dtype=np.int64)
+        )
+
+    def __len__(self):
+        return len(self.supports)
+
+    @classmethod
+    def from_lists(cls, item_names, patterns):
+        """Build a store from an array of item names and a list of (item IDs, support) tuples."""
+        lengths = np.fromiter((len(items) for items, _ in patterns), dtype=np.int64)
+        offsets = np.zeros(len(patterns) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        items = np.fromiter(
+            (item for pattern_items, _ in patterns for item in pattern_items),
+            dtype=np.int32,
+            count=int(offsets[-1]),
+        )
+        supports = np.fromiter((support for _, support in patterns), dtype=np.int64)
+        return cls(item_names, offsets, items, supports)
+
+    @classmethod
+    def from_spmf(cls, keys_txt, results_txt):
+        """
+        Load the patterns of an SPMF results file, naming items with its keys file. Patterns are
+        ordered by length and then by decreasing support, and the items of each pattern by
+        category, as in the output of format_results.py.
+        """
+        keys = {}
+        with open(keys_txt, "r") as f:
+            for line in f:
+                if line.startswith("@ITEM="):
+                    parts = line.split("=")
+                    keys[int(parts[1])] = parts[2].strip()
+        item_names = np.full(max(keys, default=-1) + 1, None, dtype=object)
+        for item, name in keys.items():
+            item_names[item] = name
+
+        def item_order(item):
+            return ITEM_SORT_ORDER.get(item_names[item][-2:], len(ITEM_SORT_ORDER))
+
+        patterns = []
+        with open(results_txt, "r") as f:
+            for line in f:
+                items, _, support = line.partition("#SUP:")
+                if not support:
+                    continue
+                patterns.append(
+                    (sorted(map(int, items.split()), key=item_order), int(support))
+                )
+        # Python's sort is stable, so patterns with equal keys keep their order in the file
+        patterns.sort(key=lambda pattern: (len(pattern[0]), -pattern[1]))
+        return cls.from_lists(item_names, patterns)
+
+    @classmethod
+    def from_csv(cls, patterns_csv):
+        """
+        Load the patterns of a CSV file with one pattern per row: its item names followed by its
+        support, as written by format_results.py. Patterns keep their order in the file.
+        """
+        item_ids = {}
+        patterns = []
+        with open(patterns_csv, "r", newline="") as f:
+            for row in csv.reader(f):
+                if not row:
+                    continue
+                items = [item_ids.setdefault(name, len(item_ids)) for name in row[:-1]]
+                patterns.append((items, int(row[-1])))
+        return cls.from_lists(list(item_ids), patterns)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                item_names=np.array(
+                    ["" if name is None else name for name in self.item_names], dtype=str
+                ),
+                offsets=self.offsets,
+                items=self.items,
+                supports=self.supports,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            item_names = [name if name else None for name in data["item_names"].tolist()]
+            return cls(item_names, data["offsets"], data["items"], data["supports"])
+
+    def patterns_with_item(self, name):
+        """Return the sorted IDs of the patterns containing an item."""
+        item = self.item_ids.get(name)
+        if item is None:
+            return np.empty(0, dtype=np.int64)
+        return self.item_patterns[self.item_offsets[item] : self.item_offsets[item + 1]]
+
+    def query(
+        self,
+        items=(),
+        min_support=None,
+        max_support=None,
+        categories="",
+        any_categories="",
+        exclude_categories="",
+        length=None,
+    ):
+        """
+        Return the sorted IDs of the patterns that:
+            - contain every item in items,
+            - have a support between min_support and max_support (inclusive),
+            - contain items of every category in categories (e.g. "NT"),
+            - contain items of at least one category in any_categories,
+            - contain no item of a category in exclude_categories,
+            - have the given number of items.
+        """
+        required = category_mask(categories)
+        any_mask = category_mask(any_categories)
+        excluded = category_mask(exclude_categories)
+
+        if items:
+            candidates = None
+            for name in items:
+                ids = self.patterns_with_item(name)
+                candidates = ids if candidates is None else np.intersect1d(
+                    candidates, ids, assume_unique=True
+                )
+        else:
+            # Gather the patterns of every category mask that matches the query
+            mask_values = np.arange(len(self.mask_offsets) - 1)
+            matching = (
+                ((mask_values & required) == required)
+                & (((mask_values & any_mask) != 0) | (any_mask == 0))
+                & ((mask_values & excluded) == 0)
+            )
+            if matching.all():
+                candidates = np.arange(len(self), dtype=np.int64)
+            else:
+                candidates = np.sort(
+                    np.concatenate(
+                        [
+                            self.mask_patterns[self.mask_offsets[m] : self.mask_offsets[m + 1]]
+                            for m in np.flatnonzero(matching)
+                        ]
+                        + [np.empty(0, dtype=np.int64)]
+                    )
+                )
+            required = any_mask = excluded = 0
+
+        keep = np.ones(len(candidates), dtype=bool)
+        masks = self.masks[candidates]
+        if required:
+            keep &= (masks & required) == required
+        if any_mask:
+            keep &= (masks & any_mask) != 0
+        if excluded:
+            keep &= (masks & excluded) == 0
+        if min_support is not None:
+            keep &= self.supports[candidates] >= min_support
+        if max_support is not None:
+            keep &= self.supports[candidates] <= max_support
+        if length is not None:
+            keep &= self.lengths[candidates] == length
+        return candidates[keep]
+
+    def pattern(self, pattern_id):
+        """Return the (item names, support) of a pattern."""
+        items = self.items[self.offsets[pattern_id] : self.offsets[pattern_id + 1]]
+        return list(self.item_names[items]), int(self.supports[pattern_id])
+
+    def rows(self, pattern_ids=None):
+        """Yield the CSV rows (item names followed by the support) of the given patterns."""
+        if pattern_ids is None:
+            pattern_ids = range(len(self))
+        for pattern_id in pattern_ids:
+            names, support = self.pattern(pattern_id)
+            yield names + [support]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query frequent patterns.")
+    parser.add_argument("keys_txt", help="Keys file mapping item numbers to names")
+    parser.add_argument("results_txt", help="SPMF results file with the frequent patterns")
+    parser.add_argument(
+        "--item", action="append", default=[], help="Item the patterns must contain (repeatable)"
+    )
+    parser.add_argument("--min-support", type=int, default=None, help="Minimum support")
+    parser.add_argument(
+        "--categories", default="", help="Categories the patterns must all contain, e.g. NT"
+    )
+    parser.add_argument(
+        "--any-categories", default="", help="Categories the patterns must contain at least one of"
+    )
+    parser.add_argument("--limit", type=int, default=20, help="Number of patterns to print")
+    args = parser.parse_args()
+
+    print("Loading patterns...")
+    store = PatternStore.from_spmf(args.keys_txt, args.results_txt)
+    print(f"Loaded {len(store)} patterns of {len(store.item_ids)} items.")
+
+    start = time.perf_counter()
+    pattern_ids = store.query(
+        items=args.item,
+        min_support=args.min_support,
+        categories=args.categories,
+        any_categories=args.any_categories,
+    )
+    elapsed = time.perf_counter() - start
+    print(f"{len(pattern_ids)} matching patterns ({elapsed * 1000:.3f} ms):")
+    for row in store.rows(pattern_ids[: args.limit]):
+        print(", ".join(map(str, row)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+This script joins the 311 service requests with the neighbourhood populations produced by
+parse_population.py, and computes per-capita request rates for every neighbourhood, request type
+and period.
+
+The request counts and total case durations of every (Neighbourhood, Type, period) combination
+are computed in one grouped pass over the columnar dataset: each request is reduced to the integer
+codes of its neighbourhood, type and period, and the combinations are totalled with np.bincount.
+Populations are then joined to the distinct neighbourhoods only, through an index of normalised
+neighbourhood names (case, accents, punctuation and abbreviations such as "St." are ignored), so
+no per-request join is ever materialised.
+
+Neighbourhoods of the 311 data without a matching population are listed, and their rates are
+left empty.
+
+Usage:
+    python per_capita_rates.py <311_request_dataset.csv> [--population POPULATION_FILE]
+        [--period {year,quarter,month}] [--no-cache]
+
+    POPULATION_FILE is the spreadsheet (or CSV file) produced by parse_population.py, with
+    Neighbourhood and Population columns ('winnipeg_neighbourhood_populations.xlsx' by default).
+
+Output:
+    './output/per_capita_rates.csv'
+"""
+
+import argparse
+import os
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from ingest import add_cache_argument, load_dataset
+from instrument import add_arguments, run, stage
+
+POPULATION_FILE = "winnipeg_neighbourhood_populations.xlsx"
+OUTPUT_FILE = "./output/per_capita_rates.csv"
+PERIOD_FREQUENCIES = {"year": "Y", "quarter": "Q", "month": "M"}
+# Rates are given per this many residents
+RATE_BASE = 1000
+
+WORD_ALIASES = {"st": "saint", "ste": "sainte", "mt": "mount"}
+
+
+def normalise_name(name):
+    """Return a neighbourhood name reduced to lowercase ASCII words, with abbreviations expanded."""
+    text = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii")
+    text = text.lower().replace("&", " and ")
+    words = re.findall(r"[a-z0-9]+", text)
+    return " ".join(WORD_ALIASES.get(word, word) for word in words)
+
+
+def read_populations(population_file):
+    """Read the Neighbourhood and Population columns of the file produced by parse_population.py."""
+    if population_file.endswith(".csv"):
+        populations = pd.read_csv(population_file)
+    else:
+        populations = pd.read_excel(population_file)
+    return populations[["Neighbourhood", "Population"]]
+
+
+def population_index(populations):
+    """Return a Series of populations indexed by normalised neighbourhood name."""
+    names = populations["Neighbourhood"].map(normalise_name)
+    duplicated = names.duplicated(keep="first")
+    if duplicated.any():
+        print(
+            "Warning: ignoring populations with duplicate names: "
+            + ", ".join(populations.loc[duplicated, "Neighbourhood"].astype(str))
+        )
+    return pd.Series(
+        populations["Population"].to_numpy()[~duplicated], index=names[~duplicated].to_numpy()
+    )
+
+
+def aggregate_requests(df, freq):
+    """
+    Count the requests and total the case durations of every (Neighbourhood, Type, period)
+    combination of df in one pass. Returns a DataFrame with one row per combination with requests.
+    """
+    periods = df["Open Date"].dt.to_period(freq)
+    neighbourhood_codes, neighbourhoods = pd.factorize(df["Neighbourhood"], sort=True)
+    type_codes, types = pd.factorize(df["Type"], sort=True)
+    period_codes, period_values = pd.factorize(periods, sort=True)
+
+    # Requests without a neighbourhood, type or open date cannot be grouped
+    known = (neighbourhood_codes >= 0) & (type_codes >= 0) & (period_codes >= 0)
+    n_types, n_periods = len(types), len(period_values)
+    keys = (
+        neighbourhood_codes[known].astype(np.int64) * n_types + type_codes[known]
+    ) * n_periods + period_codes[known]
+
+    # Only closed cases with a positive duration count towards the case durations
+    durations = (
+        (df["Closed Date"] - df["Open Date"]).dt.total_seconds().to_numpy()[known] / 3600
+    )
+    closed = durations > 0
+
+    combinations, inverse = np.unique(keys, return_inverse=True)
+    requests = np.bincount(inverse, minlength=len(combinations))
+    closed_requests = np.bincount(inverse, weights=closed, minlength=len(combinations))
+    total_durations = np.bincount(
+        inverse, weights=np.where(closed, durations, 0.0), minlength=len(combinations)
+    )
+
+    neighbourhood_index, rest = np.divmod(combinations, n_types * n_periods)
+    type_index, period_index = np.divmod(rest, n_periods)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_durations = total_durations / closed_requests
+    return pd.DataFrame(
+        {
+            "Neighbourhood": np.asarray(neighbourhoods)[neighbourhood_index],
+            "Type": np.asarray(types)[type_index],
+            "Period": np.asarray(period_values.astype(str))[period_index],
+            "Requests": requests,
+            "Total case duration (hours)": total_durations.round(2),
+            "Mean case duration (hours)": mean_durations.round(2),
+        }
+    )
+
+
+def main(dataset_csv, population_file=POPULATION_FILE, period="year", use_cache=True):
+    print("Reading dataset...")
+    df = load_dataset(
+        dataset_csv,
+        columns=["Neighbourhood", "Type", "Open Date", "Closed Date"],
+        filters={"Subject": "Service Request"},
+        use_cache=use_cache,
+    )
+
+    print("Aggregating requests...")
+    with stage("group"):
+        rates = aggregate_requests(df, PERIOD_FREQUENCIES[period])
+
+    print("Joining populations...")
+    populations = population_index(read_populations(population_file))
+    # Match each distinct neighbourhood once, then broadcast the populations to the rows
+    neighbourhoods = pd.Index(rates["Neighbourhood"].unique())
+    matched = pd.Series(
+        populations.reindex(neighbourhoods.map(normalise_name)).to_numpy(),
+        index=neighbourhoods,
+    )
+    unmatched = matched.index[matched.isna()]
+    if len(unmatched):
+        print(f"Warning: no population found for {len(unmatched)} neighbourhoods:")
+        for neighbourhood in unmatched:
+            print(f"    {neighbourhood}")
+
+    rates["Population"] = matched.reindex(rates["Neighbourhood"]).to_numpy()
+    rates["Population"] = rates["Population"].astype("Int64")
+    rates[f"Requests per {RATE_BASE:,} residents"] = (
+        rates["Requests"] / rates["Population"] * RATE_BASE
+    ).round(3)
+    rates[f"Case duration (hours) per {RATE_BASE:,} residents"] = (
+        rates["Total case duration (hours)"] / rates["Population"] * RATE_BASE
+    ).round(3)
+    rates = rates.sort_values(["Period", "Neighbourhood", "Type"])
+
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    with stage("write"):
+        rates.to_csv(OUTPUT_FILE, index=False)
+    print(
+        f"Saved {len(rates)} (neighbourhood, type, period) rates of "
+        f"{len(neighbourhoods) - len(unmatched)} neighbourhoods to {OUTPUT_FILE}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute per-capita service request rates by neighbourhood, type and period."
+    )
+    parser.add_argument("dataset_csv", help="Path to the 311 dataset CSV file")
+    parser.add_argument(
+        "--population",
+        default=POPULATION_FILE,
+        help="Neighbourhood populations produced by parse_population.py",
+    )
+    parser.add_argument(
+        "--period",
+        choices=list(PERIOD_FREQUENCIES),
+        default="year",
+        help="Length of the periods the rates are computed for",
+    )
+    add_cache_argument(parser)
+    add_arguments(parser)
+    args = parser.parse_args()
+    with run(args):
+        main(
+            args.dataset_csv,
+            population_file=args.population,
+            period=args.period,
+            use_cache=not args.no_cache,
+        )
@@ -4,40 +4,195 @@ Winnipeg Census 2021 website.
 
 The downloaded files are placed in a new directory named `winnipeg_census_2021`.
 
+Cluster pages and Excel files are downloaded by a pool of worker threads sharing one HTTP session,
+so connections to the server are reused. Requests are spaced out to at most --rate requests per
+second across all workers, and failed requests (connection errors and 429/5xx responses) are
+retried with an exponential backoff. Retries count towards the rate like any other request.
+
+The ETag and Last-Modified headers of every downloaded file are saved in a manifest
+(`manifest.json` in the download directory). On later runs, files that are already downloaded are
+requested conditionally and skipped if the server reports them unchanged; files whose contents are
+identical to the copy on disk are not rewritten either. Use --force to download everything again.
+
+The site can be replaced with --base-url, e.g. to run against a local copy of the cluster pages.
+
 Requirements:
 
 This script uses the BeautifulSoup library. Run the following command to install it"
     pip install requests beautifulsoup4
 
 Usage:
-    python scrape_census.py
+    python scrape_census.py [--base-url URL] [--output-dir DIR] [--workers N] [--rate R]
+        [--retries N] [--force]
 
 """
 
+import argparse
+import hashlib
+import json
 import requests
 from bs4 import BeautifulSoup
 import re
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin, unquote
+from urllib3.util.retry import Retry
 import time
+from instrument import add_arguments, run, stage
+
+BASE_URL = 'https://legacy.winnipeg.ca'
+CLUSTERS_PATH = '/census/2021/Clusters/default.asp'
+BASE_DIR = 'winnipeg_census_2021'
+MANIFEST_NAME = 'manifest.json'
+
+
+class RateLimiter:
+    """Spaces out calls to wait() to at most `rate` per second, across all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class RateLimitedRetry(Retry):
+    """
+    A Retry that waits for a RateLimiter after its backoff, before every retried request. urllib3
+    retries requests inside session.get(), so the limiter is otherwise only applied to the first
+    attempt of each request.
+    """
+
+    def __init__(self, *args, limiter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+
+    def new(self, **kw):
+        # urllib3 creates a new Retry for every attempt
+        retry = super().new(**kw)
+        retry.limiter = self.limiter
+        return retry
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.limiter is not None:
+            self.limiter.wait()
 
-def download_excel_file(url, save_path):
-    """Download an Excel file from a given URL and save it to the specified path."""
+
+class Manifest:
+    """The ETag, Last-Modified and SHA-256 of every downloaded file, keyed by URL."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def get(self, url):
+        with self.lock:
+            return self.entries.get(url)
+
+    def set(self, url, entry):
+        with self.lock:
+            self.entries[url] = entry
+
+    def save(self):
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def make_session(pool_size, retries, limiter=None):
+    """
+    Create an HTTP session with a connection pool and retries with exponential backoff. Retried
+    requests wait for the limiter, if given.
+    """
+    retry = RateLimitedRetry(
+        total=retries,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET'],
+        respect_retry_after_header=True,
+        limiter=limiter,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def download_excel_file(session, limiter, manifest, url, save_path, force=False):
+    """
+    Download an Excel file from a given URL and save it to the specified path, unless it is
+    unchanged since the last download. Returns "downloaded", "unchanged" or "failed".
+    """
     try:
-        response = requests.get(url)
+        headers = {}
+        entry = manifest.get(url)
+        if entry and os.path.exists(save_path) and not force:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        limiter.wait()
+        response = session.get(url, headers=headers, timeout=60)
+        if response.status_code == 304:
+            print(f"Unchanged: {save_path}")
+            return "unchanged"
         response.raise_for_status()
-        
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        new_entry = {
+            'path': save_path,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'sha256': digest,
+        }
+        if os.path.exists(save_path) and file_sha256(save_path) == digest:
+            manifest.set(url, new_entry)
+            print(f"Unchanged: {save_path}")
+            return "unchanged"
+
         # Ensure the directory exists
         os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        
-        with open(save_path, 'wb') as f:
+
+        # Write to a temporary file first so an interrupted download never leaves a partial file
+        tmp_path = save_path + '.part'
+        with open(tmp_path, 'wb') as f:
             f.write(response.content)
+        os.replace(tmp_path, save_path)
+        manifest.set(url, new_entry)
         print(f"Successfully downloaded: {save_path}")
-        return True
-        
+        return "downloaded"
+
     except Exception as e:
         print(f"Error downloading {url}: {str(e)}")
-        return False
+        return "failed"
+
 
 def extract_excel_links(html_content):
     """Extract Excel file URLs from JavaScript window.open() calls in HTML."""
@@ -46,68 +201,116 @@ def extract_excel_links(html_content):
     matches = re.findall(pattern, html_content)
     return matches
 
+
 def sanitize_path(path):
     """Convert a URL path component into a safe directory name."""
     # Remove any illegal filename characters
     return re.sub(r'[<>:"/\\|?*]', '_', path)
 
-def main():
-    # Base URLs
-    clusters_url = 'https://legacy.winnipeg.ca/census/2021/Clusters/default.asp'
-    base_url = 'https://legacy.winnipeg.ca'
-    
+
+def fetch_cluster_links(session, limiter, clusters_url, base_url):
+    """Return the URLs of the cluster pages linked from the main clusters page."""
+    limiter.wait()
+    response = session.get(clusters_url, timeout=60)
+    response.raise_for_status()
+    soup = BeautifulSoup(response.text, 'html.parser')
+
+    cluster_links = []
+    for link in soup.find_all('a'):
+        href = link.get('href')
+        if href and 'Cluster' in href and href.endswith('.asp'):
+            full_url = urljoin(base_url, href)
+            cluster_links.append(full_url)
+    return cluster_links
+
+
+def fetch_excel_links(session, limiter, cluster_url):
+    """Return the Excel file links of a cluster page, or an empty list if it cannot be fetched."""
+    try:
+        print(f"Processing cluster: {cluster_url}")
+        limiter.wait()
+        response = session.get(cluster_url, timeout=60)
+        response.raise_for_status()
+        return extract_excel_links(response.text)
+    except Exception as e:
+        print(f"Error processing cluster {cluster_url}: {str(e)}")
+        return []
+
+
+def main(base_url=BASE_URL, base_dir=BASE_DIR, workers=4, rate=1.0, retries=3, force=False):
+    clusters_url = urljoin(base_url, CLUSTERS_PATH)
+
     # Create base directory for downloads
-    base_dir = 'winnipeg_census_2021'
     os.makedirs(base_dir, exist_ok=True)
-    
+    manifest = Manifest(os.path.join(base_dir, MANIFEST_NAME))
+    limiter = RateLimiter(rate)
+    session = make_session(workers, retries, limiter)
+
     try:
         # Get the main clusters page
-        response = requests.get(clusters_url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Find all cluster links
-        cluster_links = []
-        for link in soup.find_all('a'):
-            href = link.get('href')
-            if href and 'Cluster' in href and href.endswith('.asp'):
-                full_url = urljoin(base_url, href)
-                cluster_links.append(full_url)
-        
-        # Process each cluster
-        for cluster_url in cluster_links:
-            try:
-                print(f"\nProcessing cluster: {cluster_url}")
-                response = requests.get(cluster_url)
-                response.raise_for_status()
-                
-                # Extract Excel file links
-                excel_links = extract_excel_links(response.text)
-                
-                # Download each Excel file
-                for excel_link in excel_links:
-                    # Convert relative URL to absolute URL
-                    full_url = urljoin(base_url, excel_link)
-                    
-                    # Create a directory structure that matches the URL path
-                    # Decode URL-encoded characters and create safe directory names
-                    path_parts = unquote(excel_link).split('/')
-                    path_parts = [sanitize_path(part) for part in path_parts if part]
-                    
-                    # Join with the base directory
-                    save_path = os.path.join(base_dir, *path_parts)
-                    
-                    # Download the file
-                    if download_excel_file(full_url, save_path):
-                        # Be nice to the server
-                        time.sleep(1)
-                    
-            except Exception as e:
-                print(f"Error processing cluster {cluster_url}: {str(e)}")
-                continue
-                
+        with stage("clusters"):
+            cluster_links = fetch_cluster_links(session, limiter, clusters_url, base_url)
     except Exception as e:
         print(f"Error fetching clusters page: {str(e)}")
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Extract the Excel file links of every cluster
+        downloads = {}
+        with stage("links"):
+            cluster_excel_links = list(
+                executor.map(lambda url: fetch_excel_links(session, limiter, url), cluster_links)
+            )
+        for excel_links in cluster_excel_links:
+            for excel_link in excel_links:
+                # Convert relative URL to absolute URL
+                full_url = urljoin(base_url, excel_link)
+
+                # Create a directory structure that matches the URL path
+                # Decode URL-encoded characters and create safe directory names
+                path_parts = unquote(excel_link).split('/')
+                path_parts = [sanitize_path(part) for part in path_parts if part]
+
+                # Join with the base directory
+                downloads[full_url] = os.path.join(base_dir, *path_parts)
+
+        # Download each Excel file
+        try:
+            with stage("download"):
+                results = list(
+                    executor.map(
+                        lambda item: download_excel_file(
+                            session, limiter, manifest, item[0], item[1], force
+                        ),
+                        downloads.items(),
+                    )
+                )
+        finally:
+            manifest.save()
+
+    print(
+        f"\n{results.count('downloaded')} downloaded, {results.count('unchanged')} unchanged, "
+        f"{results.count('failed')} failed."
+    )
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Download the Winnipeg Census 2021 neighbourhood Excel files."
+    )
+    parser.add_argument("--base-url", default=BASE_URL, help="Base URL of the census website")
+    parser.add_argument("--output-dir", default=BASE_DIR, help="Directory to download files to")
+    parser.add_argument("--workers", type=int, default=4, help="Number of download threads")
+    parser.add_argument(
+        "--rate", type=float, default=1.0, help="Maximum requests per second (0 for no limit)"
+    )
+    parser.add_argument(
+        "--retries", type=int, default=3, help="Retries for failed requests, with backoff"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Request every file again, ignoring the manifest"
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+    with run(args):
+        main(args.base_url, args.output_dir, args.workers, args.rate, args.retries, args.force)
@@ -0,0 +1,271 @@
+"""
+This module decodes the locations of service requests and aggregates them into a regular grid of
+square cells, so that maps can be drawn from a few thousand weighted cells instead of millions of
+individual points.
+
+Locations are stored in the Geometry column as WKT points, "POINT (longitude latitude)". They are
+decoded without regular expressions, with Arrow's vectorised string kernels: every string is
+checked for the fixed "POINT (" prefix and closing parenthesis, the text in between is sliced out
+and split at its space, and both halves are cast to floats. Strings that do not follow this
+layout, or whose coordinates are not valid longitudes and latitudes, are reported as malformed
+rather than silently dropped.
+
+Cells are square in metres: their height in degrees of latitude is fixed, and their width in
+degrees of longitude is widened by the cosine of the grid's reference latitude. Every point is
+assigned to the integer key of its cell, and the points of each cell are totalled with np.bincount.
+Each cell is drawn at its centre with the total as its weight. Coarser grids for lower zoom levels
+are built from the totals of the occupied cells, without going back to the points.
+
+The cell size for a map is derived from the zoom level it is viewed at, as a few screen pixels,
+which is well below the radius of a heatmap point and so does not change how the heatmap looks.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Ground resolution of a web map tile at zoom level 0 on the equator
+METRES_PER_PIXEL_AT_ZOOM_0 = 156543.03392
+METRES_PER_DEGREE_LATITUDE = 111_320.0
+
+POINT_PREFIX = "POINT ("
+POINT_SUFFIX = ")"
+
+
+def _to_float(text):
+    """Convert an Arrow array of numeric strings to float64, with NaN for invalid numbers."""
+    try:
+        return pc.cast(text, pa.float64()).to_numpy(zero_copy_only=False)
+    except pa.ArrowInvalid:
+        # Some strings are not numbers, which pandas can turn into NaN instead of failing
+        return pd.to_numeric(text.to_pandas(), errors="coerce").to_numpy(dtype=np.float64)
+
+
+def parse_points(geometry):
+    """
+    Decode WKT "POINT (longitude latitude)" strings. Returns (longitudes, latitudes, malformed):
+    float64 coordinate arrays, with NaN for missing and malformed geometries, and a boolean array
+    marking the geometries that are present but malformed.
+    """
+    strings = pa.array(pd.Series(geometry, dtype=object), type=pa.string(), from_pandas=True)
+    present = pc.is_valid(strings).to_numpy(zero_copy_only=False)
+
+    inner = pc.utf8_slice_codeunits(strings, len(POINT_PREFIX), -len(POINT_SUFFIX))
+    parts = pc.split_pattern(inner, " ")
+    well_formed = pc.and_(
+        pc.and_(pc.starts_with(strings, POINT_PREFIX), pc.ends_with(strings, POINT_SUFFIX)),
+        pc.equal(pc.list_value_length(parts), 2),
+    )
+    well_formed = pc.fill_null(well_formed, False).to_numpy(zero_copy_only=False)
+
+    longitudes = np.full(len(strings), np.nan)
+    latitudes = np.full(len(strings), np.nan)
+    parts = parts.filter(pa.array(well_formed))
+    longitudes[well_formed] = _to_float(pc.list_element(parts, 0))
+    latitudes[well_formed] = _to_float(pc.list_element(parts, 1))
+
+    with np.errstate(invalid="ignore"):
+        valid = (np.abs(longitudes) <= 180) & (np.abs(latitudes) <= 90)
+    longitudes[~valid] = np.nan
+    latitudes[~valid] = np.nan
+    return longitudes, latitudes, present & ~valid
+
+
+def metres_per_pixel(latitude, zoom):
+    """Return the ground distance (in metres) covered by one screen pixel at a zoom level."""
+    return METRES_PER_PIXEL_AT_ZOOM_0 * np.cos(np.radians(latitude)) / 2**zoom
+
+
+def cell_size_for_zoom(latitude, zoom, pixels=4):
+    """Return the cell size (in metres) that spans the given number of pixels at a zoom level."""
+    return metres_per_pixel(latitude, zoom) * pixels
+
+
+class Grid:
+    """
+    A grid of n_rows x n_columns cells of cell_height degrees of latitude by cell_width degrees of
+    longitude, starting at the south-west corner (south, west). Cells are numbered row by row from
+    the south-west corner.
+    """
+
+    def __init__(self, south, west, cell_height, cell_width, n_rows, n_columns):
+        self.south = south
+        self.west = west
+        self.cell_height = cell_height
+        self.cell_width = cell_width
+        self.n_rows = n_rows
+        self.n_columns = n_columns
+
+    @classmethod
+    def covering(cls, latitudes, longitudes, cell_size):
+        """Return a grid of square cells of cell_size metres covering every given point."""
+        if len(latitudes) == 0:
+            raise ValueError("Cannot build a grid without any points.")
+        south, north = float(np.min(latitudes)), float(np.max(latitudes))
+        west, east = float(np.min(longitudes)), float(np.max(longitudes))
+
+        cell_height = cell_size / METRES_PER_DEGREE_LATITUDE
+        cell_width = cell_height / np.cos(np.radians((south + north) / 2))
+        n_rows = int((north - south) // cell_height) + 1
+        n_columns = int((east - west) // cell_width) + 1
+        return cls(south, west, cell_height, cell_width, n_rows, n_columns)
+
+    @property
+    def n_cells(self):
+        return self.n_rows * self.n_columns
+
+    def cells(self, latitudes, longitudes):
+        """Return the int64 key of the cell containing each point."""
+        rows = np.floor((np.asarray(latitudes) - self.south) / self.cell_height).astype(np.int64)
+        columns = np.floor((np.asarray(longitudes) - self.west) / self.cell_width).astype(np.int64)
+        np.clip(rows, 0, self.n_rows - 1, out=rows)
+        np.clip(columns, 0, self.n_columns - 1, out=columns)
+        return rows * self.n_columns + columns
+
+    def centres(self, cells):
+        """Return the (latitudes, longitudes) of the centres of the given cells."""
+        rows, columns = np.divmod(np.asarray(cells, dtype=np.int64), self.n_columns)
+        latitudes = self.south + (rows + 0.5) * self.cell_height
+        longitudes = self.west + (columns + 0.5) * self.cell_width
+        return latitudes, longitudes
+
+    def coarsen(self, factor):
+        """Return the aligned grid with cells factor times larger in each direction."""
+        return Grid(
+            self.south,
+            self.west,
+            self.cell_height * factor,
+            self.cell_width * factor,
+            -(-self.n_rows // factor),
+            -(-self.n_columns // factor),
+        )
+
+    def coarse_cells(self, cells, factor):
+        """Return the keys of the cells of self.coarsen(factor) containing the given cells."""
+        rows, columns = np.divmod(np.asarray(cells, dtype=np.int64), self.n_columns)
+        return (rows // factor) * -(-self.n_columns // factor) + columns // factor
+
+
+def aggregate_cells(cells, weights=None):
+    """
+    Total the weights (1 per point by default) of the points in each cell. Returns the keys of the
+    occupied cells and their totals.
+    """
+    occupied, inverse = np.unique(cells, return_inverse=True)
+    totals = np.bincount(inverse, weights=weights, minlength=len(occupied))
+    return occupied, totals
+
+
+def heat_data(grid, cells, totals):
+    """Return the [latitude, longitude, weight] rows of the given cells, as expected by HeatMap."""
+    latitudes, longitudes = grid.centres(cells)
+    # Six decimal places locate a cell centre to within 0.1 m
+    return np.column_stack(
+        [np.round(latitudes, 6), np.round(longitudes, 6), totals]
+    ).tolist()
+
+
+def bin_points(latitudes, longitudes, cell_size, weights=None):
+    """
+    Aggregate points into a grid of cell_size metres. Returns (grid, cells, totals): the grid and
+    the keys and total weights of its occupied cells.
+    """
+    grid = Grid.covering(latitudes, longitudes, cell_size)
+    cells, totals = aggregate_cells(grid.cells(latitudes, longitudes), weights)
+    return grid, cells, totals
+
+
+def pyramid(grid, cells, totals, levels):
+    """
+    Build coarser versions of an aggregated grid, each with cells twice as large as the previous
+    one, by merging the totals of the occupied cells. Returns a list of levels + 1 (grid, cells,
+    totals) tuples, starting with the given grid.
+    """
+    layers = [(grid, cells, totals)]
+    for _ in range(levels):
+        coarse_cells = grid.coarse_cells(cells, 2)
+        grid = grid.coarsen(2)
+        cells, totals = aggregate_cells(coarse_cells, totals)
+        layers.append((grid, cells, totals))
+    return layers
+
+
+def _month_number(value):
+    """Return the number of months between January 1970 and the month of a date."""
+    return int(pd.Timestamp(value).to_datetime64().astype("datetime64[M]").astype(np.int64))
+
+
+class SpatialIndex:
+    """
+    Request counts for every (month, cell, type, ward) combination of a grid, sorted by month and
+    then by cell, so the heatmap of any subset of requests (e.g. one type, one ward or a range of
+    months) is totalled from the index instead of from the requests themselves.
+
+    Attributes:
+        grid: Grid of the cells.
+        months, cells, type_codes, ward_codes, counts: one entry per combination. Months are
+            numbered from January 1970 and codes index type_names and ward_names (-1 if missing).
+    """
+
+    def __init__(self, grid, months, cells, type_codes, ward_codes, counts, type_names, ward_names):
+        self.grid = grid
+        self.months = months
+        self.cells = cells
+        self.type_codes = type_codes
+        self.ward_codes = ward_codes
+        self.counts = counts
+        self.type_names = type_names
+        self.ward_names = ward_names
+
+    @classmethod
+    def build(cls, grid, latitudes, longitudes, dates, request_types, wards):
+        """Index requests given by their coordinates, open dates, types and wards."""
+        cells = grid.cells(latitudes, longitudes)
+        months = np.asarray(dates, dtype="datetime64[ns]").astype("datetime64[M]").astype(np.int64)
+        type_codes, type_names = pd.factorize(request_types, sort=True)
+        ward_codes, ward_names = pd.factorize(wards, sort=True)
+
+        keys = np.column_stack([months, cells, type_codes, ward_codes])
+        keys = keys[np.lexsort(keys.T[::-1])]
+        starts = np.flatnonzero(np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)])
+        counts = np.diff(np.r_[starts, len(keys)])
+        months, cells, type_codes, ward_codes = keys[starts].T
+        return cls(
+            grid,
+            months,
+            cells,
+            type_codes,
+            ward_codes,
+            counts,
+            pd.Index(np.asarray(type_names, dtype=object)),
+            pd.Index(np.asarray(ward_names, dtype=object)),
+        )
+
+    def month_range(self):
+        """Return every month (as a Period) from the first to the last month with requests."""
+        known = self.months[self.months != np.datetime64("NaT").astype(np.int64)]
+        first, last = known.min(), known.max()
+        return pd.period_range(
+            pd.Timestamp(np.datetime64(int(first), "M")),
+            pd.Timestamp(np.datetime64(int(last), "M")),
+            freq="M",
+        )
+
+    def query(self, request_type=None, ward=None, start=None, end=None):
+        """
+        Total the requests of a type and a ward (any type or ward if None), opened from the month
+        of start to the month of end (inclusive; unbounded if None). Returns the keys of the
+        occupied cells and their totals.
+        """
+        low = 0 if start is None else np.searchsorted(self.months, _month_number(start), "left")
+        high = len(self.months)
+        if end is not None:
+            high = np.searchsorted(self.months, _month_number(end), "right")
+
+        selected = np.ones(high - low, dtype=bool)
+        if request_type is not None:
+            selected &= self.type_codes[low:high] == self.type_names.get_loc(request_type)
+        if ward is not None:
+            selected &= self.ward_codes[low:high] == self.ward_names.get_loc(ward)
+        return aggregate_cells(self.cells[low:high][selected], self.counts[low:high][selected])
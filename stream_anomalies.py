@@ -0,0 +1,418 @@
+"""
+This script detects days with an anomalous total case duration while service requests are still
+arriving, as a streaming counterpart to count_anomaly_by_case_duration_mad.py.
+
+Requests are read one at a time from a CSV file with the 311 dataset's columns, either a file that
+is being appended to (with --follow, like `tail -f`) or standard input (with "-" as the file name),
+which lets any local queue or downloader pipe requests into it. Requests are expected to arrive
+roughly in Open Date order; requests for a day that has already been closed are counted as late
+and ignored.
+
+For every request type, the detector keeps:
+    - the running total case duration of the current day,
+    - a trailing moving average of the last --window daily totals (the trend),
+    - an exponentially weighted seasonal baseline for every day of the --period day cycle,
+    - a rolling window of the last --window residuals, kept sorted so the median and MAD of the
+      residuals can be found without re-sorting,
+so memory per type is bounded by the window and period lengths.
+
+As in the batch detector, a day is anomalous when its residual is more than 3 MADs away from the
+median residual, but only abnormally long durations (residual - median > 3 * MAD) are flagged. A
+type is flagged as soon as its running total for the day exceeds the threshold ("intraday"),
+without waiting for the day to end; days that only turn out to be anomalous once complete are
+flagged when the next day starts ("day-end"). Each type is flagged at most once per day.
+
+Sparse types have many days with the same residual (e.g. days without requests), so their MAD can
+be 0, which would make any deviation anomalous. The MAD is therefore floored at --min-mad hours and
+at MIN_MAD_SHARE of the type's trend, and a type is only flagged once its window holds at least
+--min-history days with requests. The expected total of a day is never below 0.
+
+Only closed service requests are scored, as a request's case duration is only known once it has
+been closed: requests without a Closed Date (still open) are skipped, like requests with a
+malformed date or a non-positive duration. The number of skipped requests of each kind is printed
+at the end.
+
+Usage:
+    python stream_anomalies.py <311_requests.csv | -> [--follow] [--period N] [--window N]
+        [--min-history N] [--min-mad H] [--alpha A]
+
+Output:
+    Alerts are printed and appended to './output/stream_alerts.csv'.
+"""
+
+import argparse
+import bisect
+import csv
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from instrument import add_arguments, configure, run, stage
+
+DATE_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+ALERTS_FILE = "./output/stream_alerts.csv"
+ALERT_FIELDS = [
+    "Request type",
+    "Date",
+    "Kind",
+    "Daily total case duration (hours)",
+    "Expected (hours)",
+    "Residual",
+    "Median residual",
+    "MAD",
+]
+# The MAD is at least this share of the trend, so sparse types with a MAD of 0 are not flagged for
+# any deviation
+MIN_MAD_SHARE = 0.1
+
+
+class RollingMedianMAD:
+    """
+    A fixed-size window of values kept in sorted order, giving the median in O(1) and the median
+    absolute deviation (MAD) in O(log^2 n), with O(n) memory.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.order = deque()
+        self.sorted_values = []
+
+    def __len__(self):
+        return len(self.sorted_values)
+
+    def add(self, value):
+        if len(self.order) == self.size:
+            oldest = self.order.popleft()
+            del self.sorted_values[bisect.bisect_left(self.sorted_values, oldest)]
+        self.order.append(value)
+        bisect.insort(self.sorted_values, value)
+
+    def median(self):
+        values = self.sorted_values
+        n = len(values)
+        middle = n // 2
+        if n % 2:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2
+
+    def _kth_deviation(self, median, split, k):
+        """
+        Return the k-th smallest (0-based) absolute deviation from the median. The deviations of
+        the values below the median (indices < split) and of the others are two sorted sequences,
+        so the k-th smallest of their union is found by binary search.
+        """
+        values = self.sorted_values
+        n_below = split
+        n_above = len(values) - split
+
+        def below(i):  # i-th smallest deviation among values below the median
+            return median - values[split - 1 - i]
+
+        def above(j):  # j-th smallest deviation among the other values
+            return values[split + j] - median
+
+        # Find how many of the k + 1 smallest deviations come from the values below the median
+        low, high = max(0, k + 1 - n_above), min(k + 1, n_below)
+        while low < high:
+            i = (low + high) // 2
+            j = k + 1 - i
+            if j > 0 and below(i) < above(j - 1):
+                low = i + 1
+            else:
+                high = i
+        i = low
+        j = k + 1 - i
+        candidates = []
+        if i > 0:
+            candidates.append(below(i - 1))
+        if j > 0:
+            candidates.append(above(j - 1))
+        return max(candidates)
+
+    def mad(self):
+        median = self.median()
+        n = len(self.sorted_values)
+        split = bisect.bisect_left(self.sorted_values, median)
+        middle = n // 2
+        if n % 2:
+            return self._kth_deviation(median, split, middle)
+        return (
+            self._kth_deviation(median, split, middle - 1)
+            + self._kth_deviation(median, split, middle)
+        ) / 2
+
+
+class TypeMonitor:
+    """Online daily aggregates, seasonal baseline and residual statistics for one request type."""
+
+    def __init__(self, request_type, period, window, min_history, min_mad, alpha):
+        self.request_type = request_type
+        self.period = period
+        self.min_history = min_history
+        self.min_mad = min_mad
+        self.alpha = alpha
+
+        self.current_day = None
+        self.current_total = 0.0
+        self.alerted = False
+
+        self.history = deque(maxlen=window)
+        self.history_total = 0.0
+        # Number of days in the history with at least one request
+        self.active_days = 0
+        self.seasonal = [0.0] * period
+        self.seasonal_seen = [False] * period
+        self.residuals = RollingMedianMAD(window)
+
+    def _warmed_up(self):
+        """
+        Whether the type has enough history to be flagged: min_history residuals, and as many days
+        with requests, so sparse types are not flagged for every request of a quiet day.
+        """
+        return len(self.residuals) >= self.min_history and self.active_days >= self.min_history
+
+    def _expected(self, day):
+        """Return the (trend, seasonal) baseline for a day, or None during warm-up."""
+        if not self._warmed_up():
+            return None
+        trend = self.history_total / len(self.history)
+        return trend, self.seasonal[day.toordinal() % self.period]
+
+    @staticmethod
+    def _expected_total(trend, seasonal):
+        # A daily total is never negative, however low the seasonal effect of the day
+        return max(0.0, trend + seasonal)
+
+    def _mad(self, trend):
+        """Return the MAD of the residuals, floored for sparse types."""
+        return max(self.residuals.mad(), self.min_mad, MIN_MAD_SHARE * abs(trend))
+
+    def _alert(self, kind, day, total, baseline, residual, median, mad):
+        trend, seasonal = baseline
+        return {
+            "Request type": self.request_type,
+            "Date": day.isoformat(),
+            "Kind": kind,
+            "Daily total case duration (hours)": round(total, 2),
+            "Expected (hours)": round(self._expected_total(trend, seasonal), 2),
+            "Residual": round(residual, 2),
+            "Median residual": round(median, 2),
+            "MAD": round(mad, 2),
+        }
+
+    def _close_day(self, day, total):
+        """Fold a completed day into the baseline. Returns a day-end alert or None."""
+        alert = None
+        phase = day.toordinal() % self.period
+        if self.history:
+            trend = self.history_total / len(self.history)
+            residual = total - self._expected_total(trend, self.seasonal[phase])
+            if self._warmed_up():
+                median = self.residuals.median()
+                mad = self._mad(trend)
+                already_alerted = day == self.current_day and self.alerted
+                if total > 0 and residual - median > 3 * mad and not already_alerted:
+                    baseline = (trend, self.seasonal[phase])
+                    alert = self._alert("day-end", day, total, baseline, residual, median, mad)
+            self.residuals.add(residual)
+
+            # Exponentially weighted seasonal effect of this day of the cycle
+            detrended = total - trend
+            if self.seasonal_seen[phase]:
+                self.seasonal[phase] += self.alpha * (detrended - self.seasonal[phase])
+            else:
+                self.seasonal[phase] = detrended
+                self.seasonal_seen[phase] = True
+
+        if len(self.history) == self.history.maxlen:
+            self.history_total -= self.history[0]
+            self.active_days -= self.history[0] > 0
+        self.history.append(total)
+        self.history_total += total
+        self.active_days += total > 0
+        return alert
+
+    def advance_to(self, day):
+        """Close every day before the given day. Returns the day-end alerts raised."""
+        alerts = []
+        if self.current_day is None or day <= self.current_day:
+            return alerts
+
+        alert = self._close_day(self.current_day, self.current_total)
+        if alert:
+            alerts.append(alert)
+        # Days without any requests have a total case duration of 0
+        missing_day = self.current_day + timedelta(days=1)
+        while missing_day < day:
+            alert = self._close_day(missing_day, 0.0)
+            if alert:
+                alerts.append(alert)
+            missing_day += timedelta(days=1)
+
+        self.current_day = day
+        self.current_total = 0.0
+        self.alerted = False
+        return alerts
+
+    def add(self, day, duration):
+        """
+        Add a request opened on the given day. Returns (alerts, late), where late is True if the
+        day was already closed and the request was ignored.
+        """
+        if self.current_day is None:
+            self.current_day = day
+        if day < self.current_day:
+            return [], True
+
+        alerts = self.advance_to(day)
+        self.current_total += duration
+
+        baseline = self._expected(day)
+        if baseline is not None and not self.alerted:
+            residual = self.current_total - self._expected_total(*baseline)
+            median = self.residuals.median()
+            mad = self._mad(baseline[0])
+            if residual - median > 3 * mad:
+                self.alerted = True
+                alerts.append(
+                    self._alert(
+                        "intraday", day, self.current_total, baseline, residual, median, mad
+                    )
+                )
+        return alerts, False
+
+
+def follow_lines(f, follow, poll_interval=1.0):
+    """Yield complete lines from f, waiting for new lines at the end of the file with follow."""
+    pending = ""
+    while True:
+        line = f.readline()
+        if line:
+            pending += line
+            if pending.endswith("\n"):
+                yield pending
+                pending = ""
+            continue
+        if not follow:
+            if pending:
+                yield pending
+            return
+        time.sleep(poll_interval)
+
+
+class StreamDetector:
+    """Routes requests to a TypeMonitor per request type and closes days as time moves forward."""
+
+    def __init__(self, period, window, min_history, min_mad, alpha):
+        self.settings = (period, window, min_history, min_mad, alpha)
+        self.monitors = {}
+        self.latest_day = None
+        self.late_requests = 0
+        # Number of service requests skipped, by reason
+        self.skipped = {"open": 0, "malformed date": 0, "non-positive duration": 0}
+
+    def process(self, row):
+        """Process one request (a dict of CSV fields). Returns the alerts raised."""
+        if row.get("Subject") != "Service Request":
+            return []
+        if not row.get("Closed Date"):
+            # The case duration of open requests is not known yet
+            self.skipped["open"] += 1
+            return []
+        try:
+            opened = datetime.strptime(row["Open Date"], DATE_FORMAT)
+            closed = datetime.strptime(row["Closed Date"], DATE_FORMAT)
+        except (KeyError, TypeError, ValueError):
+            self.skipped["malformed date"] += 1
+            return []
+        duration = (closed - opened).total_seconds() / 3600
+        if duration <= 0:
+            self.skipped["non-positive duration"] += 1
+            return []
+
+        alerts = []
+        day = opened.date()
+        if self.latest_day is None or day > self.latest_day:
+            # Close the previous days of every type, so quiet types are evaluated too
+            self.latest_day = day
+            for monitor in self.monitors.values():
+                alerts.extend(monitor.advance_to(day))
+
+        request_type = row["Type"]
+        monitor = self.monitors.get(request_type)
+        if monitor is None:
+            monitor = TypeMonitor(request_type, *self.settings)
+            self.monitors[request_type] = monitor
+        type_alerts, late = monitor.add(day, duration)
+        if late:
+            self.late_requests += 1
+        alerts.extend(type_alerts)
+        return alerts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Detect anomalous daily total case durations as requests arrive."
+    )
+    parser.add_argument("csv_file", help='311 requests CSV file, or "-" for standard input')
+    parser.add_argument("--follow", action="store_true", help="Keep waiting for new requests")
+    parser.add_argument("--period", type=int, default=365, help="Seasonal cycle length in days")
+    parser.add_argument("--window", type=int, default=365, help="Days in the rolling windows")
+    parser.add_argument(
+        "--min-history",
+        type=int,
+        default=60,
+        help="Days (and days with requests) needed in the window before flagging anomalies",
+    )
+    parser.add_argument(
+        "--min-mad", type=float, default=1.0, help="Smallest MAD used for flagging, in hours"
+    )
+    parser.add_argument("--alpha", type=float, default=0.3, help="Seasonal baseline smoothing")
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+
+    detector = StreamDetector(
+        args.period, args.window, args.min_history, args.min_mad, args.alpha
+    )
+
+    os.makedirs(os.path.dirname(ALERTS_FILE), exist_ok=True)
+    write_header = not os.path.exists(ALERTS_FILE)
+    infile = sys.stdin if args.csv_file == "-" else open(args.csv_file, newline="")
+    n_requests = 0
+    n_alerts = 0
+    try:
+        with stage("stream"), open(ALERTS_FILE, "a", newline="") as alerts_file:
+            writer = csv.DictWriter(alerts_file, fieldnames=ALERT_FIELDS)
+            if write_header:
+                writer.writeheader()
+
+            for row in csv.DictReader(follow_lines(infile, args.follow)):
+                n_requests += 1
+                for alert in detector.process(row):
+                    n_alerts += 1
+                    print(
+                        f"[{alert['Kind']}] {alert['Date']} {alert['Request type']}: "
+                        f"{alert['Daily total case duration (hours)']} hours "
+                        f"(expected {alert['Expected (hours)']})"
+                    )
+                    writer.writerow(alert)
+                    alerts_file.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+
+    print(
+        f"Processed {n_requests} requests, raised {n_alerts} alerts "
+        f"({detector.late_requests} late requests ignored)."
+    )
+    skipped = ", ".join(f"{count} {reason}" for reason, count in detector.skipped.items())
+    print(f"Skipped service requests: {skipped}.")
+
+
+if __name__ == "__main__":
+    with run():
+        main()
@@ -1,60 +1,86 @@
-import pandas as pd
-import sys
-import matplotlib.pyplot as plt
+"""
+This script plots, for every service request type, the distribution of the daily number of
+requests, over the days with at least one request.
 
+The histograms are saved without opening any window (see distribution_plots.py), so a run over
+every type completes unattended. Use --show to display them one at a time instead.
 
-def main(dataset_csv):
+Usage:
+    python study_distribution_of_case_count_by_type.py <311_request_dataset.csv> [--output PATH]
+        [--workers N] [--show] [--no-cache]
+
+Where:
+    --output is a directory to save one image per type in, or a file ending with .pdf to save all
+    the histograms in ('./output/case_count_distributions' by default).
+    --workers is the number of worker processes rendering images (defaults to 1).
+
+Output:
+    './output/case_count_distributions/' - One histogram image per request type
+"""
+
+import argparse
+from daily_matrix import DailyMatrix
+from distribution_plots import save_histograms, show_histograms, type_histograms
+from ingest import add_cache_argument, load_dataset
+from instrument import add_arguments, run, stage
+
+OUTPUT = "./output/case_count_distributions"
+TITLE = "Distribution of Daily Number of Requests for {request_type}"
+XLABEL = "Number of Requests"
+
+
+def main(dataset_csv, output=OUTPUT, workers=1, show=False, use_cache=True):
     print("Loading data...")
-    df = pd.read_csv(dataset_csv)
+    # Only service requests are read from the dataset
+    df = load_dataset(
+        dataset_csv,
+        columns=["Type", "Open Date"],
+        filters={"Subject": "Service Request"},
+        use_cache=use_cache,
+    )
 
     # Drop any rows that don't have either an Open date
     df = df.dropna(subset=["Open Date"])
 
-    print("Filtering by service requests...")
-    df = df[df["Subject"] == "Service Request"]
-
-    print("Converting date columns to datetime...")
-    df["Open Date"] = pd.to_datetime(df["Open Date"], format="%m/%d/%Y %I:%M:%S %p")
-
-    print("Grouping by request type...")
-    grouped = df.groupby("Type")
-
-    total_groups = len(grouped)
-    current_group = 0
-
-    for request_type, group in grouped:
-        current_group += 1
-        print(f"Processing group {current_group} of {total_groups}...")
-
-        # Group by Open Date (day) and count the number of requests
-        group["Open Date (day)"] = group["Open Date"].dt.date
-        daily_totals = group.groupby("Open Date (day)").size()
-
-        # Sort daily totals in ascending order
-        daily_totals = daily_totals.sort_values(ascending=True).dropna()
-        print(daily_totals)
-
-        # Ensure min_requests and max_requests are not NaN
-        min_requests = daily_totals.min()
-        max_requests = daily_totals.max()
-        
-        # Calculate bin width with a check for potential division by zero
-        if max_requests > min_requests:
-            bin_width = (max_requests - min_requests) / max(1, len(daily_totals) - 1)
-            bins = max(10, int(bin_width))  # Ensure at least 10 bins
-        else:
-            bins = 10
-
-        plt.figure(figsize=(12, 6))
-        plt.hist(daily_totals, bins=bins, color="blue", alpha=0.7)
-        plt.title(f"Distribution of Daily Number of Requests for {request_type}")
-        plt.xlabel("Number of Requests")
-        plt.ylabel("Frequency")
-        plt.tight_layout()
-        plt.show()
+    print("Counting daily requests by request type...")
+    with stage("group"):
+        daily = DailyMatrix.from_frame(df)
+
+    print(f"Computing histograms of {len(daily.types)} request types...")
+    with stage("histograms"):
+        histograms = type_histograms(daily, kind="counts")
+
+    if show:
+        show_histograms(histograms, TITLE, XLABEL)
+    else:
+        print(f"Saving histograms to {output}...")
+        with stage("render"):
+            save_histograms(histograms, output, TITLE, XLABEL, workers=workers)
     print("Processing completed!")
 
 
 if __name__ == "__main__":
-    dataset_csv = sys.argv[1]
-    main(dataset_csv)
+    parser = argparse.ArgumentParser(
+        description="Plot the distribution of daily request counts for each request type."
+    )
+    parser.add_argument("dataset_csv", help="Path to the 311 dataset CSV file")
+    parser.add_argument(
+        "--output", default=OUTPUT, help="Directory for one image per type, or a .pdf file"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes rendering images"
+    )
+    parser.add_argument(
+        "--show", action="store_true", help="Display the histograms instead of saving them"
+    )
+    add_cache_argument(parser)
+    add_arguments(parser)
+    args = parser.parse_args()
+    with run(args):
+        main(
+            args.dataset_csv,
+            output=args.output,
+            workers=args.workers,
+            show=args.show,
+            use_cache=not args.no_cache,
+        )
@@ -1,22 +1,47 @@
-import pandas as pd
-import sys
-import matplotlib.pyplot as plt
+"""
+This script plots, for every service request type, the distribution of the daily total case
+duration (in hours), over the days with at least one closed request.
 
+The histograms are saved without opening any window (see distribution_plots.py), so a run over
+every type completes unattended. Use --show to display them one at a time instead.
 
-def main(dataset_csv):
+Usage:
+    python study_distribution_of_case_duration_by_type.py <311_request_dataset.csv>
+        [--output PATH] [--workers N] [--show] [--no-cache]
+
+Where:
+    --output is a directory to save one image per type in, or a file ending with .pdf to save all
+    the histograms in ('./output/case_duration_distributions' by default).
+    --workers is the number of worker processes rendering images (defaults to 1).
+
+Output:
+    './output/case_duration_distributions/' - One histogram image per request type
+"""
+
+import argparse
+from daily_matrix import DailyMatrix
+from distribution_plots import save_histograms, show_histograms, type_histograms
+from ingest import add_cache_argument, load_dataset
+from instrument import add_arguments, run, stage
+
+OUTPUT = "./output/case_duration_distributions"
+TITLE = "Distribution of Daily Total Case Durations for {request_type}"
+XLABEL = "Daily Total Case Duration (hours)"
+
+
+def main(dataset_csv, output=OUTPUT, workers=1, show=False, use_cache=True):
     print("Loading data...")
-    df = pd.read_csv(dataset_csv)
+    # Only service requests are read from the dataset
+    df = load_dataset(
+        dataset_csv,
+        columns=["Type", "Open Date", "Closed Date"],
+        filters={"Subject": "Service Request"},
+        use_cache=use_cache,
+    )
 
     # Drop any rows that don't have either an Open or Closed date
     df = df.dropna(subset=["Open Date", "Closed Date"])
 
-    print("Filtering by service requests...")
-    df = df[df["Subject"] == "Service Request"]
-
-    print("Converting date columns to datetime...")
-    df["Open Date"] = pd.to_datetime(df["Open Date"], format="%m/%d/%Y %I:%M:%S %p")
-    df["Closed Date"] = pd.to_datetime(df["Closed Date"], format="%m/%d/%Y %I:%M:%S %p")
-
     print("Calculating case durations...")
     df["Case Duration (hours)"] = (
         df["Closed Date"] - df["Open Date"]
@@ -25,45 +50,45 @@ def main(dataset_csv):
 
     df = df.dropna(subset=["Case Duration (hours)"])
 
-    print("Grouping by request type...")
-    grouped = df.groupby("Type")
-
-    total_groups = len(grouped)
-    current_group = 0
-
-    for request_type, group in grouped:
-        current_group += 1
-        print(f"Processing group {current_group} of {total_groups}...")
-
-        # Group by Open Date (day) and sum the case durations
-        group["Open Date (day)"] = group["Open Date"].dt.date
-        daily_totals = group.groupby("Open Date (day)")["Case Duration (hours)"].sum()
-
-        # Sort daily totals in ascending order
-        daily_totals = daily_totals.sort_values()
-        print(daily_totals)
-
-        # Ensure min_duration and max_duration are not NaN
-        min_duration = daily_totals.min()
-        max_duration = daily_totals.max()
-        
-        # Calculate bin width with a check for potential division by zero
-        if max_duration > min_duration:
-            bin_width = (max_duration - min_duration) / max(1, len(daily_totals) - 1)
-            bins = max(10, int(bin_width))  # Ensure at least 10 bins
-        else:
-            bins = 10
-
-        plt.figure(figsize=(12, 6))
-        plt.hist(daily_totals, bins=bins, color="blue", alpha=0.7)
-        plt.title(f"Distribution of Daily Total Case Durations for {request_type}")
-        plt.xlabel("Daily Total Case Duration (hours)")
-        plt.ylabel("Frequency")
-        plt.tight_layout()
-        plt.show()
+    print("Summing daily case durations by request type...")
+    with stage("group"):
+        daily = DailyMatrix.from_frame(df, value_column="Case Duration (hours)")
+
+    print(f"Computing histograms of {len(daily.types)} request types...")
+    with stage("histograms"):
+        histograms = type_histograms(daily, kind="sums")
+
+    if show:
+        show_histograms(histograms, TITLE, XLABEL)
+    else:
+        print(f"Saving histograms to {output}...")
+        with stage("render"):
+            save_histograms(histograms, output, TITLE, XLABEL, workers=workers)
     print("Processing completed!")
 
 
 if __name__ == "__main__":
-    dataset_csv = sys.argv[1]
-    main(dataset_csv)
+    parser = argparse.ArgumentParser(
+        description="Plot the distribution of daily total case durations for each request type."
+    )
+    parser.add_argument("dataset_csv", help="Path to the 311 dataset CSV file")
+    parser.add_argument(
+        "--output", default=OUTPUT, help="Directory for one image per type, or a .pdf file"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes rendering images"
+    )
+    parser.add_argument(
+        "--show", action="store_true", help="Display the histograms instead of saving them"
+    )
+    add_cache_argument(parser)
+    add_arguments(parser)
+    args = parser.parse_args()
+    with run(args):
+        main(
+            args.dataset_csv,
+            output=args.output,
+            workers=args.workers,
+            show=args.show,
+            use_cache=not args.no_cache,
+        )
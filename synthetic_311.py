@@ -0,0 +1,307 @@
+"""
+This script generates a synthetic dataset shaped like Winnipeg's 311 Service Request dataset, for
+testing and benchmarking the scripts at any scale without downloading the real dataset.
+
+Every row has the columns read by the scripts: Case ID, Subject, Reason, Type, Open Date, Closed
+Date, Ward, Neighbourhood and Geometry, with dates in the dataset's "%m/%d/%Y %I:%M:%S %p" format
+and locations as WKT points ("POINT (longitude latitude)"). The values follow the main features of
+the real data:
+    - request volumes grow over the years, peak in the summer and drop on weekends, with noise
+      from day to day, and requests are opened mostly during the day,
+    - request types, reasons and neighbourhoods are skewed (a few account for most requests),
+      and some types are seasonal (winter or summer),
+    - every type belongs to a reason and every neighbourhood to a ward,
+    - case durations are log-normally distributed, with a typical duration for every type,
+    - cases that would close after the end of the period are still open (no Closed Date), and a
+      few requests have no neighbourhood, no location, or a malformed location.
+Case IDs increase with the Open Date, as in the real dataset. The same seed and options always
+produce the same file.
+
+The file is written in chunks of days, so datasets of tens of millions of rows can be generated
+with bounded memory.
+
+Usage:
+    python synthetic_311.py <output_csv> [--rows N] [--start YYYY-MM-DD] [--years Y] [--seed S]
+
+    N accepts suffixes, e.g. 100k, 1M or 10M (100k by default).
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+
+COLUMNS = [
+    "Case ID",
+    "Subject",
+    "Reason",
+    "Type",
+    "Open Date",
+    "Closed Date",
+    "Ward",
+    "Neighbourhood",
+    "Geometry",
+]
+CHUNK_SIZE = 1_000_000
+
+N_REASONS = 25
+N_TYPES = 300
+N_NEIGHBOURHOODS = 236
+N_WARDS = 15
+# Share of the types with a winter or a summer peak
+SEASONAL_SHARE = 0.1
+SUBJECTS = {"Service Request": 0.88, "Information": 0.09, "Complaint": 0.02, "Compliment": 0.01}
+
+# Bounding box of the city (longitude, latitude)
+CITY_BOUNDS = ((-97.33, 49.77), (-96.96, 49.98))
+# Spread of request locations around their neighbourhood's centre, in degrees
+NEIGHBOURHOOD_SPREAD = 0.006
+
+ANNUAL_GROWTH = 0.04
+SUMMER_PEAK = 0.25
+WEEKDAY_WEIGHTS = np.array([1.15, 1.1, 1.05, 1.05, 1.0, 0.6, 0.5])
+# Shape of the gamma noise on daily volumes (lower is noisier)
+DAILY_NOISE_SHAPE = 25
+NO_NEIGHBOURHOOD_RATE = 0.01
+NO_GEOMETRY_RATE = 0.02
+MALFORMED_GEOMETRY_RATE = 0.001
+MISSING_CLOSED_DATE_RATE = 0.005
+
+ROW_SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+
+def row_count(value):
+    """Parse a number of rows, with an optional k or M suffix (e.g. 100k or 10M)."""
+    suffix = value[-1:].lower()
+    if suffix in ROW_SUFFIXES:
+        return int(float(value[:-1]) * ROW_SUFFIXES[suffix])
+    return int(value)
+
+
+def zipf_weights(n, exponent, rng):
+    """Return n probabilities decreasing as a power law, in a random order."""
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return rng.permutation(weights / weights.sum())
+
+
+class Vocabulary:
+    """The categories of the synthetic dataset and their relationships."""
+
+    def __init__(self, rng):
+        self.reasons = np.array([f"Reason {i:02d}" for i in range(1, N_REASONS + 1)], dtype=object)
+        self.types = np.array(
+            [f"Request Type {i:03d}" for i in range(1, N_TYPES + 1)], dtype=object
+        )
+        self.wards = np.array([f"Ward {i:02d}" for i in range(1, N_WARDS + 1)], dtype=object)
+        self.neighbourhoods = np.array(
+            [f"Neighbourhood {i:03d}" for i in range(1, N_NEIGHBOURHOODS + 1)], dtype=object
+        )
+
+        self.type_weights = zipf_weights(N_TYPES, 1.1, rng)
+        self.type_reasons = rng.choice(N_REASONS, N_TYPES, p=zipf_weights(N_REASONS, 0.8, rng))
+        # 1 for winter types, 2 for summer types, 0 for the others
+        self.type_seasons = rng.choice(
+            3, N_TYPES, p=[1 - SEASONAL_SHARE, SEASONAL_SHARE / 2, SEASONAL_SHARE / 2]
+        )
+        # Median case duration of every type, from a couple of hours to a few weeks
+        self.type_durations = np.exp(rng.uniform(np.log(2 * 3600), np.log(21 * 86400), N_TYPES))
+        self.type_duration_spread = rng.uniform(0.5, 1.5, N_TYPES)
+
+        self.neighbourhood_weights = zipf_weights(N_NEIGHBOURHOODS, 0.7, rng)
+        self.neighbourhood_wards = rng.integers(0, N_WARDS, N_NEIGHBOURHOODS)
+        (min_lon, min_lat), (max_lon, max_lat) = CITY_BOUNDS
+        self.neighbourhood_centres = np.column_stack(
+            [
+                rng.uniform(min_lon, max_lon, N_NEIGHBOURHOODS),
+                rng.uniform(min_lat, max_lat, N_NEIGHBOURHOODS),
+            ]
+        )
+
+    def monthly_type_cdfs(self):
+        """Return the cumulative type probabilities of every month (12 x N_TYPES)."""
+        months = np.arange(12)
+        winter = 1 + 3 * np.maximum(0, np.cos(2 * np.pi * months / 12))
+        summer = 1 + 3 * np.maximum(0, np.cos(2 * np.pi * (months - 6) / 12))
+        factors = np.ones((12, N_TYPES))
+        factors[:, self.type_seasons == 1] = winter[:, None]
+        factors[:, self.type_seasons == 2] = summer[:, None]
+        weights = self.type_weights * factors
+        return np.cumsum(weights / weights.sum(axis=1, keepdims=True), axis=1)
+
+
+def daily_counts(days, n_rows, rng):
+    """Split n_rows requests between the given days, following the growth and seasonality."""
+    years = (days - days[0]).days.to_numpy() / 365.25
+    seasonal = 1 + SUMMER_PEAK * np.cos(2 * np.pi * (days.dayofyear.to_numpy() - 196) / 365.25)
+    weights = (
+        (1 + ANNUAL_GROWTH) ** years
+        * seasonal
+        * WEEKDAY_WEIGHTS[days.dayofweek.to_numpy()]
+        * rng.gamma(DAILY_NOISE_SHAPE, 1 / DAILY_NOISE_SHAPE, len(days))
+    )
+    return rng.multinomial(n_rows, weights / weights.sum())
+
+
+def seconds_of_day(n, rng):
+    """Return the opening times of n requests, in seconds since midnight, mostly during the day."""
+    daytime = rng.normal(13 * 3600, 3.5 * 3600, n)
+    anytime = rng.uniform(0, 86400, n)
+    seconds = np.where(rng.random(n) < 0.9, daytime, anytime)
+    return np.clip(seconds, 0, 86399).astype(np.int64)
+
+
+class Calendar:
+    """
+    The days of the dataset, with lookup tables formatting timestamps (given as a day index and a
+    number of seconds since midnight) much faster than strftime.
+    """
+
+    def __init__(self, dates):
+        self.dates = dates
+        self.months = dates.month.to_numpy() - 1
+        self.day_strings = dates.strftime("%m/%d/%Y").to_numpy(dtype=object)
+        seconds = np.arange(86400)
+        hours, minutes, seconds = seconds // 3600, seconds // 60 % 60, seconds % 60
+        self.clock_strings = np.array(
+            [
+                f"{(h - 1) % 12 + 1:02d}:{m:02d}:{s:02d} {'AM' if h < 12 else 'PM'}"
+                for h, m, s in zip(hours, minutes, seconds)
+            ],
+            dtype=object,
+        )
+
+    def format(self, day_index, seconds):
+        """Format timestamps in the dataset's "%m/%d/%Y %I:%M:%S %p" format."""
+        return self.day_strings[day_index] + " " + self.clock_strings[seconds]
+
+
+def generate_chunk(days, counts, first_id, calendar, vocabulary, type_cdfs, rng):
+    """
+    Generate the requests opened on the given days (counts[i] on days[i], as indices into the
+    calendar), with Case IDs from first_id. Returns a DataFrame with the dataset's columns.
+    """
+    n = int(counts.sum())
+    day_index = np.repeat(days, counts)
+    open_seconds = seconds_of_day(n, rng)
+    order = np.lexsort((open_seconds, day_index))
+    day_index, open_seconds = day_index[order], open_seconds[order]
+
+    months = calendar.months[day_index]
+    types = np.empty(n, dtype=np.int64)
+    uniforms = rng.random(n)
+    for month in np.unique(months):
+        rows = months == month
+        types[rows] = np.minimum(
+            np.searchsorted(type_cdfs[month], uniforms[rows], side="right"), N_TYPES - 1
+        )
+
+    durations = rng.lognormal(
+        np.log(vocabulary.type_durations[types]), vocabulary.type_duration_spread[types]
+    ).astype(np.int64) + 60
+    closed = day_index * 86400 + open_seconds + durations
+    # Cases closing after the last day are still open when the dataset is extracted
+    is_closed = (closed < len(calendar.dates) * 86400) & (
+        rng.random(n) >= MISSING_CLOSED_DATE_RATE
+    )
+    closed_dates = np.full(n, "", dtype=object)
+    closed_dates[is_closed] = calendar.format(
+        closed[is_closed] // 86400, closed[is_closed] % 86400
+    )
+
+    neighbourhoods = rng.choice(N_NEIGHBOURHOODS, n, p=vocabulary.neighbourhood_weights)
+    centres = vocabulary.neighbourhood_centres[neighbourhoods]
+    points = centres + rng.normal(0, NEIGHBOURHOOD_SPREAD, (n, 2))
+    geometry = (
+        "POINT ("
+        + pd.Series(points[:, 0]).map("{:.6f}".format).to_numpy(dtype=object)
+        + " "
+        + pd.Series(points[:, 1]).map("{:.6f}".format).to_numpy(dtype=object)
+        + ")"
+    )
+    draws = rng.random(n)
+    geometry[draws < NO_GEOMETRY_RATE] = ""
+    geometry[(draws >= NO_GEOMETRY_RATE) & (draws < NO_GEOMETRY_RATE + MALFORMED_GEOMETRY_RATE)] = (
+        "POINT EMPTY"
+    )
+    neighbourhood_names = vocabulary.neighbourhoods[neighbourhoods]
+    neighbourhood_names[rng.random(n) < NO_NEIGHBOURHOOD_RATE] = ""
+
+    subjects = np.array(list(SUBJECTS), dtype=object)
+    return pd.DataFrame(
+        {
+            "Case ID": np.arange(first_id, first_id + n),
+            "Subject": subjects[rng.choice(len(subjects), n, p=list(SUBJECTS.values()))],
+            "Reason": vocabulary.reasons[vocabulary.type_reasons[types]],
+            "Type": vocabulary.types[types],
+            "Open Date": calendar.format(day_index, open_seconds),
+            "Closed Date": closed_dates,
+            "Ward": vocabulary.wards[vocabulary.neighbourhood_wards[neighbourhoods]],
+            "Neighbourhood": neighbourhood_names,
+            "Geometry": geometry,
+        },
+        columns=COLUMNS,
+    )
+
+
+def generate_dataset(output_csv, n_rows, start="2015-01-01", years=10, seed=0,
+                     chunk_size=CHUNK_SIZE):
+    """Write a synthetic dataset of n_rows requests opened over the given years to output_csv."""
+    rng = np.random.default_rng(seed)
+    vocabulary = Vocabulary(rng)
+    type_cdfs = vocabulary.monthly_type_cdfs()
+
+    calendar = Calendar(pd.date_range(start=start, periods=round(years * 365.25), freq="D"))
+    counts = daily_counts(calendar.dates, n_rows, rng)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_csv)), exist_ok=True)
+    # Chunks are runs of whole days of about chunk_size requests
+    boundaries = np.searchsorted(
+        np.cumsum(counts), np.arange(chunk_size, n_rows, chunk_size), side="left"
+    ) + 1
+    day_ranges = np.split(np.arange(len(calendar.dates)), np.unique(boundaries))
+    tmp_path = output_csv + ".tmp"
+    first_id = 1
+    with open(tmp_path, "w", newline="") as f:
+        f.write(",".join(COLUMNS) + "\n")
+        for days in day_ranges:
+            if len(days) == 0:
+                continue
+            chunk = generate_chunk(
+                days, counts[days], first_id, calendar, vocabulary, type_cdfs, rng
+            )
+            chunk.to_csv(f, header=False, index=False)
+            first_id += len(chunk)
+            print(f"\rGenerated {first_id - 1:,} / {n_rows:,} rows", end="", flush=True)
+    print()
+    os.replace(tmp_path, output_csv)
+    return first_id - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic dataset shaped like the 311 Service Request dataset."
+    )
+    parser.add_argument("output_csv", help="CSV file to write the dataset to")
+    parser.add_argument(
+        "--rows", type=row_count, default=100_000, help="Number of requests, e.g. 100k or 10M"
+    )
+    parser.add_argument("--start", default="2015-01-01", help="Day of the first request")
+    parser.add_argument(
+        "--years", type=float, default=10, help="Number of years the requests are spread over"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    n_rows = generate_dataset(
+        args.output_csv, args.rows, start=args.start, years=args.years, seed=args.seed
+    )
+    print(
+        f"Saved {n_rows:,} rows to {args.output_csv} "
+        f"in {time.perf_counter() - start_time:.1f} seconds"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Tests that loading the 311 dataset directly from the CSV file (--no-cache) returns the same data
+as loading it through the columnar cache, on a small synthetic dataset with malformed values.
+
+Usage:
+    python -m pytest test_ingest.py
+"""
+
+import pandas as pd
+import pytest
+
+import ingest
+from synthetic_311 import generate_dataset
+
+N_ROWS = 5000
+
+
+@pytest.fixture
+def dataset_csv(tmp_path, monkeypatch):
+    # The cache is written to ./output/cache
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "synthetic_311.csv"
+    generate_dataset(str(path), N_ROWS, years=1, seed=1)
+    df = pd.read_csv(path, dtype=str)
+    df.loc[3, "Case ID"] = None
+    df.loc[4, "Case ID"] = "not an ID"
+    df.loc[5, "Open Date"] = "not a date"
+    df.loc[6, "Geometry"] = "POINT (-97.1"
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.mark.parametrize(
+    "columns, filters",
+    [
+        (None, None),
+        (
+            ["Case ID", "Subject", "Type", "Open Date", "Closed Date"],
+            {"Subject": "Service Request"},
+        ),
+        (["Longitude", "Latitude", "Open Date", "Type", "Ward"], {"Subject": "Service Request"}),
+    ],
+)
+def test_csv_matches_cache(dataset_csv, columns, filters):
+    cached = ingest.load_dataset(dataset_csv, columns=columns, filters=filters)
+    direct = ingest.load_dataset(dataset_csv, columns=columns, filters=filters, use_cache=False)
+
+    pd.testing.assert_frame_equal(direct, cached)
+
+
+def test_chunks_match_cache(dataset_csv):
+    # A common and a rare type: most chunks of 700 rows have no requests of the rare type, and
+    # the categories of every chunk differ
+    columns = ["Case ID", "Type", "Ward", "Open Date", "Longitude"]
+    filters = {"Type": ["Request Type 081", "Request Type 050"]}
+    cached = ingest.load_dataset(dataset_csv, columns=columns, filters=filters)
+    direct = ingest.read_csv_filtered(dataset_csv, columns=columns, filters=filters, chunksize=700)
+
+    assert set(cached["Type"]) == set(filters["Type"])
+    pd.testing.assert_frame_equal(direct, cached)
+
+
+def test_malformed_values_are_missing(dataset_csv):
+    df = ingest.load_dataset(dataset_csv, use_cache=False)
+
+    assert df["Case ID"].dtype == "Int64"
+    assert df.loc[[3, 4], "Case ID"].isna().all()
+    assert pd.isna(df.loc[5, "Open Date"])
+    assert df.loc[6, ["Longitude", "Latitude"]].isna().all()
@@ -0,0 +1,166 @@
+"""
+Tests of scrape_census.py against a local HTTP server, which serves a clusters page, a cluster page
+and the workbooks it links to, with ETags, and can fail requests with 503 responses.
+
+Usage:
+    python -m pytest test_scrape_census.py
+"""
+
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import scrape_census
+
+CLUSTER_PATH = "/census/2021/Clusters/Cluster1.asp"
+WORKBOOKS = {
+    "/census/2021/Clusters/Cluster1/Fort%20Rouge.xlsx": os.path.join(
+        "census", "2021", "Clusters", "Cluster1", "Fort Rouge.xlsx"
+    ),
+    "/census/2021/Clusters/Cluster1/Osborne%20Village.xlsx": os.path.join(
+        "census", "2021", "Clusters", "Cluster1", "Osborne Village.xlsx"
+    ),
+}
+FORT_ROUGE, OSBORNE_VILLAGE = WORKBOOKS
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serves the pages of the server, answering conditional requests with 304 responses."""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            if server.failures.get(self.path, 0) > 0:
+                server.failures[self.path] -= 1
+                status = 503
+            elif self.path not in server.pages:
+                status = 404
+            elif self.headers.get("If-None-Match") == server.pages[self.path][1]:
+                status = 304
+            else:
+                status = 200
+            server.requests.append((self.path, status))
+            body, etag = server.pages.get(self.path, (b"", None))
+
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if status == 200:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def set_page(server, path, body):
+    with server.lock:
+        server.pages[path] = (body, f'"{len(server.requests)}-{hash(body)}"')
+
+
+def requests_to(server, path):
+    """Return the statuses of the requests made to path."""
+    with server.lock:
+        return [status for request_path, status in server.requests if request_path == path]
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    httpd.lock = threading.Lock()
+    httpd.pages = {}
+    httpd.failures = {}
+    httpd.requests = []
+    links = "".join(
+        f"<a href=\"javascript:void(window.open('{path}'))\">{path}</a>" for path in WORKBOOKS
+    )
+    set_page(httpd, scrape_census.CLUSTERS_PATH, f'<a href="{CLUSTER_PATH}">1</a>'.encode())
+    set_page(httpd, CLUSTER_PATH, links.encode())
+    for path in WORKBOOKS:
+        # The scraper does not open the workbooks, so any contents will do
+        set_page(httpd, path, f"workbook {path}".encode())
+
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def limiter_waits(monkeypatch):
+    """Count the calls to RateLimiter.wait()."""
+    waits = []
+    wait = scrape_census.RateLimiter.wait
+
+    def counting_wait(self):
+        waits.append(1)
+        wait(self)
+
+    monkeypatch.setattr(scrape_census.RateLimiter, "wait", counting_wait)
+    return waits
+
+
+def scrape(server, output_dir, retries=3):
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    scrape_census.main(base_url, str(output_dir), workers=2, rate=0, retries=retries)
+
+
+def read(output_dir, path):
+    with open(os.path.join(output_dir, WORKBOOKS[path]), "rb") as f:
+        return f.read()
+
+
+def test_downloads_workbooks_and_saves_etags(server, tmp_path):
+    scrape(server, tmp_path)
+
+    with open(tmp_path / scrape_census.MANIFEST_NAME, "r") as f:
+        manifest = json.load(f)
+    for path in WORKBOOKS:
+        assert read(tmp_path, path) == server.pages[path][0]
+        url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+        assert manifest[url]["etag"] == server.pages[path][1]
+
+
+def test_unchanged_workbooks_are_skipped(server, tmp_path, capsys):
+    scrape(server, tmp_path)
+    set_page(server, OSBORNE_VILLAGE, b"updated workbook")
+    capsys.readouterr()
+
+    scrape(server, tmp_path)
+
+    # The unchanged workbook is requested with its ETag and not downloaded again
+    assert requests_to(server, FORT_ROUGE) == [200, 304]
+    assert requests_to(server, OSBORNE_VILLAGE) == [200, 200]
+    assert read(tmp_path, OSBORNE_VILLAGE) == b"updated workbook"
+    assert "1 downloaded, 1 unchanged, 0 failed." in capsys.readouterr().out
+
+
+def test_failed_requests_are_retried_at_the_rate(server, tmp_path, limiter_waits):
+    server.failures[CLUSTER_PATH] = 1
+    server.failures[FORT_ROUGE] = 1
+
+    scrape(server, tmp_path)
+
+    assert requests_to(server, CLUSTER_PATH) == [503, 200]
+    assert requests_to(server, FORT_ROUGE) == [503, 200]
+    assert read(tmp_path, FORT_ROUGE) == server.pages[FORT_ROUGE][0]
+    # Every attempt, retries included, waits for the rate limiter
+    assert len(limiter_waits) == len(server.requests)
+
+
+def test_requests_fail_after_the_last_retry(server, tmp_path, capsys):
+    server.failures[FORT_ROUGE] = 5
+
+    scrape(server, tmp_path, retries=1)
+
+    assert requests_to(server, FORT_ROUGE) == [503, 503]
+    assert not os.path.exists(os.path.join(tmp_path, WORKBOOKS[FORT_ROUGE]))
+    assert "1 downloaded, 0 unchanged, 1 failed." in capsys.readouterr().out
@@ -1,72 +1,140 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import statsmodels.api as sm
+"""
+This script creates plots for two stages of detecting anomalous days with abnormally long service
+request durations for a request type ("Turn Off Water - Repairs Emergency" by default), as carried
+out for every request type by count_anomaly_by_case_duration_mad.py.
+
+The first plot shows the decomposition of the daily total case duration time series data into its
+components - seasonal, trend and residual. The second plot displays the daily total case durations
+with the anomalous days identified.
+
+The plots are drawn from the decompositions saved by count_anomaly_by_case_duration_mad.py
+('./output/anomaly_decompositions.npz'), so the 311 dataset is not read again; run it first.
+
+Usage:
+    python visualize_anomaly_detection.py [--type TYPE] [--store PATH] [--ymax Y] [--save]
+
+Where:
+    --ymax caps the y axis of the second plot (100000 hours by default).
+    --save saves the plots to './output' instead of displaying them.
+"""
+
+import argparse
+import os
+import re
 import sys
+import matplotlib.pyplot as plt
+from statsmodels.tsa.seasonal import DecomposeResult
+from decomposition_store import DECOMPOSITION_FILE, DecompositionStore
+from instrument import add_arguments, run, stage
 
+DEFAULT_TYPE = "Turn Off Water - Repairs Emergency"
+DEFAULT_YMAX = 100000
+OUTPUT_DIR = "./output"
 
-def main(dataset_csv):
-    # Input Data
-    df = pd.read_csv(dataset_csv)
-
-    # Convert dates and calculate case duration
-    df = df[df["Subject"] == "Service Request"]
-    df = df[df["Type"] == "Turn Off Water - Repairs Emergency"]
-    df = df.dropna(subset=['Open Date', 'Closed Date'])
-    df['Open Date'] = pd.to_datetime(df['Open Date'], format='%m/%d/%Y %I:%M:%S %p', errors='coerce')
-    df['Closed Date'] = pd.to_datetime(df['Closed Date'], format='%m/%d/%Y %I:%M:%S %p', errors='coerce')
-    df.sort_values(by='Open Date', inplace=True)
-    df['Case Duration (hours)'] = (df['Closed Date'] - df['Open Date']).dt.total_seconds() / 3600
-    df = df[df['Case Duration (hours)'] > 0]
-
-    df.set_index('Open Date', inplace=True)
-    daily_total_case_durations = df.groupby(df.index.date)["Case Duration (hours)"].sum()
-    # Fill missing days with 0 case durations
-    daily_total_case_durations = daily_total_case_durations.reindex(
-        pd.date_range(
-            start=daily_total_case_durations.index.min(),
-            end=daily_total_case_durations.index.max(),
-            freq="D",
-        ),
-        fill_value=0,
+
+def plot_decomposition(series):
+    """
+    Plot the observed, trend, seasonal and residual components of a decomposed series, as
+    statsmodels plots the result of seasonal_decompose.
+    """
+    decomposition = DecomposeResult(
+        observed=series["observed"].rename("Case Duration (hours)"),
+        seasonal=series["seasonal"].rename("seasonal"),
+        trend=series["trend"].rename("trend"),
+        resid=series["resid"].rename("resid"),
     )
+    return decomposition.plot()
+
 
-    decomposition = sm.tsa.seasonal_decompose(
-                daily_total_case_durations, model='additive', period=365
-            )
-    fig = decomposition.plot()
-    plt.show()
+def plot_anomalies(series, request_type, median, mad, threshold, ymax=DEFAULT_YMAX):
+    """Plot the daily total case durations, with the anomalous days in red."""
+    daily_total_case_durations = series["observed"]
+    residuals = series["resid"].dropna()
 
-    residuals = decomposition.resid.dropna()
+    # Identify anomalous points using the index of the residuals
+    anomaly_indices = residuals.index[residuals - median > 3 * mad]
+    anomalies = daily_total_case_durations.loc[anomaly_indices]
 
-    if not residuals.empty:
-        # Calculate the median and MAD of the residuals
-        median = residuals.median()
-        mad = (residuals - median).abs().median()
+    # Plot daily total case durations
+    fig = plt.figure(figsize=(15, 6))
+    plt.bar(
+        daily_total_case_durations.index,
+        daily_total_case_durations,
+        color='blue',
+        label=f'Daily Total Case Durations for "{request_type}" Service Requests',
+    )
+    plt.bar(anomalies.index, anomalies, color='red', label='Anomalies')
+
+    # Add a horizontal line for the anomaly threshold
+    plt.axhline(
+        y=threshold, color='green', linestyle='--', label=f'Anomaly Threshold ({threshold:.2f})'
+    )
 
-        # Identify anomalous points using the index of the residuals
-        anomaly_indices = residuals.index[residuals - median > 3 * mad]
-        anomalies = daily_total_case_durations.loc[anomaly_indices]
-        # Calculate the threshold above which a day is considered an anomaly
-        threshold = median + 3 * mad
+    # Add labels and legend
+    plt.title('Daily Total Case Durations with Anomalies')
+    plt.xlabel('Date')
+    plt.ylabel('Case Duration (hours)')
+    plt.legend()
 
-        # Plot daily total case durations
-        plt.figure(figsize=(15, 6))
-        plt.bar(daily_total_case_durations.index, daily_total_case_durations, color='blue', label='Daily Total Case Durations for "Turn Off Water - Repairs Emergency" Service Requests')
-        plt.bar(anomalies.index, anomalies, color='red', label='Anomalies')
+    plt.ylim(0, ymax)
+    return fig
 
-        # Add a horizontal line for the anomaly threshold
-        plt.axhline(y=threshold, color='green', linestyle='--', label=f'Anomaly Threshold ({threshold:.2f})')
 
-        # Add labels and legend
-        plt.title('Daily Total Case Durations with Anomalies')
-        plt.xlabel('Date')
-        plt.ylabel('Case Duration (hours)')
-        plt.legend()
+def main(request_type=DEFAULT_TYPE, store_file=DECOMPOSITION_FILE, ymax=DEFAULT_YMAX, save=False):
+    if not os.path.exists(store_file):
+        sys.exit(
+            f"No decompositions found at {store_file}; "
+            "run count_anomaly_by_case_duration_mad.py first."
+        )
+    with stage("load"):
+        store = DecompositionStore.load(store_file)
+    if request_type not in store.types:
+        sys.exit(
+            f"No decomposition stored for {request_type!r} (data version {store.version}). "
+            "Only types with at least two years of data are analysed."
+        )
 
-        plt.ylim(0, 100000)
+    i = store.types.get_loc(request_type)
+    series = store.series(request_type)
+    print(f"Plotting {request_type} (data version {store.version})...")
 
+    with stage("plot"):
+        decomposition_fig = plot_decomposition(series)
+        anomalies_fig = plot_anomalies(
+            series, request_type, store.median[i], store.mad[i], store.thresholds[i], ymax
+        )
+
+    if save:
+        name = re.sub(r"[^\w\-]+", "_", request_type).strip("_")
+        for fig, kind in [(decomposition_fig, "decomposition"), (anomalies_fig, "anomalies")]:
+            path = os.path.join(OUTPUT_DIR, f"{kind}_{name}.png")
+            with stage("write"):
+                fig.savefig(path)
+            print(f"Saved {path}")
+    else:
         plt.show()
 
+
 if __name__ == "__main__":
-    dataset_csv = sys.argv[1]
-    main(dataset_csv)
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Plot the decomposition and anomalous days of a request type."
+    )
+    parser.add_argument("--type", default=DEFAULT_TYPE, help="Request type to plot")
+    parser.add_argument(
+        "--store",
+        default=DECOMPOSITION_FILE,
+        help="Decompositions saved by count_anomaly_by_case_duration_mad.py",
+    )
+    parser.add_argument(
+        "--ymax",
+        type=float,
+        default=DEFAULT_YMAX,
+        help="Upper limit of the anomalies plot's y axis",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Save the plots to ./output instead of showing them"
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+    with run(args):
+        main(args.type, args.store, args.ymax, args.save)